@@ -1,15 +1,17 @@
+import json
 import os
-from flask import Flask, request, jsonify
+from functools import wraps
+from itertools import islice
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from flask_restx import Api, Resource, fields
+import banking
+import fastpath
+import metrics
+from banking import (BATCH_MAX_OPERATIONS, BATCH_MODES, accounts, account_locks,
+                     apply_operations, validate_operations)
 
 
-# Dictionary to store account information with account numbers as keys
-accounts = {
-    "1001": {"balance": 500.0},
-    "1002": {"balance": 1000.0},
-    "1003": {"balance": 750.0}
-}
 # Initialize Flask application
 app = Flask(__name__)
 CORS(app)
@@ -25,7 +27,7 @@ api = Api(
 )
 app.config["SWAGGER_UI_DOC_EXPANSION"] = "list"
 app.config['ERROR_404_HELP'] = False
-app.config['SERVER_NAME'] = 'atm-api-435429241525.us-central1.run.app'
+app.config['SERVER_NAME'] = banking.SERVER_NAME
 app.config['PREFERRED_URL_SCHEME'] = 'https'
 # Create namespace for account-related operations
 accounts_ns = api.namespace('accounts', description='Account management operations')
@@ -58,90 +60,477 @@ not_found_error_model = api.model('NotFoundError', {
 bad_request_error_model = api.model('BadRequestError', {
     'error': fields.String(required=True, description='Error message', example='Deposit amount must be a positive number')
 })
+# Model for 429 rate limit error
+rate_limit_error_model = api.model('RateLimitError', {
+    'error': fields.String(required=True, description='Error message', example='Too many requests for account 1001')
+})
 # Model for 400 insufficient funds error
 insufficient_funds_error_model = api.model('InsufficientFundsError', {
     'error': fields.String(required=True, description='Error message', example='Insufficient funds. Current balance: $500.0, Requested: $600.0')
 })
+# Model for 401 and 403 errors of the bulk import and export routes
+admin_error_model = api.model('AdminError', {
+    'error': fields.String(required=True, description='Error message', example='Missing or wrong admin token')
+})
+# Header carrying the admin token the bulk import and export routes require
+admin_token_param = {'Authorization': {'in': 'header', 'type': 'string', 'required': True,
+                                       'description': "'Bearer ' followed by the ATM_ADMIN_TOKEN of the server"}}
+# Optional header making deposit and withdraw retries safe
+idempotency_key_param = {'Idempotency-Key': {'in': 'header', 'type': 'string',
+                                             'description': 'Unique key per transaction; retries with the same key are not applied again'}}
+# Conditional request headers taking the ETag of a balance
+if_none_match_param = {'If-None-Match': {'in': 'header', 'type': 'string',
+                                         'description': 'ETag of a balance already held; answered with 304 while unchanged'}}
+if_match_param = {'If-Match': {'in': 'header', 'type': 'string',
+                               'description': 'ETag the account must still be at for the transaction to apply'}}
+# Models for transfers between accounts
+transfer_request = api.model('TransferRequest', {
+    'to_account': fields.String(required=True, description='Destination account number', example='1002'),
+    'amount': fields.Float(required=True, description='Transfer amount', example=100.0, min=0.01)
+})
+transfer_response = api.model('TransferResponse', {
+    'message': fields.String(required=True, description='Transaction status message',
+                           example='Transfer successful. $100.0 moved from account 1001 to account 1002'),
+    'balance': fields.Float(required=True, description='Updated source account balance', example=400.0),
+    'to_balance': fields.Float(required=True, description='Updated destination account balance', example=1100.0)
+})
+# Models for bulk balance lookups
+bulk_balance_request = api.model('BulkBalanceRequest', {
+    'account_numbers': fields.List(fields.String, required=True, description='Account numbers to look up',
+                                   example=['1001', '1002', '9999'])
+})
+bulk_balance = api.model('BulkBalance', {
+    'account_number': fields.String(description='Account number', example='1001'),
+    'balance': fields.Float(description='Current balance, if the account exists', example=500.0),
+    'error': fields.String(description='Why there is no balance, e.g. Account not found')
+})
+# Models for balance statistics
+balance_stats_model = api.model('BalanceStats', {
+    'accounts': fields.Integer(description='Number of accounts', example=3),
+    'total': fields.Float(description='Sum of all balances', example=2250.0),
+    'mean': fields.Float(description='Mean balance, null without accounts', example=750.0),
+    'min': fields.Float(description='Smallest balance', example=500.0),
+    'median': fields.Float(description='Median balance', example=750.0),
+    'max': fields.Float(description='Largest balance', example=1000.0),
+    'below': fields.Float(description='The below query parameter, if given', example=800.0),
+    'accounts_below': fields.Integer(description='Accounts with a balance under below, if given', example=2)
+})
+top_balances_model = api.model('TopBalances', {
+    'accounts': fields.List(fields.Nested(balance_model), description='Largest balances first')
+})
+# Models for bulk account import
+import_error = api.model('ImportError', {
+    'row': fields.Integer(description='Record number in the upload, 1-based, header excluded', example=3),
+    'error': fields.String(description='Why the record was skipped', example='Balance must be a number between 0 and 92233720368547758')
+})
+import_response = api.model('ImportResponse', {
+    'imported': fields.Integer(description='Records applied', example=9999),
+    'created': fields.Integer(description='Accounts created', example=9990),
+    'updated': fields.Integer(description='Records overwriting an existing balance', example=9),
+    'failed': fields.Integer(description='Records skipped as invalid', example=1),
+    'errors': fields.List(fields.Nested(import_error),
+                          description=f'The first {banking.IMPORT_MAX_ERRORS} skipped records')
+})
+# Models for batch transactions
+batch_operation = api.model('BatchOperation', {
+    'account_number': fields.String(required=True, description='Account number', example='1001'),
+    'type': fields.String(required=True, description='Operation type', enum=['deposit', 'withdraw'], example='deposit'),
+    'amount': fields.Float(required=True, description='Transaction amount', example=100.0, min=0.01)
+})
+batch_request = api.model('BatchRequest', {
+    'mode': fields.String(description='atomic applies all operations or none; independent applies each valid operation',
+                          enum=list(BATCH_MODES), default='atomic'),
+    'operations': fields.List(fields.Nested(batch_operation), required=True, description='Operations in order')
+})
+batch_result = api.model('BatchResult', {
+    'account_number': fields.String(description='Account number', example='1001'),
+    'type': fields.String(description='Operation type', example='deposit'),
+    'status': fields.Integer(description='Status the single-operation endpoint would return', example=200),
+    'amount': fields.Float(description='Applied amount', example=100.0),
+    'balance': fields.Float(description='Balance after this operation', example=600.0),
+    'error': fields.String(description='Error message for failed operations')
+})
+batch_response = api.model('BatchResponse', {
+    'mode': fields.String(description='Batch mode used', example='atomic'),
+    'applied': fields.Integer(description='Number of operations applied', example=1),
+    'failed': fields.Integer(description='Number of operations rejected', example=0),
+    'results': fields.List(fields.Nested(batch_result), description='Per-operation results in request order')
+})
+# Models for transaction history
+transaction_model = api.model('Transaction', {
+    'id': fields.Integer(description='Per-account transaction id, increasing over time', example=7),
+    'timestamp': fields.String(description='When the transaction was applied (ISO 8601, UTC)',
+                               example='2024-01-01T12:00:00.000000+00:00'),
+    'type': fields.String(description='Transaction type', enum=['deposit', 'withdraw', 'transfer_out', 'transfer_in'],
+                          example='deposit'),
+    'amount': fields.Float(description='Transaction amount', example=100.0),
+    'balance': fields.Float(description='Balance after the transaction', example=600.0)
+})
+transaction_page = api.model('TransactionPage', {
+    'account_number': fields.String(description='Account number', example='1001'),
+    'transactions': fields.List(fields.Nested(transaction_model), description='Transactions, newest first'),
+    'next_cursor': fields.Integer(description='Cursor for the next (older) page, null on the last page', example=5)
+})
+# Lines buffered into each chunk of a streamed response
+STREAM_CHUNK_LINES = 512
+def stream_json(items, output):
+    """Stream dicts as NDJSON or as a JSON array, one chunk of lines at a time"""
+    def chunks():
+        lines = []
+        separator = '' if output == 'ndjson' else '['
+        for item in items:
+            lines.append(separator + json.dumps(item))
+            if output == 'json':
+                separator = ',\n'
+            if len(lines) == STREAM_CHUNK_LINES:
+                yield ''.join(lines) if output == 'json' else '\n'.join(lines) + '\n'
+                lines = []
+        if output == 'json':
+            yield ''.join(lines) + ('[]\n' if separator == '[' else ']\n')
+        elif lines:
+            yield '\n'.join(lines) + '\n'
+    mimetype = 'application/x-ndjson' if output == 'ndjson' else 'application/json'
+    return Response(stream_with_context(chunks()), mimetype=mimetype)
+def iter_lines(stream, block_size=64 * 1024):
+    """Yield the stripped, non-empty lines of a request body, reading it in fixed-size blocks"""
+    rest = b''
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        lines = (rest + block).split(b'\n')
+        rest = lines.pop()
+        for line in lines:
+            line = line.strip()
+            if line:
+                yield line.decode('utf-8', 'replace')
+    rest = rest.strip()
+    if rest:
+        yield rest.decode('utf-8', 'replace')
+def instrumented(route):
+    """Resource method_decorators recording per-route request metrics"""
+    return [] if banking.metrics is None else [banking.metrics.instrument(route)]
+def rate_limited():
+    """Resource method_decorators answering 429 once the client or account is over its rate limit"""
+    def decorator(handler):
+        @wraps(handler)
+        def limited(*args, **kwargs):
+            if banking.client_limiter is None and banking.account_limiter is None:
+                return handler(*args, **kwargs)
+            client = banking.client_identity(request.remote_addr, request.headers.get('X-Forwarded-For'))
+            throttled = banking.check_rate_limit(kwargs.get('account_number'), client)
+            if throttled is not None:
+                return throttled
+            return handler(*args, **kwargs)
+        return limited
+    return [decorator]
+def admin_only():
+    """Resource method_decorators answering 401 or 403 unless the request holds the admin token"""
+    def decorator(handler):
+        @wraps(handler)
+        def checked(*args, **kwargs):
+            refused = banking.check_admin(request.headers.get('Authorization'))
+            if refused is not None:
+                return refused
+            return handler(*args, **kwargs)
+        return checked
+    return [decorator]
 @accounts_ns.route('/<string:account_number>/balance')
+@accounts_ns.response(429, 'Too many requests - Rate limit exceeded', rate_limit_error_model)
 @accounts_ns.param('account_number', 'The account number (1001, 1002, or 1003)')
 class AccountBalance(Resource):
+    method_decorators = rate_limited() + instrumented('balance')
     @accounts_ns.doc('get_balance')
+    @accounts_ns.doc(params=if_none_match_param)
     @accounts_ns.response(200, 'Success', balance_model)
+    @accounts_ns.response(304, 'Not modified - Balance still matches If-None-Match')
     @accounts_ns.response(404, 'Account not found', not_found_error_model)
     def get(self, account_number):
         """Get account balance
 
         Retrieve the current balance for the specified account number.
         Available accounts: 1001, 1002, 1003
+        The response carries an ETag; polling with it in If-None-Match gets
+        an empty 304 until the balance changes.
         """
-        if account_number not in accounts:
-            return {"error": "Account not found"}, 404
-
-        return {
-            'account_number': account_number,
-            'balance': accounts[account_number]['balance']
-        }
+        return banking.get_balance(account_number, request.headers.get('If-None-Match'))
 @accounts_ns.route('/<string:account_number>/deposit')
+@accounts_ns.response(429, 'Too many requests - Rate limit exceeded', rate_limit_error_model)
 @accounts_ns.param('account_number', 'The account number (1001, 1002, or 1003)')
 class AccountDeposit(Resource):
+    method_decorators = rate_limited() + instrumented('deposit')
     @accounts_ns.doc('deposit_money')
     @accounts_ns.expect(transaction_request, validate=False)
+    @accounts_ns.doc(params={**idempotency_key_param, **if_match_param})
     @accounts_ns.response(200, 'Success', deposit_response)
     @accounts_ns.response(400, 'Bad request - Invalid amount', bad_request_error_model)
     @accounts_ns.response(404, 'Account not found', not_found_error_model)
+    @accounts_ns.response(412, 'Account changed since the If-Match ETag', bad_request_error_model)
+    @accounts_ns.response(422, 'Idempotency-Key reused for a different request', bad_request_error_model)
     def post(self, account_number):
         """Deposit money to account
 
         Add money to the specified account. The amount must be positive.
         The response includes a success message and the updated balance.
+        Retries sent with the same Idempotency-Key header get the original
+        response back instead of depositing again. With an If-Match header
+        the deposit is only made while the balance still has that ETag.
         """
-        if account_number not in accounts:
-            return {"error": "Account not found"}, 404
-        data = request.get_json()
-        if not data or 'amount' not in data:
-            return {"error": "Amount is required"}, 400
-        amount = data.get('amount', 0)
-        if not isinstance(amount, (int, float)) or amount <= 0:
-            return {"error": "Deposit amount must be a positive number"}, 400
-        # Round to 2 decimal places for currency
-        amount = round(float(amount), 2)
-        accounts[account_number]['balance'] = round(accounts[account_number]['balance'] + amount, 2)
-        return {
-            'message': f'Deposit successful. ${amount} added to account {account_number}',
-            'balance': accounts[account_number]['balance']
-        }
+        return banking.idempotent(request.headers.get('Idempotency-Key'), 'deposit', account_number,
+                                  request.get_data(),
+                                  lambda: banking.deposit(account_number, request.get_json,
+                                                          request.headers.get('If-Match')))
 @accounts_ns.route('/<string:account_number>/withdraw')
+@accounts_ns.response(429, 'Too many requests - Rate limit exceeded', rate_limit_error_model)
 @accounts_ns.param('account_number', 'The account number (1001, 1002, or 1003)')
 class AccountWithdraw(Resource):
+    method_decorators = rate_limited() + instrumented('withdraw')
     @accounts_ns.doc('withdraw_money')
     @accounts_ns.expect(transaction_request, validate=False)
+    @accounts_ns.doc(params={**idempotency_key_param, **if_match_param})
     @accounts_ns.response(200, 'Success', withdraw_response)
     @accounts_ns.response(400, 'Bad request - Invalid amount or insufficient funds', insufficient_funds_error_model)
     @accounts_ns.response(404, 'Account not found', not_found_error_model)
+    @accounts_ns.response(412, 'Account changed since the If-Match ETag', bad_request_error_model)
+    @accounts_ns.response(422, 'Idempotency-Key reused for a different request', bad_request_error_model)
     def post(self, account_number):
         """Withdraw money from account
 
         Remove money from the specified account. The amount must be positive
-        and not exceed the current account balance.
+        and not exceed the current account balance. Retries sent with the same
+        Idempotency-Key header get the original response back. With an
+        If-Match header the withdrawal is only made while the balance still
+        has that ETag.
+        """
+        return banking.idempotent(request.headers.get('Idempotency-Key'), 'withdraw', account_number,
+                                  request.get_data(),
+                                  lambda: banking.withdraw(account_number, request.get_json,
+                                                           request.headers.get('If-Match')))
+@accounts_ns.route('/<string:account_number>/transfer')
+@accounts_ns.response(429, 'Too many requests - Rate limit exceeded', rate_limit_error_model)
+@accounts_ns.param('account_number', 'The source account number (1001, 1002, or 1003)')
+class AccountTransfer(Resource):
+    method_decorators = rate_limited() + instrumented('transfer')
+    @accounts_ns.doc('transfer_money')
+    @accounts_ns.expect(transfer_request, validate=False)
+    @accounts_ns.response(200, 'Success', transfer_response)
+    @accounts_ns.response(400, 'Bad request - Invalid amount, destination or insufficient funds', insufficient_funds_error_model)
+    @accounts_ns.response(404, 'Source or destination account not found', not_found_error_model)
+    def post(self, account_number):
+        """Transfer money to another account
+
+        Debit the specified account and credit the destination account in a
+        single atomic step. The amount must be positive and not exceed the
+        source account balance.
+        """
+        return banking.transfer(account_number, request.get_json)
+@accounts_ns.route('/<string:account_number>/transactions')
+@accounts_ns.response(429, 'Too many requests - Rate limit exceeded', rate_limit_error_model)
+@accounts_ns.param('account_number', 'The account number (1001, 1002, or 1003)')
+@accounts_ns.param('limit', f'Transactions per page (1-{banking.HISTORY_MAX_LIMIT}, default {banking.HISTORY_DEFAULT_LIMIT})',
+                   type=int)
+@accounts_ns.param('cursor', 'next_cursor of the previous page', type=int)
+@accounts_ns.param('format', "'ndjson' streams one transaction per line instead of a JSON page",
+                   enum=['json', 'ndjson'])
+class AccountTransactions(Resource):
+    method_decorators = rate_limited() + instrumented('transactions')
+    @accounts_ns.doc('list_transactions')
+    @accounts_ns.response(200, 'Success', transaction_page)
+    @accounts_ns.response(400, 'Bad request - Invalid limit, cursor or format', bad_request_error_model)
+    @accounts_ns.response(404, 'Account not found', not_found_error_model)
+    def get(self, account_number):
+        """Get recent transactions of an account
+
+        Returns the most recent transactions first, one page at a time; pass
+        next_cursor back as cursor to fetch older ones. Only the most recent
+        transactions of each account are retained. With format=ndjson every
+        retained transaction older than the cursor is streamed instead.
         """
+        output = request.args.get('format', 'json')
+        if output not in ('json', 'ndjson'):
+            return {"error": "Format must be 'json' or 'ndjson'"}, 400
+        limit, cursor, error = banking.parse_history_query(request.args, stream=output == 'ndjson')
+        if error:
+            return {"error": error}, 400
+        if output == 'json':
+            return banking.list_transactions(account_number, limit, cursor)
         if account_number not in accounts:
             return {"error": "Account not found"}, 404
+        # Records are read from the ring buffer as the response is written
+        return stream_json(islice(banking.iter_transactions(account_number, cursor), limit), 'ndjson')
+@accounts_ns.route('/balances')
+@accounts_ns.response(429, 'Too many requests - Rate limit exceeded', rate_limit_error_model)
+class AccountBalances(Resource):
+    method_decorators = rate_limited() + instrumented('balances')
+    @accounts_ns.doc('get_balances')
+    @accounts_ns.param('ids', 'Comma-separated account numbers', required=True)
+    @accounts_ns.param('format', "'json' streams a JSON array, 'ndjson' one balance per line",
+                       enum=['json', 'ndjson'])
+    @accounts_ns.response(200, 'Success', [bulk_balance])
+    @accounts_ns.response(400, 'Bad request - Missing ids or invalid format', bad_request_error_model)
+    def get(self):
+        """Get the balances of several accounts
+
+        Streams one result per requested account, in request order. Accounts
+        that do not exist are reported inline with an error.
+        """
+        output = request.args.get('format', 'json')
+        if output not in ('json', 'ndjson'):
+            return {"error": "Format must be 'json' or 'ndjson'"}, 400
+        ids = [account_number.strip() for value in request.args.getlist('ids')
+               for account_number in value.split(',') if account_number.strip()]
+        if not ids:
+            return {"error": "ids is required"}, 400
+        return stream_json(banking.iter_balances(ids), output)
+    @accounts_ns.doc('post_balances')
+    @accounts_ns.param('format', "'json' streams a JSON array, 'ndjson' one balance per line",
+                       enum=['json', 'ndjson'])
+    @accounts_ns.expect(bulk_balance_request, validate=False)
+    @accounts_ns.response(200, 'Success', [bulk_balance])
+    @accounts_ns.response(400, 'Bad request - Invalid account list or format', bad_request_error_model)
+    def post(self):
+        """Get the balances of many accounts
+
+        Takes a JSON object with an account_numbers list, or a text/plain body
+        with one account number per line, which is read as it arrives so any
+        number of accounts can be requested. Streams one result per account,
+        in request order; accounts that do not exist are reported inline.
+        """
+        output = request.args.get('format', 'json')
+        if output not in ('json', 'ndjson'):
+            return {"error": "Format must be 'json' or 'ndjson'"}, 400
+        if request.mimetype == 'text/plain':
+            return stream_json(banking.iter_balances(iter_lines(request.stream)), output)
+        data = request.get_json()
+        if not isinstance(data, dict) or not isinstance(data.get('account_numbers'), list):
+            return {"error": "account_numbers must be a list"}, 400
+        if len(data['account_numbers']) > banking.BULK_MAX_IDS:
+            return {"error": f"At most {banking.BULK_MAX_IDS} account numbers per JSON request; "
+                             "send them as text/plain, one per line, for more"}, 400
+        return stream_json(banking.iter_balances(data['account_numbers']), output)
+@accounts_ns.route('/stats')
+@accounts_ns.response(429, 'Too many requests - Rate limit exceeded', rate_limit_error_model)
+class AccountStats(Resource):
+    method_decorators = rate_limited() + instrumented('stats')
+    @accounts_ns.doc('get_stats')
+    @accounts_ns.param('below', 'Also count the accounts with a balance under this amount', type=float)
+    @accounts_ns.response(200, 'Success', balance_stats_model)
+    @accounts_ns.response(400, 'Bad request - Invalid below amount', bad_request_error_model)
+    def get(self):
+        """Get the number of accounts and the total, mean, min, median and max balance"""
+        below, error = banking.parse_stats_query(request.args)
+        if error:
+            return {"error": error}, 400
+        return banking.balance_stats(below)
+@accounts_ns.route('/top')
+@accounts_ns.response(429, 'Too many requests - Rate limit exceeded', rate_limit_error_model)
+class AccountTop(Resource):
+    method_decorators = rate_limited() + instrumented('top')
+    @accounts_ns.doc('get_top')
+    @accounts_ns.param('n', f'Number of accounts (1-{banking.TOP_MAX_N}, default {banking.TOP_DEFAULT_N})',
+                       type=int)
+    @accounts_ns.response(200, 'Success', top_balances_model)
+    @accounts_ns.response(400, 'Bad request - Invalid n', bad_request_error_model)
+    def get(self):
+        """Get the accounts with the largest balances, largest first"""
+        n, error = banking.parse_top_query(request.args)
+        if error:
+            return {"error": error}, 400
+        return banking.top_balances(n)
+# Bulk import and export formats, and the Content-Type each one is served with
+BULK_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+@accounts_ns.route('/import')
+@accounts_ns.response(429, 'Too many requests - Rate limit exceeded', rate_limit_error_model)
+class AccountImport(Resource):
+    method_decorators = admin_only() + rate_limited() + instrumented('import')
+    @accounts_ns.doc('import_accounts', params=admin_token_param)
+    @accounts_ns.param('format', "'csv' (account_number,balance rows, optional header) or 'ndjson' "
+                                 "(one object per line); defaults to ndjson for an application/x-ndjson "
+                                 "body and csv otherwise", enum=['csv', 'ndjson'])
+    @accounts_ns.response(200, 'Import processed', import_response)
+    @accounts_ns.response(400, 'Bad request - Invalid format or no accounts', bad_request_error_model)
+    @accounts_ns.response(401, 'Missing or wrong admin token', admin_error_model)
+    @accounts_ns.response(403, 'Import and export are disabled (ATM_ADMIN_TOKEN is not set)', admin_error_model)
+    def post(self):
+        """Create or overwrite accounts in bulk
+
+        The body is read and applied in batches as it arrives, so uploads of
+        any size are accepted. Each record sets an account's balance,
+        creating the account if needed. Invalid records are skipped and
+        reported; the others are applied.
+        """
+        default = 'ndjson' if request.mimetype == BULK_FORMATS['ndjson'] else 'csv'
+        output = request.args.get('format', default)
+        if output not in BULK_FORMATS:
+            return {"error": "Format must be 'csv' or 'ndjson'"}, 400
+        return banking.import_accounts(iter_lines(request.stream), output)
+@accounts_ns.route('/export')
+@accounts_ns.response(429, 'Too many requests - Rate limit exceeded', rate_limit_error_model)
+class AccountExport(Resource):
+    method_decorators = admin_only() + rate_limited() + instrumented('export')
+    @accounts_ns.doc('export_accounts', params=admin_token_param)
+    @accounts_ns.param('format', "'csv' (the default) or 'ndjson'", enum=['csv', 'ndjson'])
+    @accounts_ns.response(200, 'Every account and its balance')
+    @accounts_ns.response(400, 'Bad request - Invalid format', bad_request_error_model)
+    @accounts_ns.response(401, 'Missing or wrong admin token', admin_error_model)
+    @accounts_ns.response(403, 'Import and export are disabled (ATM_ADMIN_TOKEN is not set)', admin_error_model)
+    def get(self):
+        """Download every account and its balance
+
+        Streams a point-in-time copy of the store in the format POST
+        /accounts/import reads; transactions pause only while it is copied.
+        """
+        output = request.args.get('format', 'csv')
+        if output not in BULK_FORMATS:
+            return {"error": "Format must be 'csv' or 'ndjson'"}, 400
+        response = Response(stream_with_context(banking.export_accounts(output)), mimetype=BULK_FORMATS[output])
+        response.headers['Content-Disposition'] = f'attachment; filename=accounts.{output}'
+        return response
+@accounts_ns.route('/batch')
+@accounts_ns.response(429, 'Too many requests - Rate limit exceeded', rate_limit_error_model)
+class AccountBatch(Resource):
+    method_decorators = rate_limited() + instrumented('batch')
+    @accounts_ns.doc('batch_transactions')
+    @accounts_ns.expect(batch_request, validate=False)
+    @accounts_ns.response(200, 'Batch processed', batch_response)
+    @accounts_ns.response(400, 'Bad request - Invalid batch or atomic batch rolled back', batch_response)
+    def post(self):
+        """Apply a batch of deposits and withdrawals
+
+        Each operation is validated with the same rules as the single-operation
+        endpoints. In atomic mode (the default) either every operation is
+        applied or none is; in independent mode each valid operation is applied
+        and failures are reported per item.
+        """
         data = request.get_json()
-        if not data or 'amount' not in data:
-            return {"error": "Amount is required"}, 400
-        amount = data.get('amount', 0)
-        if not isinstance(amount, (int, float)) or amount <= 0:
-            return {"error": "Withdrawal amount must be a positive number"}, 400
-        # Round to 2 decimal places for currency
-        amount = round(float(amount), 2)
-        current_balance = accounts[account_number]['balance']
-        if current_balance < amount:
-            return {"error": f"Insufficient funds. Current balance: ${current_balance}, Requested: ${amount}"}, 400
-        accounts[account_number]['balance'] = round(current_balance - amount, 2)
-        return {
-            'message': f'Withdrawal successful. ${amount} withdrawn from account {account_number}',
-            'balance': accounts[account_number]['balance']
-        }
+        if not isinstance(data, dict) or not isinstance(data.get('operations'), list) or not data['operations']:
+            return {"error": "Operations must be a non-empty list"}, 400
+        operations = data['operations']
+        if len(operations) > BATCH_MAX_OPERATIONS:
+            return {"error": f"Batch exceeds the maximum of {BATCH_MAX_OPERATIONS} operations"}, 400
+        mode = data.get('mode', 'atomic')
+        if mode not in BATCH_MODES:
+            return {"error": "Mode must be 'atomic' or 'independent'"}, 400
+        validated = validate_operations(operations)
+        results, applied, failed = apply_operations(validated, mode == 'atomic')
+        body = {'mode': mode, 'applied': applied, 'failed': failed, 'results': results}
+        if mode == 'atomic' and failed:
+            return body, 400
+        return body
+if banking.metrics is not None:
+    @app.route('/metrics')
+    def prometheus_metrics():
+        """Request, store and lock metrics in the Prometheus text format"""
+        return Response(banking.metrics.render(), content_type=metrics.CONTENT_TYPE)
+def export_openapi(path):
+    """Write the spec served at /swagger.json to path, for wsgi.py to serve without Flask"""
+    with app.test_request_context():
+        body = json.dumps(api.__schema__) + "\n"
+    with open(path, 'w') as f:
+        f.write(body)
+# Opt-in: serve the balance, deposit and withdraw routes without Flask dispatch
+if os.environ.get("ATM_FAST_PATH") == "1":
+    fastpath.install(app)
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8080))
     app.run(host="0.0.0.0", port=port, debug=False)
\ No newline at end of file
@@ -0,0 +1,272 @@
+import asyncio
+import json
+import os
+import re
+import time
+from functools import partial
+from http import HTTPStatus
+from urllib.parse import unquote
+
+import banking
+import metrics
+
+# Same contract as the Flask resources for the three account routes
+_ROUTE = re.compile(r'^/accounts/([^/]+)/(balance|deposit|withdraw)$')
+_ALLOWED = {'balance': ('GET', 'HEAD', 'OPTIONS'), 'deposit': ('POST', 'OPTIONS'), 'withdraw': ('POST', 'OPTIONS')}
+_MUTATIONS = {'deposit': banking.deposit, 'withdraw': banking.withdraw}
+# Error bodies Flask and flask-restx produce for the same situations
+_NOT_FOUND_PAGE = (
+    b'<!doctype html>\n<html lang=en>\n<title>404 Not Found</title>\n<h1>Not Found</h1>\n'
+    b'<p>The requested URL was not found on the server. If you entered the URL manually '
+    b'please check your spelling and try again.</p>\n'
+)
+_BAD_REQUEST = {"message": "The browser (or proxy) sent a request that this server could not understand."}
+_UNSUPPORTED_MEDIA_TYPE = {"message": "Did not attempt to load JSON data because the request "
+                                      "Content-Type was not 'application/json'."}
+_METHOD_NOT_ALLOWED = {"message": "The method is not allowed for the requested URL."}
+_METRICS_CONTENT_TYPE = metrics.CONTENT_TYPE.encode()
+
+# Connection handling for the built-in server
+KEEP_ALIVE_TIMEOUT = float(os.environ.get("ATM_KEEP_ALIVE_TIMEOUT", 75))
+MAX_BODY_BYTES = 1 << 20
+
+
+class _RejectedPayload(Exception):
+    def __init__(self, status, body):
+        super().__init__(status)
+        self.status = status
+        self.body = body
+
+
+def _json_loader(headers, body):
+    # Mirrors Flask's request.get_json(): JSON content type required, 400 on bad JSON
+    def load():
+        mimetype = headers.get(b'content-type', b'').split(b';', 1)[0].strip().lower()
+        if mimetype != b'application/json' and not (mimetype.startswith(b'application/')
+                                                    and mimetype.endswith(b'+json')):
+            raise _RejectedPayload(415, _UNSUPPORTED_MEDIA_TYPE)
+        try:
+            return json.loads(body)
+        except ValueError:
+            raise _RejectedPayload(400, _BAD_REQUEST)
+    return load
+
+
+async def _respond(send, status, body, content_type=b'application/json', extra_headers=(), head=False):
+    if content_type == b'application/json':
+        body = (json.dumps(body) + "\n").encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type), (b'content-length', str(len(body)).encode()),
+                    (b'access-control-allow-origin', b'*'), *extra_headers],
+    })
+    await send({'type': 'http.response.body', 'body': b'' if head else body})
+
+
+def _observe(route, status, start):
+    if banking.metrics is not None:
+        banking.metrics.observe(route, status, time.perf_counter() - start)
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+async def app(scope, receive, send):
+    """ASGI entry point serving the account balance, deposit and withdraw routes"""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    match = _ROUTE.match(scope['path'])
+    if match is None:
+        if scope['path'] == '/metrics' and scope['method'] == 'GET' and banking.metrics is not None:
+            await _respond(send, 200, banking.metrics.render().encode(), content_type=_METRICS_CONTENT_TYPE)
+            return
+        await _respond(send, 404, _NOT_FOUND_PAGE, content_type=b'text/html; charset=utf-8')
+        return
+    account_number, action = match.groups()
+    method = scope['method']
+    allowed = _ALLOWED[action]
+    if method not in allowed:
+        await _respond(send, 405, _METHOD_NOT_ALLOWED, extra_headers=[(b'allow', ', '.join(allowed).encode())])
+        return
+    if method == 'OPTIONS':
+        await _respond(send, 200, b'', content_type=b'text/html; charset=utf-8', extra_headers=[
+            (b'allow', ', '.join(allowed).encode()),
+            (b'access-control-allow-methods', b'DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT'),
+        ])
+        return
+    start = time.perf_counter()
+    if banking.client_limiter is not None or banking.account_limiter is not None:
+        forwarded_for = dict(scope['headers']).get(b'x-forwarded-for')
+        client = banking.client_identity(scope['client'][0] if scope.get('client') else None,
+                                         None if forwarded_for is None else forwarded_for.decode('latin-1'))
+        throttled = banking.check_rate_limit(account_number, client)
+        if throttled is not None:
+            body, status, extra = throttled
+            _observe(action, status, start)
+            await _respond(send, status, body, head=method == 'HEAD',
+                           extra_headers=[(name.lower().encode(), value.encode()) for name, value in extra.items()])
+            return
+    headers = dict(scope['headers'])
+    if action == 'balance':
+        if_none_match = headers.get(b'if-none-match')
+        body, status, extra = banking.get_balance(account_number,
+                                                  None if if_none_match is None else if_none_match.decode('latin-1'))
+        _observe(action, status, start)
+        extra = [(name.lower().encode(), value.encode()) for name, value in extra.items()]
+        if status == 304:
+            # No body and no content headers, as Werkzeug sends it
+            await send({'type': 'http.response.start', 'status': 304,
+                        'headers': [*extra, (b'access-control-allow-origin', b'*')]})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        await _respond(send, status, body, head=method == 'HEAD', extra_headers=extra)
+        return
+
+    payload = await _read_body(receive)
+    key = headers.get(b'idempotency-key')
+    if_match = headers.get(b'if-match')
+    call = partial(banking.idempotent, None if key is None else key.decode('latin-1'), action, account_number,
+                   payload, partial(_MUTATIONS[action], account_number, _json_loader(headers, payload),
+                                    None if if_match is None else if_match.decode('latin-1')))
+    try:
+        if (banking.accounts.journal is not None or banking.write_pipeline is not None
+                or banking.STORE_BACKEND != "memory"):
+            # Waiting for the journal fsync, the write pipeline, a coalesced
+            # duplicate, a SQLite commit or another worker's fcntl lock on the
+            # shared store must not stall the event loop
+            loop = asyncio.get_running_loop()
+            body, status, extra = await loop.run_in_executor(None, call)
+        else:
+            body, status, extra = call()
+    except _RejectedPayload as rejected:
+        body, status, extra = rejected.body, rejected.status, {}
+    _observe(action, status, start)
+    await _respond(send, status, body, extra_headers=[(name.lower().encode(), value.encode())
+                                                      for name, value in extra.items()])
+
+
+async def _call(asgi_app, scope, body):
+    # Run one request through the ASGI app and return (status, headers, body)
+    received = False
+    response = {'status': 500, 'headers': [], 'body': []}
+
+    async def receive():
+        nonlocal received
+        if received:
+            # Nothing more will arrive; only reached by apps awaiting a disconnect
+            await asyncio.Event().wait()
+        received = True
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            response['headers'] = message.get('headers', [])
+        elif message['type'] == 'http.response.body':
+            response['body'].append(message.get('body', b''))
+
+    await asgi_app(scope, receive, send)
+    return response['status'], response['headers'], b''.join(response['body'])
+
+
+async def _serve_connection(asgi_app, reader, writer):
+    """Serve HTTP/1.1 requests on one keep-alive connection until it closes"""
+    server = writer.get_extra_info('sockname')
+    client = writer.get_extra_info('peername')
+    try:
+        while True:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEP_ALIVE_TIMEOUT)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+                return
+            lines = head[:-4].split(b'\r\n')
+            try:
+                method, target, version = lines[0].decode('latin-1').split(' ')
+                headers = [(name.strip().lower(), value.strip())
+                           for name, _, value in (line.partition(b':') for line in lines[1:])]
+                header_map = dict(headers)
+                length = int(header_map.get(b'content-length', b'0'))
+                if length < 0:
+                    raise ValueError(length)
+            except ValueError:
+                writer.write(b'HTTP/1.1 400 Bad Request\r\ncontent-length: 0\r\nconnection: close\r\n\r\n')
+                return
+            if b'transfer-encoding' in header_map:
+                # Chunked request bodies are not supported; clients send Content-Length
+                writer.write(b'HTTP/1.1 501 Not Implemented\r\ncontent-length: 0\r\nconnection: close\r\n\r\n')
+                return
+            if length > MAX_BODY_BYTES:
+                writer.write(b'HTTP/1.1 413 Payload Too Large\r\ncontent-length: 0\r\nconnection: close\r\n\r\n')
+                return
+            body = await reader.readexactly(length) if length else b''
+            connection = header_map.get(b'connection', b'').lower()
+            keep_alive = connection == b'keep-alive' if version == 'HTTP/1.0' else connection != b'close'
+
+            path, _, query = target.partition('?')
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0', 'spec_version': '2.3'},
+                'http_version': version[5:], 'method': method.upper(), 'scheme': 'http',
+                'path': unquote(path), 'raw_path': path.encode('latin-1'),
+                'query_string': query.encode('latin-1'), 'root_path': '',
+                'headers': headers, 'client': client, 'server': server,
+            }
+            try:
+                status, response_headers, response_body = await _call(asgi_app, scope, body)
+                out = [f'HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n'.encode()]
+            except Exception as e:
+                # Answer rather than drop the socket, and report it as asyncio
+                # reports any other unhandled error
+                asyncio.get_running_loop().call_exception_handler(
+                    {'message': 'Unhandled exception in the ASGI app', 'exception': e})
+                writer.write(b'HTTP/1.1 500 Internal Server Error\r\ncontent-length: 0\r\nconnection: close\r\n\r\n')
+                return
+            out.extend(name + b': ' + value + b'\r\n' for name, value in response_headers)
+            if not keep_alive:
+                out.append(b'connection: close\r\n')
+            out.append(b'\r\n')
+            out.append(response_body)
+            writer.write(b''.join(out))
+            await writer.drain()
+            if not keep_alive:
+                return
+    except (ConnectionError, asyncio.IncompleteReadError):
+        # The client went away, possibly in the middle of its body
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host="0.0.0.0", port=8080, asgi_app=app, ready=None):
+    """Run the built-in asyncio HTTP/1.1 server until cancelled
+
+    ready, if given, is called with the listening asyncio server.
+    """
+    server = await asyncio.start_server(partial(_serve_connection, asgi_app), host, port, backlog=4096)
+    if ready is not None:
+        ready(server)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    port = int(os.environ.get("PORT", 8080))
+    asyncio.run(serve(port=port))
@@ -0,0 +1,338 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import chain, compress, count, islice
+from operator import eq, itemgetter
+
+# Range of the int64 arrays holding the cents
+_MIN_CENTS = -(1 << 63)
+_MAX_CENTS = (1 << 63) - 1
+
+
+def _check(cents):
+    # Refuse a value the arrays cannot hold before any entry is touched
+    if not _MIN_CENTS <= cents <= _MAX_CENTS:
+        raise OverflowError(f'{cents} cents does not fit in int64')
+
+
+def _sort_entries(keys, cents):
+    # Sort a list of account numbers and an int64 array of their cents by
+    # (cents, account_number). Sorting slot numbers by cents compares plain
+    # ints, several times faster than sorting (cents, account_number)
+    # tuples; only the runs of equal balances are then sorted by account.
+    order = sorted(range(len(cents)), key=cents.__getitem__)
+    cents = array('q', map(cents.__getitem__, order))
+    keys = list(map(keys.__getitem__, order))
+    start = end = -1
+    for i in compress(count(), map(eq, cents, islice(cents, 1, None))):
+        if i != end:
+            keys[start:end + 1] = sorted(keys[start:end + 1])
+            start = i
+        end = i + 1
+    keys[start:end + 1] = sorted(keys[start:end + 1])
+    return keys, cents
+
+
+class BalanceIndex:
+    """Every account's balance in sorted order, with a running total.
+
+    Balances are ordered by (cents, account_number) and split into buckets
+    of up to 2 * load entries. Each bucket keeps its cents in an int64 array
+    and the account numbers in a parallel list, so an entry costs 16 bytes
+    and a bisection reads contiguous memory. The largest (cents,
+    account_number) of every bucket is kept in a separate list to find the
+    bucket holding a value. A Fenwick tree over the bucket sizes turns a
+    position into a bucket and back in O(log n), which answers rank and
+    order-statistic queries without walking the buckets; it is rebuilt only
+    when a bucket splits or empties.
+
+    Stores call move() with the account's lock held, so the old balance they
+    pass is the one in the index. The index has a lock of its own because
+    accounts on different lock stripes update it concurrently.
+    """
+
+    def __init__(self, items=(), load=1000):
+        self._load = load
+        self._lock = threading.Lock()
+        self._cents = []
+        self._keys = []
+        self._maxes = []
+        self._tree = []
+        self._count = 0
+        self._total = 0
+        self.update(items)
+
+    def update(self, items):
+        """Add (account_number, cents) pairs of accounts not yet in the index"""
+        items = list(items)
+        self.add_many(list(map(itemgetter(0), items)), array('q', map(itemgetter(1), items)))
+
+    def add_many(self, keys, cents):
+        """Add accounts not yet in the index from a list of account numbers and an int64 array of their cents
+
+        No object per account is allocated besides its slot number, so even
+        millions of them set off no full collection of the cyclic garbage
+        collector, which would walk every account number in the process.
+        """
+        if not keys:
+            return
+        keys, cents = _sort_entries(keys, cents)
+        with self._lock:
+            if self._count:
+                if len(keys) < self._count // 4:
+                    self._insert_sorted(list(zip(cents, keys)))
+                    return
+                # Inserted one by one, this many entries would cost more than
+                # merging them with the indexed ones (two sorted runs, which
+                # the sort merges in one pass) and rebuilding every bucket
+                indexed_cents = array('q')
+                for bucket in self._cents:
+                    indexed_cents += bucket
+                keys, cents = _sort_entries(list(chain.from_iterable(self._keys)) + keys, indexed_cents + cents)
+                self._cents, self._keys, self._maxes = [], [], []
+            load = self._load
+            for start in range(0, len(keys), load):
+                self._cents.append(cents[start:start + load])
+                self._keys.append(keys[start:start + load])
+                self._maxes.append((self._cents[-1][-1], self._keys[-1][-1]))
+            self._count = len(keys)
+            self._total = sum(cents)
+            self._rebuild_tree()
+
+    def add(self, account_number, cents):
+        _check(cents)
+        with self._lock:
+            self._add(cents, account_number)
+
+    def move(self, account_number, old_cents, new_cents):
+        """Record that an indexed account's balance changed from old_cents to new_cents
+
+        Raises before changing anything if the old entry is missing or
+        new_cents does not fit in int64, so the index never loses an entry.
+        """
+        if old_cents == new_cents:
+            return
+        _check(new_cents)
+        with self._lock:
+            maxes = self._maxes
+            i = bisect_left(maxes, (old_cents, account_number))
+            new = (new_cents, account_number)
+            # Most moves stay inside one bucket: replace the entry there and
+            # leave the bucket sizes, and so the tree, as they are
+            if (i < len(maxes) and len(self._keys[i]) > 1 and (i == 0 or maxes[i - 1] < new)
+                    and (new < maxes[i] or i == len(maxes) - 1)):
+                cents, keys = self._cents[i], self._keys[i]
+                j = self._find(i, old_cents, account_number)
+                del cents[j]
+                del keys[j]
+                j = self._position(i, new_cents, account_number)
+                cents.insert(j, new_cents)
+                keys.insert(j, account_number)
+                maxes[i] = (cents[-1], keys[-1])
+                self._total += new_cents - old_cents
+                return
+            self._remove(old_cents, account_number)
+            self._add(new_cents, account_number)
+
+    def clear(self):
+        with self._lock:
+            self._cents = []
+            self._keys = []
+            self._maxes = []
+            self._tree = []
+            self._count = 0
+            self._total = 0
+
+    def __len__(self):
+        return self._count
+
+    def _position(self, i, cents, account_number):
+        # Insertion point of (cents, account_number) in bucket i: equal
+        # balances are ordered by account number
+        bucket = self._cents[i]
+        lo = bisect_left(bucket, cents)
+        hi = bisect_right(bucket, cents, lo)
+        return bisect_left(self._keys[i], account_number, lo, hi)
+
+    def _find(self, i, cents, account_number):
+        j = self._position(i, cents, account_number)
+        if j == len(self._keys[i]) or self._cents[i][j] != cents or self._keys[i][j] != account_number:
+            raise KeyError(account_number)
+        return j
+
+    def _rebuild_tree(self):
+        # Fenwick tree over bucket sizes, built in O(buckets)
+        tree = [0] + [len(keys) for keys in self._keys]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, bucket, delta):
+        tree = self._tree
+        i = bucket + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def _before(self, bucket):
+        # Number of entries in the buckets before bucket
+        tree = self._tree
+        total = 0
+        while bucket:
+            total += tree[bucket]
+            bucket -= bucket & -bucket
+        return total
+
+    def _locate(self, position):
+        # (bucket, offset) of the entry at position, by descending the tree
+        tree = self._tree
+        bucket = 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            probe = bucket + step
+            if probe < len(tree) and tree[probe] <= position:
+                bucket = probe
+                position -= tree[probe]
+            step >>= 1
+        return bucket, position
+
+    def _add(self, cents, account_number):
+        bucket = self._insert(cents, account_number)
+        if bucket < 0:
+            self._rebuild_tree()
+        else:
+            self._tree_add(bucket, 1)
+
+    def _insert_sorted(self, entries):
+        # Bulk insert of sorted (cents, account_number) entries: each one
+        # lands in the same bucket as the previous one or a later bucket, so
+        # the search starts there, and the tree is rebuilt once at the end
+        maxes, all_cents, all_keys = self._maxes, self._cents, self._keys
+        split = 2 * self._load
+        total = 0
+        i = 0
+        for entry in entries:
+            cents, account_number = entry
+            total += cents
+            # Usually the same or the next bucket: check those before bisecting
+            if maxes[i] < entry:
+                i += 1
+                if i < len(maxes) and maxes[i] < entry:
+                    i = bisect_left(maxes, entry, i + 1)
+            if i == len(maxes):
+                i -= 1
+                all_cents[i].append(cents)
+                all_keys[i].append(account_number)
+                maxes[i] = entry
+            else:
+                bucket, keys = all_cents[i], all_keys[i]
+                j = bisect_left(bucket, cents)
+                if j < len(bucket) and bucket[j] == cents:
+                    j = bisect_left(keys, account_number, j, bisect_right(bucket, cents, j))
+                bucket.insert(j, cents)
+                keys.insert(j, account_number)
+            keys = all_keys[i]
+            if len(keys) > split:
+                bucket = all_cents[i]
+                half = len(keys) // 2
+                all_cents.insert(i + 1, bucket[half:])
+                all_keys.insert(i + 1, keys[half:])
+                del bucket[half:]
+                del keys[half:]
+                maxes.insert(i, (bucket[-1], keys[-1]))
+        self._count += len(entries)
+        self._total += total
+        self._rebuild_tree()
+
+    def _insert(self, cents, account_number):
+        # Returns the bucket the entry went into, or -1 if the buckets were
+        # split or created and the tree has to be rebuilt
+        self._count += 1
+        self._total += cents
+        entry = (cents, account_number)
+        if not self._keys:
+            self._cents.append(array('q', [cents]))
+            self._keys.append([account_number])
+            self._maxes.append(entry)
+            return -1
+        i = bisect_left(self._maxes, entry)
+        if i == len(self._maxes):
+            i -= 1
+            self._cents[i].append(cents)
+            self._keys[i].append(account_number)
+            self._maxes[i] = entry
+        else:
+            j = self._position(i, cents, account_number)
+            self._cents[i].insert(j, cents)
+            self._keys[i].insert(j, account_number)
+        keys = self._keys[i]
+        if len(keys) > 2 * self._load:
+            half = len(keys) // 2
+            cents = self._cents[i]
+            self._cents.insert(i + 1, cents[half:])
+            self._keys.insert(i + 1, keys[half:])
+            del cents[half:]
+            del keys[half:]
+            self._maxes.insert(i, (cents[-1], keys[-1]))
+            return -1
+        return i
+
+    def _remove(self, cents, account_number):
+        i = bisect_left(self._maxes, (cents, account_number))
+        if i == len(self._maxes):
+            raise KeyError(account_number)
+        j = self._find(i, cents, account_number)
+        bucket, keys = self._cents[i], self._keys[i]
+        del bucket[j]
+        del keys[j]
+        self._count -= 1
+        self._total -= cents
+        if not keys:
+            del self._cents[i]
+            del self._keys[i]
+            del self._maxes[i]
+            self._rebuild_tree()
+            return
+        self._maxes[i] = (bucket[-1], keys[-1])
+        self._tree_add(i, -1)
+
+    def stats(self):
+        """Return count, total, min, max and median balance in cents (None when empty)"""
+        with self._lock:
+            count = self._count
+            if not count:
+                return {'count': 0, 'total': 0, 'min': None, 'max': None, 'median': None}
+            bucket, offset = self._locate((count - 1) // 2)
+            median = self._cents[bucket][offset]
+            if count % 2 == 0:
+                bucket, offset = self._locate(count // 2)
+                # Integer cents; the mean of the two middle balances is rounded down
+                median = (median + self._cents[bucket][offset]) // 2
+            return {'count': count, 'total': self._total, 'min': self._cents[0][0],
+                    'max': self._maxes[-1][0], 'median': median}
+
+    def count_below(self, cents):
+        """Number of accounts with a balance strictly below cents"""
+        with self._lock:
+            # (cents,) sorts before every (cents, account_number) entry
+            i = bisect_left(self._maxes, (cents,))
+            if i == len(self._maxes):
+                return self._count
+            return self._before(i) + bisect_left(self._cents[i], cents)
+
+    def top(self, n):
+        """Return the n largest (account_number, cents) pairs, largest first
+
+        Ties are listed in descending account number order.
+        """
+        result = []
+        with self._lock:
+            for i in range(len(self._keys) - 1, -1, -1):
+                cents, keys = self._cents[i], self._keys[i]
+                for j in range(len(keys) - 1, -1, -1):
+                    if len(result) == n:
+                        return result
+                    result.append((keys[j], cents[j]))
+        return result
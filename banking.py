@@ -0,0 +1,788 @@
+import csv
+import hashlib
+import heapq
+import hmac
+import io
+import json
+import math
+import os
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone
+from itertools import chain, islice
+from json.encoder import encode_basestring
+
+from history import TransactionHistory
+from idempotency import IdempotencyCache
+from journal import Journal, replay as replay_journal, segment_paths
+from metrics import Metrics
+from pipeline import MutationPipeline
+from ratelimit import RateLimiter
+from shared_store import DEFAULT_PATH as SHARED_DEFAULT_PATH, SharedAccountStore
+from snapshot import Snapshot, SnapshotWriter
+from sqlite_store import DEFAULT_PATH as SQLITE_DEFAULT_PATH, SQLiteAccountStore
+from store import (MAX_CENTS, BalanceOverflowError, MemoryAccountStore, StripedLockManager, from_cents,
+                   to_cents)
+
+
+# Host name the API is served under; requests for any other host get a 404
+SERVER_NAME = 'atm-api-435429241525.us-central1.run.app'
+# Balances every fresh deployment starts with, in cents
+SEED_BALANCES = {
+    "1001": 50000,
+    "1002": 100000,
+    "1003": 75000
+}
+# Stripes of the per-account locks serializing balance updates (gunicorn runs 8 threads)
+LOCK_STRIPES = int(os.environ.get("ATM_LOCK_STRIPES", 64))
+# Storage backend: "memory" (per-process), "shared" (one table mapped by every
+# worker) or "sqlite" (a database file, persisted and shared by every worker)
+STORE_BACKEND = os.environ.get("ATM_STORE", "memory")
+SNAPSHOT_PATH = os.environ.get("ATM_SNAPSHOT_PATH")
+JOURNAL_PATH = os.environ.get("ATM_JOURNAL_PATH")
+if STORE_BACKEND in ("shared", "sqlite") and (SNAPSHOT_PATH or JOURNAL_PATH):
+    raise RuntimeError("ATM_SNAPSHOT_PATH and ATM_JOURNAL_PATH require ATM_STORE=memory")
+if STORE_BACKEND == "shared":
+    accounts = SharedAccountStore(os.environ.get("ATM_SHARED_PATH", SHARED_DEFAULT_PATH),
+                                  capacity=int(os.environ.get("ATM_SHARED_CAPACITY", 1 << 20)),
+                                  balances=SEED_BALANCES, stripes=LOCK_STRIPES)
+elif STORE_BACKEND == "sqlite":
+    accounts = SQLiteAccountStore(os.environ.get("ATM_SQLITE_PATH", SQLITE_DEFAULT_PATH), balances=SEED_BALANCES,
+                                  synchronous=os.environ.get("ATM_SQLITE_SYNCHRONOUS", "FULL"),
+                                  stripes=LOCK_STRIPES)
+elif STORE_BACKEND != "memory":
+    raise RuntimeError(f"Unknown ATM_STORE backend: {STORE_BACKEND}")
+elif int(os.environ.get("WEB_CONCURRENCY", 1)) > 1:
+    # Each worker process would hold its own diverging copy of every balance
+    raise RuntimeError("Multiple gunicorn workers require ATM_STORE=shared or ATM_STORE=sqlite")
+elif SNAPSHOT_PATH and os.path.exists(SNAPSHOT_PATH):
+    # Serve balances straight from the mmap'd snapshot instead of the seed data
+    accounts = MemoryAccountStore(locks=StripedLockManager(LOCK_STRIPES), base=Snapshot(SNAPSHOT_PATH))
+else:
+    accounts = MemoryAccountStore(SEED_BALANCES, locks=StripedLockManager(LOCK_STRIPES))
+account_locks = accounts.locks
+# Durable mode: rebuild balances from the journal, then journal every change
+if JOURNAL_PATH:
+    for segment in segment_paths(JOURNAL_PATH):
+        accounts.update(replay_journal(segment))
+    accounts.journal = Journal(JOURNAL_PATH,
+                               fsync_interval=float(os.environ.get("ATM_JOURNAL_FSYNC_INTERVAL", 0)),
+                               batch_size=int(os.environ.get("ATM_JOURNAL_BATCH_SIZE", 512)))
+# Periodically rewrite the snapshot in the background (0 disables)
+SNAPSHOT_INTERVAL = float(os.environ.get("ATM_SNAPSHOT_INTERVAL", 300))
+snapshot_writer = None
+if SNAPSHOT_PATH and SNAPSHOT_INTERVAL > 0:
+    snapshot_writer = SnapshotWriter(accounts, SNAPSHOT_PATH, SNAPSHOT_INTERVAL).start()
+# Transactions kept per account for GET /accounts/<id>/transactions (0 disables).
+# Off by default with ATM_STORE=sqlite: recording in order puts every write
+# under a Python stripe lock that SQLite does not otherwise need.
+HISTORY_CAPACITY = int(os.environ.get("ATM_HISTORY_CAPACITY", 0 if STORE_BACKEND == "sqlite" else 50))
+if HISTORY_CAPACITY > 0:
+    accounts.history = TransactionHistory(HISTORY_CAPACITY)
+# Sorted balances and running totals answering /accounts/stats and /accounts/top
+# (0 disables; those requests then scan the store). A per-process index cannot
+# see other workers' updates, so ATM_STORE=shared always scans. A snapshot is
+# indexed on a background thread to keep startup constant-time; requests scan
+# until it is ready.
+if os.environ.get("ATM_BALANCE_INDEX", "1") != "0" and STORE_BACKEND == "memory":
+    if accounts.base is not None:
+        threading.Thread(target=accounts.index_balances, name="balance-index", daemon=True).start()
+    else:
+        accounts.index_balances()
+TOP_DEFAULT_N = 10
+TOP_MAX_N = 1000
+# Page size limits for transaction history requests
+HISTORY_DEFAULT_LIMIT = 20
+HISTORY_MAX_LIMIT = 100
+# Responses replayed for retried requests carrying an Idempotency-Key (0 bytes disables)
+IDEMPOTENCY_MAX_BYTES = int(os.environ.get("ATM_IDEMPOTENCY_MAX_BYTES", 64 << 20))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+idempotency_cache = None
+if IDEMPOTENCY_MAX_BYTES > 0:
+    idempotency_cache = IdempotencyCache(IDEMPOTENCY_MAX_BYTES,
+                                         ttl=float(os.environ.get("ATM_IDEMPOTENCY_TTL", 86400)))
+# Upper bound on the number of operations accepted by one batch request
+BATCH_MAX_OPERATIONS = int(os.environ.get("ATM_BATCH_MAX_OPERATIONS", 10000))
+# Upper bound on account numbers in one JSON bulk balance request; text/plain
+# request bodies are read line by line and have no limit
+BULK_MAX_IDS = int(os.environ.get("ATM_BULK_MAX_IDS", 100000))
+# Accounts applied to the store at a time by /accounts/import, and the rows
+# written per chunk by /accounts/export
+IMPORT_BATCH_SIZE = int(os.environ.get("ATM_IMPORT_BATCH_SIZE", 10000))
+EXPORT_CHUNK_ROWS = 4096
+# Rejected rows reported back individually by an import; the rest are only counted
+IMPORT_MAX_ERRORS = 100
+# Bearer token /accounts/import and /accounts/export require, since they read
+# or overwrite every account; without one both routes are disabled
+ADMIN_TOKEN = os.environ.get("ATM_ADMIN_TOKEN")
+# Account numbers an import may create, short enough for a shared store slot
+ACCOUNT_NUMBER_PATTERN = re.compile(r'[0-9A-Za-z_-]{1,24}')
+# Largest balance, in dollars, that fits the stores' int64 cents
+MAX_BALANCE = MAX_CENTS // 100
+# Entity tags of account balances, as sent back in If-None-Match and If-Match
+ETAG_PATTERN = re.compile(r'(W/)?"([0-9]+)-([0-9]+)"')
+# ATM_WRITE_PIPELINE=1 sends deposits and withdrawals through one applier thread,
+# which applies up to ATM_WRITE_PIPELINE_MAX_BATCH of them at a time, waiting up
+# to ATM_WRITE_PIPELINE_MAX_DELAY seconds for a batch to fill
+write_pipeline = None
+if os.environ.get("ATM_WRITE_PIPELINE", "0") != "0":
+    write_pipeline = MutationPipeline(accounts,
+                                      max_batch=int(os.environ.get("ATM_WRITE_PIPELINE_MAX_BATCH", 256)),
+                                      max_delay=float(os.environ.get("ATM_WRITE_PIPELINE_MAX_DELAY", 0))).start()
+# Token-bucket rate limits on the account routes, in requests per second per
+# account number and per client address (0 disables each; both are off by default).
+# Bursts are token counts, fractional like the rates, and at least 1
+ACCOUNT_RATE_LIMIT = float(os.environ.get("ATM_ACCOUNT_RATE_LIMIT", 0))
+ACCOUNT_RATE_BURST = float(os.environ.get("ATM_ACCOUNT_RATE_BURST", max(1, 2 * ACCOUNT_RATE_LIMIT)))
+CLIENT_RATE_LIMIT = float(os.environ.get("ATM_CLIENT_RATE_LIMIT", 0))
+CLIENT_RATE_BURST = float(os.environ.get("ATM_CLIENT_RATE_BURST", max(1, 2 * CLIENT_RATE_LIMIT)))
+# Proxies in front of the app appending to X-Forwarded-For (Cloud Run: 1); with 0
+# clients are identified by the connection's address
+TRUSTED_PROXY_HOPS = int(os.environ.get("ATM_TRUSTED_PROXY_HOPS", 0))
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("ATM_RATE_LIMIT_MAX_KEYS", 100000))
+account_limiter = None
+if ACCOUNT_RATE_LIMIT > 0:
+    account_limiter = RateLimiter(ACCOUNT_RATE_LIMIT, ACCOUNT_RATE_BURST, max_keys=RATE_LIMIT_MAX_KEYS)
+client_limiter = None
+if CLIENT_RATE_LIMIT > 0:
+    client_limiter = RateLimiter(CLIENT_RATE_LIMIT, CLIENT_RATE_BURST, max_keys=RATE_LIMIT_MAX_KEYS)
+# Prometheus metrics served at /metrics (ATM_METRICS=0 disables recording and the endpoint)
+metrics = None
+if os.environ.get("ATM_METRICS", "1") != "0":
+    metrics = Metrics()
+    metrics.register('atm_accounts', 'gauge', 'Accounts in the store', lambda: len(accounts))
+    metrics.register('atm_store_memory_bytes', 'gauge', 'Approximate memory held by the account store',
+                     lambda: accounts.memory_bytes())
+    metrics.register('atm_lock_acquisitions_total', 'counter', 'Account lock acquisitions',
+                     lambda: accounts.locks.stats()['acquisitions'])
+    metrics.register('atm_lock_wait_seconds_total', 'counter', 'Time spent waiting for account locks',
+                     lambda: accounts.locks.stats()['wait_seconds_total'])
+    metrics.register('atm_lock_hold_seconds_total', 'counter', 'Time account locks were held',
+                     lambda: accounts.locks.stats()['hold_seconds_total'])
+    if accounts.history is not None:
+        metrics.register('atm_history_memory_bytes', 'gauge', 'Memory held by transaction histories',
+                         lambda: accounts.history.memory_bytes())
+    if idempotency_cache is not None:
+        metrics.register('atm_idempotency_entries', 'gauge', 'Responses held by the idempotency cache',
+                         lambda: idempotency_cache.stats()['entries'])
+        metrics.register('atm_idempotency_bytes', 'gauge', 'Estimated size of the idempotency cache',
+                         lambda: idempotency_cache.stats()['bytes'])
+        metrics.register('atm_idempotency_events_total', 'counter', 'Idempotency cache lookups and evictions, by event',
+                         lambda: [({'event': event}, count) for event, count in idempotency_cache.stats().items()
+                                  if event not in ('entries', 'bytes', 'max_bytes')])
+    for scope, limiter in (('account', account_limiter), ('client', client_limiter)):
+        if limiter is not None:
+            metrics.register(f'atm_rate_limit_{scope}_buckets', 'gauge', f'Token buckets held per {scope}',
+                             lambda limiter=limiter: limiter.stats()['buckets'])
+            metrics.register(f'atm_rate_limit_{scope}_throttled_total', 'counter',
+                             f'Requests rejected by the per-{scope} rate limit',
+                             lambda limiter=limiter: limiter.stats()['throttled'])
+    if write_pipeline is not None:
+        metrics.register('atm_write_pipeline_batches_total', 'counter', 'Batches applied by the write pipeline',
+                         lambda: write_pipeline.batches)
+        metrics.register('atm_write_pipeline_operations_total', 'counter',
+                         'Deposits and withdrawals applied by the write pipeline',
+                         lambda: write_pipeline.operations)
+    if accounts.journal is not None:
+        metrics.register('atm_journal_records_total', 'counter', 'Journal records made durable',
+                         lambda: accounts.journal.stats()['records'])
+        metrics.register('atm_journal_fsyncs_total', 'counter', 'Journal fsync calls',
+                         lambda: accounts.journal.stats()['fsyncs'])
+
+
+def parse_amount(data, label):
+    """Validate a transaction payload
+
+    Returns (amount, None) with the amount rounded to cents, or
+    (None, error message) using the same wording as the API responses.
+    """
+    if not isinstance(data, dict) or 'amount' not in data:
+        return None, "Amount is required"
+    amount = data.get('amount', 0)
+    # NaN fails the comparison too
+    if not isinstance(amount, (int, float)) or not amount > 0:
+        return None, f"{label} amount must be a positive number"
+    # Compared before float(), so Infinity and huge integers are refused rather than raised on
+    if amount > MAX_BALANCE:
+        return None, f"{label} amount must not exceed ${MAX_BALANCE}"
+    # Round to 2 decimal places for currency
+    return round(float(amount), 2), None
+
+
+def overflow_message(amount):
+    """Error for a deposit refused because the balance would not fit in int64 cents"""
+    return f"Balance would exceed the maximum of ${MAX_BALANCE}. Requested: ${amount}"
+
+
+# Error label used by parse_amount for each batch operation type
+OPERATION_LABELS = {'deposit': 'Deposit', 'withdraw': 'Withdrawal'}
+BATCH_MODES = ('atomic', 'independent')
+
+
+def validate_operations(operations):
+    """Validate every batch operation in a single pass
+
+    Applies the same rules as the single-operation endpoints and returns one
+    (account_number, type, amount, status, error) tuple per operation, with
+    status and error set to None for operations that passed.
+    """
+    validated = []
+    append = validated.append
+    for op in operations:
+        if not isinstance(op, dict):
+            append((None, None, None, 400, "Operation must be an object"))
+            continue
+        account_number = op.get('account_number')
+        kind = op.get('type')
+        label = OPERATION_LABELS.get(kind)
+        if label is None:
+            append((account_number, kind, None, 400, "Operation type must be 'deposit' or 'withdraw'"))
+        elif not isinstance(account_number, str) or account_number not in accounts:
+            append((account_number, kind, None, 404, "Account not found"))
+        else:
+            amount, error = parse_amount(op, label)
+            append((account_number, kind, amount, 400 if error else None, error))
+    return validated
+
+
+def apply_operations(validated, atomic):
+    """Apply validated batch operations through the account store
+
+    In atomic mode nothing is written unless every operation succeeds.
+    Returns (results, applied, failed) with one result dict per operation.
+    """
+    valid = [(account_number, kind, to_cents(amount))
+             for account_number, kind, amount, status, error in validated if status is None]
+    failed = len(validated) - len(valid)
+    outcomes = []
+    # An atomic batch that failed validation is rolled back without touching the store
+    if valid and not (atomic and failed):
+        try:
+            outcomes = accounts.apply_batch(valid, atomic)
+        except BalanceOverflowError as e:
+            # Nothing was written. An atomic batch fails on the deposits to the
+            # account that would overflow; otherwise each operation is applied alone
+            if atomic:
+                outcomes = [(None, None) if op[0] == e.account_number and op[1] == 'deposit' else (True, None)
+                            for op in valid]
+            else:
+                outcomes = [_apply_alone(op) for op in valid]
+    outcomes = iter(outcomes)
+    results = []
+    for account_number, kind, amount, status, error in validated:
+        if status is None:
+            ok, balance = next(outcomes, (True, None))
+            if ok:
+                results.append({'account_number': account_number, 'type': kind, 'status': 200,
+                                'amount': amount, 'balance': None if balance is None else from_cents(balance)})
+                continue
+            failed += 1
+            status = 400
+            if ok is None:
+                error = overflow_message(amount)
+            else:
+                if metrics is not None:
+                    metrics.count_insufficient_funds('batch')
+                error = f"Insufficient funds. Current balance: ${from_cents(balance)}, Requested: ${amount}"
+        results.append({'account_number': account_number, 'type': kind, 'status': status, 'error': error})
+    if atomic and failed:
+        for result in results:
+            if result['status'] == 200:
+                del result['amount'], result['balance']
+                result['status'] = 424
+                result['error'] = "Not applied: another operation in the batch failed"
+        return results, 0, failed
+    return results, len(results) - failed, failed
+
+
+def _apply_alone(operation):
+    # (ok, balance) of one batch operation, with ok None if it would overflow
+    try:
+        return accounts.apply_batch([operation], False)[0]
+    except BalanceOverflowError:
+        return None, None
+
+
+def etag(cents, version):
+    """Entity tag of a balance at a version
+
+    A memory store starts counting versions again when it is rebuilt, so
+    the tag carries the balance too: a tag handed out before a restart can
+    only ever match the same balance.
+    """
+    return f'"{version}-{cents}"'
+
+
+def parse_etags(header, weak):
+    """(version, cents) pairs listed by an If-None-Match or If-Match header
+
+    Returns None for "*". Weak tags count only when weak is true, as for
+    If-None-Match; tags this API never hands out match nothing.
+    """
+    if header.strip() == '*':
+        return None
+    tags = set()
+    for tag in header.split(','):
+        match = ETAG_PATTERN.fullmatch(tag.strip())
+        if match is not None and (weak or match.group(1) is None):
+            tags.add((int(match.group(2)), int(match.group(3))))
+    return tags
+
+
+def get_balance(account_number, if_none_match=None):
+    """Body, status and headers for GET /accounts/<account_number>/balance
+
+    The response carries the balance's ETag; when if_none_match (the
+    If-None-Match header) lists it, the answer is a bodiless 304.
+    """
+    state = accounts.get_versioned(account_number)
+    if state is None:
+        return {"error": "Account not found"}, 404, {}
+    balance, version = state
+    headers = {'ETag': etag(balance, version)}
+    if if_none_match is not None:
+        tags = parse_etags(if_none_match, weak=True)
+        if tags is None or (version, balance) in tags:
+            return None, 304, headers
+
+    return {
+        'account_number': account_number,
+        'balance': from_cents(balance)
+    }, 200, headers
+
+
+def _precondition_failed(balance):
+    return {"error": f"Account has changed. Current balance: ${from_cents(balance)}"}, 412
+
+
+def deposit(account_number, load_json, if_match=None):
+    """Body and status for POST /accounts/<account_number>/deposit
+
+    load_json is called for the request payload only once the account is
+    known to exist, matching the order of checks clients rely on. With
+    if_match (the If-Match header), the deposit is only made while the
+    account is still at one of the listed ETags, else the answer is 412.
+    """
+    if account_number not in accounts:
+        return {"error": "Account not found"}, 404
+    amount, error = parse_amount(load_json(), 'Deposit')
+    if error:
+        return {"error": error}, 400
+    expected = None if if_match is None else parse_etags(if_match, weak=False)
+    try:
+        if expected is None:
+            balance = (write_pipeline or accounts).deposit(account_number, to_cents(amount))
+        else:
+            # Checked and applied under the account lock, bypassing the write pipeline
+            ok, balance = accounts.apply_if(account_number, 'deposit', to_cents(amount), expected)
+            if ok is None:
+                return _precondition_failed(balance)
+    except BalanceOverflowError:
+        return {"error": overflow_message(amount)}, 400
+    return {
+        'message': f'Deposit successful. ${amount} added to account {account_number}',
+        'balance': from_cents(balance)
+    }, 200
+
+
+def withdraw(account_number, load_json, if_match=None):
+    """Body and status for POST /accounts/<account_number>/withdraw
+
+    if_match makes the withdrawal conditional, as for deposit.
+    """
+    if account_number not in accounts:
+        return {"error": "Account not found"}, 404
+    amount, error = parse_amount(load_json(), 'Withdrawal')
+    if error:
+        return {"error": error}, 400
+    expected = None if if_match is None else parse_etags(if_match, weak=False)
+    if expected is None:
+        ok, balance = (write_pipeline or accounts).withdraw(account_number, to_cents(amount))
+    else:
+        ok, balance = accounts.apply_if(account_number, 'withdraw', to_cents(amount), expected)
+        if ok is None:
+            return _precondition_failed(balance)
+    if not ok:
+        if metrics is not None:
+            metrics.count_insufficient_funds('withdraw')
+        return {"error": f"Insufficient funds. Current balance: ${from_cents(balance)}, Requested: ${amount}"}, 400
+    return {
+        'message': f'Withdrawal successful. ${amount} withdrawn from account {account_number}',
+        'balance': from_cents(balance)
+    }, 200
+
+
+def transfer(account_number, load_json):
+    """Body and status for POST /accounts/<account_number>/transfer"""
+    if account_number not in accounts:
+        return {"error": "Account not found"}, 404
+    data = load_json()
+    amount, error = parse_amount(data, 'Transfer')
+    if error:
+        return {"error": error}, 400
+    to_account = data.get('to_account')
+    if not isinstance(to_account, str) or not to_account:
+        return {"error": "Destination account is required"}, 400
+    if to_account == account_number:
+        return {"error": "Cannot transfer to the same account"}, 400
+    if to_account not in accounts:
+        return {"error": "Destination account not found"}, 404
+    try:
+        ok, balance, to_balance = accounts.transfer(account_number, to_account, to_cents(amount))
+    except BalanceOverflowError:
+        return {"error": overflow_message(amount)}, 400
+    if not ok:
+        if metrics is not None:
+            metrics.count_insufficient_funds('transfer')
+        return {"error": f"Insufficient funds. Current balance: ${from_cents(balance)}, Requested: ${amount}"}, 400
+    return {
+        'message': f'Transfer successful. ${amount} moved from account {account_number} to account {to_account}',
+        'balance': from_cents(balance),
+        'to_balance': from_cents(to_balance)
+    }, 200
+
+
+def client_identity(remote_addr, forwarded_for=None):
+    """Address a request came from, as seen by the first trusted proxy"""
+    if TRUSTED_PROXY_HOPS and forwarded_for:
+        hops = forwarded_for.split(',')
+        if len(hops) >= TRUSTED_PROXY_HOPS:
+            return hops[-TRUSTED_PROXY_HOPS].strip()
+    return remote_addr or ''
+
+
+def check_rate_limit(account_number, client):
+    """Return None if the request may proceed, else the 429 (body, status, headers)"""
+    if client_limiter is not None:
+        wait = client_limiter.acquire(client)
+        if wait:
+            return ({"error": "Too many requests from this client"}, 429,
+                    {'Retry-After': str(math.ceil(wait))})
+    # Only existing accounts get a bucket, so requests for made-up account
+    # numbers cannot crowd real accounts' buckets out; they get their 404
+    if account_limiter is not None and account_number is not None and account_number in accounts:
+        wait = account_limiter.acquire(account_number)
+        if wait:
+            return ({"error": f"Too many requests for account {account_number}"}, 429,
+                    {'Retry-After': str(math.ceil(wait))})
+    return None
+
+
+def iter_balances(account_numbers):
+    """Yield one balance or inline error dict per requested account, in order"""
+    get_cents = accounts.get_cents
+    for account_number in account_numbers:
+        if not isinstance(account_number, str):
+            yield {'account_number': account_number, 'error': "Account number must be a string"}
+            continue
+        balance = get_cents(account_number)
+        if balance is None:
+            yield {'account_number': account_number, 'error': "Account not found"}
+        else:
+            yield {'account_number': account_number, 'balance': from_cents(balance)}
+
+
+def check_admin(authorization):
+    """Return None if an Authorization header holds the admin token, else (body, status)"""
+    if not ADMIN_TOKEN:
+        return {"error": "Bulk import and export are disabled"}, 403
+    # Compared in constant time, so the token cannot be guessed byte by byte
+    if not hmac.compare_digest((authorization or '').encode(), f'Bearer {ADMIN_TOKEN}'.encode()):
+        return {"error": "Missing or wrong admin token"}, 401
+    return None
+
+
+def _import_records(lines, output):
+    # Iterator of (account_number, balance) pairs of a CSV or NDJSON upload;
+    # records of the wrong shape come out as None or CSV rows that do not
+    # unpack into two fields. A CSV header row is skipped.
+    if output == 'csv':
+        rows = csv.reader(lines)
+        first = next(rows, None)
+        if first is None or first == ['account_number', 'balance']:
+            return rows
+        return chain([first], rows)
+    return map(_ndjson_record, lines)
+
+
+def _ndjson_record(line):
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    if isinstance(record, dict) and 'account_number' in record and 'balance' in record:
+        return record['account_number'], record['balance']
+    return None
+
+
+def _import_cents(balance):
+    # Balance of an imported record in cents, or None if it is not valid
+    if isinstance(balance, str):
+        try:
+            balance = float(balance)
+        except ValueError:
+            return None
+    elif isinstance(balance, bool) or not isinstance(balance, (int, float)):
+        return None
+    # Also false for NaN
+    if not 0 <= balance <= MAX_BALANCE:
+        return None
+    # Nearest cent; round(balance, 2) first, as parse_amount does, would
+    # double the cost of a CSV row for the same result on 2-decimal input.
+    # Balances just under MAX_BALANCE can round past MAX_CENTS as floats.
+    cents = round(balance * 100)
+    return cents if cents <= MAX_CENTS else None
+
+
+def import_accounts(lines, output):
+    """Create or overwrite accounts from the lines of a CSV or NDJSON upload
+
+    Records are validated as they are read and applied IMPORT_BATCH_SIZE at
+    a time, so the upload is never held in memory. Invalid records are
+    skipped and reported by row number (1-based, header excluded); the
+    valid ones are applied regardless. Returns (body, status).
+
+    Keeping the balance index sorted batch by batch would cost more than
+    the parsing, so it is detached for the import and brought up to date
+    afterwards on a background thread, as at startup. The statistics routes
+    scan the store until it is attached again.
+    """
+    token = accounts.suspend_index() if accounts.balance_index is not None else None
+    try:
+        return _import_accounts(lines, output)
+    finally:
+        if token is not None:
+            threading.Thread(target=accounts.resume_index, args=(token,), name="balance-index", daemon=True).start()
+
+
+def _import_accounts(lines, output):
+    shape_error = ("Row must be account_number,balance" if output == 'csv'
+                   else "Line must be a JSON object with account_number and balance")
+    valid_account = ACCOUNT_NUMBER_PATTERN.fullmatch
+    batch = {}
+    imported = created = failed = 0
+    errors = []
+    for row, record in enumerate(_import_records(lines, output), 1):
+        try:
+            account_number, balance = record
+        except (TypeError, ValueError):
+            error = shape_error
+        else:
+            if not isinstance(account_number, str) or not valid_account(account_number):
+                error = "Account number must be 1 to 24 letters, digits, '-' or '_'"
+            else:
+                cents = _import_cents(balance)
+                if cents is not None:
+                    batch[account_number] = cents
+                    imported += 1
+                    if len(batch) == IMPORT_BATCH_SIZE:
+                        created += accounts.update(batch)
+                        batch = {}
+                    continue
+                error = f"Balance must be a number between 0 and {MAX_BALANCE}"
+        failed += 1
+        if len(errors) < IMPORT_MAX_ERRORS:
+            errors.append({'row': row, 'error': error})
+    if batch:
+        created += accounts.update(batch)
+    if not imported and not failed:
+        return {"error": "No accounts to import"}, 400
+    return {'imported': imported, 'created': created, 'updated': imported - created,
+            'failed': failed, 'errors': errors}, 200
+
+
+def export_accounts(output):
+    """Return an iterator of CSV or NDJSON text chunks holding every account
+
+    The store is captured when this is called, so the export is a
+    point-in-time view: writes pause only while the balances are copied,
+    and later ones do not change it.
+    """
+    pairs = accounts.capture()
+
+    def chunks():
+        if output == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer, lineterminator='\n')
+            writer.writerow(('account_number', 'balance'))
+            while True:
+                rows = list(islice(pairs, EXPORT_CHUNK_ROWS))
+                if not rows:
+                    break
+                writer.writerows([(account_number, from_cents(cents)) for account_number, cents in rows])
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                # No accounts: just the header
+                yield buffer.getvalue()
+            return
+        while True:
+            rows = list(islice(pairs, EXPORT_CHUNK_ROWS))
+            if not rows:
+                break
+            # Formatted directly: json.dumps of a dict per row is several times slower
+            yield ''.join([f'{{"account_number": {encode_basestring(account_number)}, '
+                           f'"balance": {from_cents(cents)!r}}}\n' for account_number, cents in rows])
+
+    return chunks()
+
+
+def idempotent(key, action, account_number, payload, handler):
+    """Run a deposit or withdrawal at most once per Idempotency-Key
+
+    payload is the raw request body; a key reused with a different action,
+    account or body is rejected. Returns (body, status, headers), where the
+    headers mark responses replayed from an earlier request.
+    """
+    if key is None or idempotency_cache is None:
+        body, status = handler()
+        return body, status, {}
+    if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        return {"error": f"Idempotency-Key must be 1 to {IDEMPOTENCY_KEY_MAX_LENGTH} characters"}, 400, {}
+    fingerprint = (action, account_number, hashlib.sha256(payload).digest())
+    body, status, replayed = idempotency_cache.run(key, fingerprint, handler)
+    return body, status, {'Idempotent-Replayed': 'true'} if replayed else {}
+
+
+def parse_history_query(args, stream=False):
+    """Validate the limit and cursor query parameters of a history request
+
+    Returns (limit, cursor, None) or (None, None, error message). The cursor
+    is the id of the last transaction of the previous page. Streamed
+    requests have no upper bound on limit and default to no limit (None).
+    """
+    limit = args.get('limit')
+    cursor = args.get('cursor')
+    if limit is None:
+        limit = None if stream else HISTORY_DEFAULT_LIMIT
+    else:
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            limit = 0
+        if limit < 1 or (limit > HISTORY_MAX_LIMIT and not stream):
+            return None, None, f"Limit must be an integer between 1 and {HISTORY_MAX_LIMIT}"
+    if cursor is not None:
+        try:
+            cursor = int(cursor)
+        except (TypeError, ValueError):
+            cursor = 0
+        if cursor < 1:
+            return None, None, "Cursor must be a positive integer"
+    return limit, cursor, None
+
+
+def iter_transactions(account_number, cursor=None):
+    """Yield transaction dicts for an account, newest first, older than cursor"""
+    history = accounts.history
+    if history is None:
+        return
+    for seq, timestamp, kind, cents, balance in history.iter_records(account_number, cursor):
+        yield {
+            'id': seq,
+            'timestamp': datetime.fromtimestamp(timestamp, timezone.utc).isoformat(),
+            'type': kind,
+            'amount': from_cents(cents),
+            'balance': from_cents(balance)
+        }
+
+
+def list_transactions(account_number, limit, cursor=None):
+    """Body and status for one page of GET /accounts/<account_number>/transactions"""
+    if account_number not in accounts:
+        return {"error": "Account not found"}, 404
+    transactions = []
+    for transaction in iter_transactions(account_number, cursor):
+        if len(transactions) == limit:
+            break
+        transactions.append(transaction)
+    else:
+        # The history was exhausted before the page filled up
+        return {'account_number': account_number, 'transactions': transactions, 'next_cursor': None}, 200
+    return {
+        'account_number': account_number,
+        'transactions': transactions,
+        'next_cursor': transactions[-1]['id']
+    }, 200
+
+
+def _scan_stats(below=None):
+    # (stats, accounts below or None) from one pass over a store without an
+    # index. Only the balances are sorted, as plain int64s in C, to find the
+    # median; no per-account objects are built.
+    ordered = sorted(array('q', [cents for _, cents in accounts.items()]))
+    count = len(ordered)
+    if not count:
+        stats = {'count': 0, 'total': 0, 'min': None, 'max': None, 'median': None}
+    else:
+        middle = count // 2
+        stats = {'count': count, 'total': sum(ordered), 'min': ordered[0], 'max': ordered[-1],
+                 'median': ordered[middle] if count % 2 else (ordered[middle - 1] + ordered[middle]) // 2}
+    return stats, None if below is None else bisect_left(ordered, below)
+
+
+def parse_stats_query(args):
+    """Validate the optional below query parameter; returns (cents or None, error)"""
+    below = args.get('below')
+    if below is None:
+        return None, None
+    try:
+        below = float(below)
+    except ValueError:
+        return None, "Below must be a number"
+    if below != below or below in (float('inf'), float('-inf')):
+        return None, "Below must be a number"
+    return to_cents(round(below, 2)), None
+
+
+def balance_stats(below=None):
+    """Body and status for GET /accounts/stats"""
+    index = accounts.balance_index
+    if index is None:
+        stats, accounts_below = _scan_stats(below)
+    else:
+        stats = index.stats()
+        accounts_below = None if below is None else index.count_below(below)
+    count = stats['count']
+    body = {
+        'accounts': count,
+        'total': from_cents(stats['total']),
+        'mean': round(stats['total'] / count / 100, 2) if count else None,
+        'min': None if stats['min'] is None else from_cents(stats['min']),
+        'median': None if stats['median'] is None else from_cents(stats['median']),
+        'max': None if stats['max'] is None else from_cents(stats['max']),
+    }
+    if below is not None:
+        body['below'] = from_cents(below)
+        body['accounts_below'] = accounts_below
+    return body, 200
+
+
+def parse_top_query(args):
+    """Validate the n query parameter of a top balances request; returns (n, error)"""
+    n = args.get('n')
+    if n is None:
+        return TOP_DEFAULT_N, None
+    try:
+        n = int(n)
+    except ValueError:
+        n = 0
+    if n < 1 or n > TOP_MAX_N:
+        return None, f"N must be an integer between 1 and {TOP_MAX_N}"
+    return n, None
+
+
+def top_balances(n):
+    """Body and status for GET /accounts/top"""
+    index = accounts.balance_index
+    if index is None:
+        # One pass keeping only the n largest, in the index's order
+        top = [(account_number, cents) for cents, account_number in
+               heapq.nlargest(n, ((cents, account_number) for account_number, cents in accounts.items()))]
+    else:
+        top = index.top(n)
+    return {'accounts': [{'account_number': account_number, 'balance': from_cents(cents)}
+                         for account_number, cents in top]}, 200
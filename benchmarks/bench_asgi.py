@@ -0,0 +1,123 @@
+"""Compare gunicorn (WSGI) and the asyncio server (ASGI) at high concurrency
+
+Both servers are started locally: gunicorn with the Dockerfile's settings
+and `python asgi_app.py`. An asyncio load generator then holds the given
+number of keep-alive connections open, each issuing balance reads and
+deposits back to back, and reports throughput and latency percentiles.
+
+    python benchmarks/bench_asgi.py --concurrency 64 512 2048 --seconds 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# app.py pins SERVER_NAME, so requests must carry the production host name
+HOST = 'atm-api-435429241525.us-central1.run.app'
+SERVERS = {
+    'gunicorn': lambda port: ['gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', '1', '--threads', '8',
+                              '--timeout', '0', 'app:app'],
+    'asyncio': lambda port: [sys.executable, 'asgi_app.py'],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+async def wait_until_up(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.05)
+    raise RuntimeError(f'server did not start on port {port}')
+
+
+async def connection(port, stop, write_ratio, latencies, errors):
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    except OSError:
+        errors.append('connect')
+        return
+    body = json.dumps({"amount": 1.0}).encode()
+    deposit = (b'POST /accounts/1001/deposit HTTP/1.1\r\nHost: %s\r\nContent-Type: application/json\r\n'
+               b'Content-Length: %d\r\n\r\n%s' % (HOST.encode(), len(body), body))
+    balance = b'GET /accounts/1002/balance HTTP/1.1\r\nHost: %s\r\n\r\n' % HOST.encode()
+    sent = 0
+    try:
+        while time.perf_counter() < stop:
+            request = deposit if (sent % 100) < write_ratio * 100 else balance
+            sent += 1
+            start = time.perf_counter()
+            writer.write(request)
+            head = await reader.readuntil(b'\r\n\r\n')
+            length = 0
+            for line in head.split(b'\r\n'):
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':', 1)[1])
+            await reader.readexactly(length)
+            if not head.startswith(b'HTTP/1.1 200') and not head.startswith(b'HTTP/1.0 200'):
+                errors.append(head.split(b'\r\n', 1)[0])
+                continue
+            latencies.append(time.perf_counter() - start)
+    except (OSError, asyncio.IncompleteReadError) as exc:
+        errors.append(type(exc).__name__)
+    finally:
+        writer.close()
+
+
+async def load(port, concurrency, seconds, write_ratio):
+    await wait_until_up(port)
+    latencies, errors = [], []
+    stop = time.perf_counter() + seconds
+    await asyncio.gather(*(connection(port, stop, write_ratio, latencies, errors) for _ in range(concurrency)))
+    return sorted(latencies), errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[64, 512, 2048])
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    print(f"{'server':>10}{'conns':>7}{'req/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for concurrency in args.concurrency:
+        for name, command in SERVERS.items():
+            port = free_port()
+            env = dict(os.environ, PORT=str(port))
+            server = subprocess.Popen(command(port), cwd=ROOT, env=env,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                latencies, errors = asyncio.run(load(port, concurrency, args.seconds, args.write_ratio))
+            finally:
+                server.terminate()
+                server.wait()
+            print(f"{name:>10}{concurrency:>7}{len(latencies) / args.seconds:>10,.0f}"
+                  f"{percentile(latencies, 0.50) * 1000:>9.1f}{percentile(latencies, 0.95) * 1000:>9.1f}"
+                  f"{percentile(latencies, 0.99) * 1000:>9.1f}{len(errors):>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Measure what the balance index costs on writes and saves on aggregate reads
+
+Builds a memory store of --accounts random balances and reports the time
+and memory to build the index, the time per deposit and withdrawal with
+and without it (from --threads threads), and the latency of stats,
+count-below and top-100 queries answered by the index against a scan of
+the store.
+
+    python benchmarks/bench_balance_index.py --accounts 1000000 --threads 8
+"""
+import argparse
+import heapq
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from balance_index import BalanceIndex  # noqa: E402
+from store import MemoryAccountStore  # noqa: E402
+
+
+def write_cost(store, numbers, threads, operations):
+    """CPU-bound deposits and withdrawals from several threads; returns seconds per operation"""
+    per_thread = operations // threads
+    barrier = threading.Barrier(threads + 1)
+
+    def run(seed):
+        rng = random.Random(seed)
+        picks = [rng.choice(numbers) for _ in range(per_thread)]
+        barrier.wait()
+        for i, number in enumerate(picks):
+            if i & 1:
+                store.withdraw(number, 100)
+            else:
+                store.deposit(number, 100)
+
+    workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - start) / (per_thread * threads)
+
+
+def timed(function, repeats=5):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def scan_stats(store):
+    balances = sorted(cents for _, cents in store.items())
+    return len(balances), sum(balances), balances[0], balances[-1], balances[len(balances) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--accounts', type=int, default=1000000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--operations', type=int, default=400000, help='deposits and withdrawals per run')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    numbers = [str(10000000 + i) for i in range(args.accounts)]
+    store = MemoryAccountStore({number: rng.randrange(10 ** 6, 10 ** 8) for number in numbers})
+
+    without = write_cost(store, numbers, args.threads, args.operations)
+
+    start = time.perf_counter()
+    index = BalanceIndex(store.items())
+    build = time.perf_counter() - start
+    # Traced separately: tracemalloc slows allocation down several times
+    tracemalloc.start()
+    traced = BalanceIndex(store.items())
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del traced
+    print(f"index build: {build * 1e3:.0f} ms, {memory / 2 ** 20:.1f} MiB "
+          f"({memory / args.accounts:.0f} bytes per account)")
+
+    store.balance_index = index
+    with_index = write_cost(store, numbers, args.threads, args.operations)
+    print(f"deposit/withdraw: {without * 1e6:.2f} us without index, {with_index * 1e6:.2f} us with "
+          f"({(with_index - without) * 1e6:+.2f} us)")
+
+    below = 5 * 10 ** 7
+    print(f"{'query':<14}{'index us':>12}{'scan ms':>12}")
+    for name, indexed, scanned in [
+        ('stats', index.stats, lambda: scan_stats(store)),
+        ('count below', lambda: index.count_below(below),
+         lambda: sum(1 for _, cents in store.items() if cents < below)),
+        ('top 100', lambda: index.top(100),
+         lambda: heapq.nlargest(100, ((cents, number) for number, cents in store.items()))),
+    ]:
+        print(f"{name:<14}{timed(indexed) * 1e6:>12.1f}{timed(scanned, 1) * 1e3:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Compare ops/sec of POST /accounts/batch against the single-operation endpoints
+
+Runs in-process through the Flask test client, so the numbers measure request
+dispatch, JSON handling and balance updates without network overhead.
+
+    python benchmarks/bench_batch.py --operations 20000 --batch-sizes 10 100 1000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, accounts  # noqa: E402
+
+ACCOUNT_NUMBERS = [str(1001 + i) for i in range(100)]
+
+
+def reset_accounts():
+    accounts.clear()
+    accounts.update({number: 100_000_000 for number in ACCOUNT_NUMBERS})
+
+
+def operations(count):
+    for i in range(count):
+        yield {"account_number": ACCOUNT_NUMBERS[i % len(ACCOUNT_NUMBERS)],
+               "type": "deposit" if i % 2 else "withdraw",
+               "amount": 1.25}
+
+
+def bench_single(client, count):
+    reset_accounts()
+    start = time.perf_counter()
+    for op in operations(count):
+        response = client.post(f"/accounts/{op['account_number']}/{op['type']}",
+                               data=json.dumps({"amount": op['amount']}),
+                               content_type='application/json')
+        assert response.status_code == 200, response.data
+    return count / (time.perf_counter() - start)
+
+
+def bench_batch(client, count, batch_size, mode):
+    reset_accounts()
+    ops = list(operations(count))
+    start = time.perf_counter()
+    for offset in range(0, count, batch_size):
+        response = client.post('/accounts/batch',
+                               data=json.dumps({"mode": mode, "operations": ops[offset:offset + batch_size]}),
+                               content_type='application/json')
+        assert response.status_code == 200, response.data
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--operations', type=int, default=20000)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[10, 100, 1000])
+    args = parser.parse_args()
+
+    app.config['SERVER_NAME'] = None
+    client = app.test_client()
+
+    baseline = bench_single(client, args.operations)
+    print(f"{'endpoint':<28}{'ops/sec':>12}{'speedup':>10}")
+    print(f"{'single deposit/withdraw':<28}{baseline:>12,.0f}{1.0:>9.1f}x")
+    for mode in ('atomic', 'independent'):
+        for size in args.batch_sizes:
+            rate = bench_batch(client, args.operations, size, mode)
+            print(f"{f'batch {mode} x{size}':<28}{rate:>12,.0f}{rate / baseline:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Measure memory and time of bulk balance lookups as the number of IDs grows
+
+Sends POST /accounts/balances through the Flask WSGI app with a text/plain
+body of account numbers read from a temporary file, consumes the streamed
+response chunk by chunk, and reports the time per ID and, in a second run,
+the peak Python memory allocated while serving it (tracemalloc). Half of the
+IDs exist, half are reported as missing. For comparison, the same number of single GET
+/balance requests is timed for the smallest size.
+
+    python benchmarks/bench_bulk_balances.py --sizes 1000 100000 1000000
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, accounts  # noqa: E402
+
+HOST = 'atm-api-435429241525.us-central1.run.app'
+
+
+def environ_for(method, path, body_file=None, length=0, query=''):
+    return {
+        'REQUEST_METHOD': method, 'PATH_INFO': path, 'SCRIPT_NAME': '', 'QUERY_STRING': query,
+        'SERVER_NAME': HOST, 'SERVER_PORT': '443', 'HTTP_HOST': HOST, 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'CONTENT_TYPE': 'text/plain', 'CONTENT_LENGTH': str(length),
+        'wsgi.url_scheme': 'https', 'wsgi.input': body_file or io.BytesIO(), 'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False, 'wsgi.version': (1, 0),
+    }
+
+
+def start_response(status, headers, exc_info=None):
+    assert status == '200 OK', status
+
+
+def bulk(path, output):
+    """Send the IDs in path as one request; returns (seconds, response bytes)"""
+    with open(path, 'rb') as body:
+        environ = environ_for('POST', '/accounts/balances', body, os.path.getsize(path), f'format={output}')
+        received = 0
+        start = time.perf_counter()
+        response = app.wsgi_app(environ, start_response)
+        for chunk in response:
+            received += len(chunk)
+        response.close()
+        return time.perf_counter() - start, received
+
+
+def peak_memory(path, output):
+    # Traced separately: tracemalloc slows allocation down several times
+    tracemalloc.start()
+    try:
+        bulk(path, output)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def write_ids(path, size):
+    with open(path, 'w') as f:
+        # Even IDs exist, odd ones do not
+        for i in range(size):
+            f.write(f'{20000000 + i}\n')
+
+
+def single_gets(count):
+    start = time.perf_counter()
+    for i in range(count):
+        response = app.wsgi_app(environ_for('GET', f'/accounts/{20000000 + i * 2}/balance'), start_response)
+        for _ in response:
+            pass
+        response.close()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--format', choices=['json', 'ndjson'], default='ndjson')
+    args = parser.parse_args()
+
+    accounts.clear()
+    accounts.update({str(20000000 + i): 10000 for i in range(0, max(args.sizes), 2)})
+    print(f"{'ids':>10} {'peak KiB':>10} {'us/id':>8} {'response MiB':>13}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'ids')
+        write_ids(path, 100)
+        bulk(path, args.format)
+        for size in args.sizes:
+            write_ids(path, size)
+            elapsed, received = bulk(path, args.format)
+            peak = peak_memory(path, args.format)
+            print(f"{size:>10} {peak / 1024:>10.1f} {elapsed / size * 1e6:>8.2f} {received / 2 ** 20:>13.1f}")
+    smallest = min(args.sizes)
+    existing = (smallest + 1) // 2
+    print(f"{existing} single GET /balance requests: {single_gets(existing) / existing * 1e6:.2f} us/id")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Compare poll-heavy balance traffic with and without conditional requests
+
+Clients poll the balances of --accounts accounts round-robin while one
+deposit every --write-every polls changes one of them. Plain polling gets
+the full JSON body every time. Conditional polling sends the last ETag seen
+for the account in If-None-Match and gets a bodiless 304 while the balance
+is unchanged. Each WSGI stack (Flask, fast path) is called directly with a
+prepared environ, so the numbers are the CPU time per poll and the bytes of
+each response (status line, headers and body), without server or socket
+work. Deposits go straight to the store and are not counted as polls.
+
+    python benchmarks/bench_conditional.py --requests 20000 --accounts 100 --write-every 50
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.test import EnvironBuilder  # noqa: E402
+
+import fastpath  # noqa: E402
+from app import app, accounts  # noqa: E402
+
+HOST = 'atm-api-435429241525.us-central1.run.app'
+FIRST_ACCOUNT = 10000000
+
+
+def base_environ():
+    builder = EnvironBuilder(path=f'/accounts/{FIRST_ACCOUNT}/balance', method='GET', base_url=f'http://{HOST}')
+    try:
+        return builder.get_environ()
+    finally:
+        builder.close()
+
+
+def poll(wsgi_app, environ, numbers, requests, write_every, conditional):
+    """Return (CPU seconds per poll, bytes per response, share of 304 answers)"""
+    response = {}
+    tags = {}
+    sent = 0
+    not_modified = 0
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = status
+        response['headers'] = headers
+
+    start = time.process_time()
+    for i in range(requests):
+        if write_every and i % write_every == 0:
+            accounts.deposit(numbers[(i // write_every) % len(numbers)], 1)
+        number = numbers[i % len(numbers)]
+        request_environ = environ.copy()
+        request_environ['PATH_INFO'] = f'/accounts/{number}/balance'
+        if conditional and number in tags:
+            request_environ['HTTP_IF_NONE_MATCH'] = tags[number]
+        body = b''.join(wsgi_app(request_environ, start_response))
+        headers = response['headers']
+        sent += len(response['status']) + sum(len(name) + len(value) + 4 for name, value in headers) + len(body)
+        if response['status'].startswith('304'):
+            not_modified += 1
+        for name, value in headers:
+            if name == 'ETag':
+                tags[number] = value
+    elapsed = time.process_time() - start
+    return elapsed / requests, sent / requests, not_modified / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20000, help='polls per stack and mode')
+    parser.add_argument('--accounts', type=int, default=100, help='accounts polled round-robin')
+    parser.add_argument('--write-every', type=int, default=50, help='polls per deposit (0: no writes)')
+    args = parser.parse_args()
+
+    numbers = [str(FIRST_ACCOUNT + i) for i in range(args.accounts)]
+    accounts.update({number: 100_000_000 for number in numbers})
+    environ = base_environ()
+    stacks = [('flask', app.wsgi_app), ('fast path', fastpath.FastPathMiddleware(app))]
+    print(f"{'stack':<11}{'polling':<13}{'us/poll':>9}{'bytes/resp':>12}{'304s':>7}")
+    for name, wsgi_app in stacks:
+        for conditional in (False, True):
+            # Warm up before timing
+            poll(wsgi_app, environ, numbers, 200, args.write_every, conditional)
+            cpu, size, share = poll(wsgi_app, environ, numbers, args.requests, args.write_every, conditional)
+            print(f"{name:<11}{'conditional' if conditional else 'plain':<13}{cpu * 1e6:>9.1f}"
+                  f"{size:>12.0f}{share:>7.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Compare per-request CPU time of the fast-path dispatcher with the Flask stack
+
+Calls each WSGI callable directly with a prepared environ, so the numbers are
+the CPU cost of routing, dispatch, JSON handling and the balance update alone,
+without any server or socket work.
+
+    python benchmarks/bench_fastpath.py --requests 20000
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.test import EnvironBuilder  # noqa: E402
+
+import fastpath  # noqa: E402
+from app import app, accounts  # noqa: E402
+
+HOST = 'atm-api-435429241525.us-central1.run.app'
+ROUTES = [
+    ('balance', 'GET', '/accounts/1001/balance', None),
+    ('deposit', 'POST', '/accounts/1001/deposit', {"amount": 1.25}),
+    ('withdraw', 'POST', '/accounts/1001/withdraw', {"amount": 1.25}),
+]
+
+
+def environ_for(method, path, payload):
+    builder = EnvironBuilder(path=path, method=method, base_url=f'http://{HOST}',
+                             data=None if payload is None else json.dumps(payload),
+                             content_type=None if payload is None else 'application/json')
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+    body = environ['wsgi.input'].read()
+    return environ, body
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def cpu_per_request(wsgi_app, environ, body, count):
+    start = time.process_time()
+    for _ in range(count):
+        request_environ = environ.copy()
+        request_environ['wsgi.input'] = io.BytesIO(body)
+        for chunk in wsgi_app(request_environ, start_response):
+            pass
+    return (time.process_time() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20000, help='requests per route and stack')
+    args = parser.parse_args()
+
+    accounts.update({"1001": 100_000_000})
+    flask_wsgi = app.wsgi_app
+    fast_wsgi = fastpath.FastPathMiddleware(app)
+    print(f"{'route':<10} {'flask us/req':>13} {'fast us/req':>12} {'speedup':>8}")
+    for name, method, path, payload in ROUTES:
+        environ, body = environ_for(method, path, payload)
+        # Warm up both stacks before timing
+        cpu_per_request(flask_wsgi, environ, body, 200)
+        cpu_per_request(fast_wsgi, environ, body, 200)
+        flask_cpu = cpu_per_request(flask_wsgi, environ, body, args.requests)
+        fast_cpu = cpu_per_request(fast_wsgi, environ, body, args.requests)
+        print(f"{name:<10} {flask_cpu * 1e6:>13.1f} {fast_cpu * 1e6:>12.1f} {flask_cpu / fast_cpu:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Time bulk account import and export through the Flask app
+
+Writes an upload of --accounts random balances to a temporary file, streams
+it into POST /accounts/import and reads GET /accounts/export back, both
+through the WSGI app with no server, for each format. While the export
+runs, a thread keeps depositing and its worst latency is compared with the
+same deposits on an idle store, to show the export does not block writes.
+The time the balance index takes to catch up after each import is reported
+too.
+
+    python benchmarks/bench_import_export.py --accounts 10000000
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Import and export are disabled without an admin token
+os.environ['ATM_ADMIN_TOKEN'] = 'bench'
+
+from werkzeug.test import EnvironBuilder  # noqa: E402
+
+from app import BULK_FORMATS, app, accounts  # noqa: E402
+
+HOST = 'atm-api-435429241525.us-central1.run.app'
+
+
+def write_upload(path, output, count):
+    rng = random.Random(1)
+    with open(path, 'w') as f:
+        if output == 'csv':
+            f.write('account_number,balance\n')
+        for start in range(0, count, 100000):
+            lines = []
+            for i in range(start, min(start + 100000, count)):
+                balance = rng.randrange(10 ** 8) / 100
+                if output == 'csv':
+                    lines.append(f'{10000000 + i},{balance}\n')
+                else:
+                    lines.append(f'{{"account_number": "{10000000 + i}", "balance": {balance}}}\n')
+            f.write(''.join(lines))
+
+
+def call(method, path, content_type=None, input_stream=None, length=None):
+    builder = EnvironBuilder(path=path, method=method, base_url=f'http://{HOST}', content_type=content_type,
+                             input_stream=input_stream, content_length=length,
+                             headers={'Authorization': 'Bearer bench'})
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+    status = []
+    body = app.wsgi_app(environ, lambda line, headers, exc_info=None: status.append(line))
+    size = 0
+    for chunk in body:
+        size += len(chunk)
+    if hasattr(body, 'close'):
+        body.close()
+    return status[0], size
+
+
+def deposit_latencies(stop, latencies):
+    numbers = ['10000000', '10000001', '10000002']
+    while not stop.is_set():
+        start = time.perf_counter()
+        accounts.deposit(numbers[len(latencies) % 3], 1)
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.001)
+
+
+def worst_deposit(seconds=None, during=None):
+    """Worst and 99th percentile latency of a deposit loop, over seconds or while during() runs"""
+    stop = threading.Event()
+    latencies = []
+    worker = threading.Thread(target=deposit_latencies, args=(stop, latencies))
+    worker.start()
+    result = during() if during else time.sleep(seconds)
+    stop.set()
+    worker.join()
+    latencies.sort()
+    return result, latencies[-1], latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--accounts', type=int, default=10000000)
+    parser.add_argument('--formats', default='csv,ndjson')
+    args = parser.parse_args()
+
+    for output in args.formats.split(','):
+        accounts.clear()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, f'accounts.{output}')
+            write_upload(path, output, args.accounts)
+            size = os.path.getsize(path)
+            with open(path, 'rb') as upload:
+                wall, cpu = time.perf_counter(), time.process_time()
+                status, _ = call('POST', f'/accounts/import?format={output}', BULK_FORMATS[output], upload, size)
+                wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        print(f"{output} import: {status}, {len(accounts):,} accounts from {size / 2 ** 20:.0f} MiB "
+              f"in {wall:.1f} s ({cpu:.1f} s CPU, {args.accounts / wall:,.0f} accounts/s)")
+        # The balance index is brought up to date after the response
+        indexing = [thread for thread in threading.enumerate() if thread.name == 'balance-index']
+        if indexing:
+            wall = time.perf_counter()
+            for thread in indexing:
+                thread.join()
+            print(f"{output} balance index attached {time.perf_counter() - wall:.1f} s after the import")
+
+        _, idle_worst, idle_p99 = worst_deposit(seconds=2)
+        wall = time.perf_counter()
+        (status, size), worst, p99 = worst_deposit(during=lambda: call('GET', f'/accounts/export?format={output}'))
+        wall = time.perf_counter() - wall
+        print(f"{output} export: {status}, {size / 2 ** 20:.0f} MiB in {wall:.1f} s "
+              f"({args.accounts / wall:,.0f} accounts/s)")
+        print(f"deposit latency idle / during export: p99 {idle_p99 * 1e3:.2f} / {p99 * 1e3:.2f} ms, "
+              f"worst {idle_worst * 1e3:.2f} / {worst * 1e3:.2f} ms")
+    print(f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10:,.0f} MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Measure acknowledged writes/sec with the write-ahead journal
+
+Each run drives MemoryAccountStore.deposit from several threads. A deposit
+counts once it returns, i.e. once its journal record has been fsynced.
+
+    python benchmarks/bench_journal.py --threads 8 --seconds 2 \
+        --fsync-intervals 0 0.001 0.005 --batch-sizes 64 512
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from journal import Journal  # noqa: E402
+from store import MemoryAccountStore  # noqa: E402
+
+
+def run(threads, seconds, journal):
+    store = MemoryAccountStore({str(1000 + i): 0 for i in range(1000)}, journal=journal)
+    stop = time.perf_counter() + seconds
+    counts = [0] * threads
+
+    def worker(n):
+        account_number = str(1000 + n)
+        done = 0
+        while time.perf_counter() < stop:
+            store.deposit(account_number, 1)
+            done += 1
+        counts[n] = done
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return sum(counts) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=2.0)
+    parser.add_argument('--fsync-intervals', type=float, nargs='+', default=[0.0, 0.001, 0.005])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[64, 512])
+    parser.add_argument('--dir', default=None, help='directory for journal files (default: a temp dir)')
+    args = parser.parse_args()
+
+    print(f"{'fsync interval':>15}{'batch size':>12}{'writes/sec':>12}{'records/fsync':>15}")
+    print(f"{'no journal':>15}{'-':>12}{run(args.threads, args.seconds, None):>12,.0f}{'-':>15}")
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for interval in args.fsync_intervals:
+            for batch_size in args.batch_sizes:
+                path = os.path.join(tmp, f'journal-{interval}-{batch_size}')
+                journal = Journal(path, fsync_interval=interval, batch_size=batch_size)
+                rate = run(args.threads, args.seconds, journal)
+                stats = journal.stats()
+                journal.close()
+                per_fsync = stats['records'] / max(stats['fsyncs'], 1)
+                print(f"{interval:>15}{batch_size:>12}{rate:>12,.0f}{per_fsync:>15.1f}")
+
+
+if __name__ == '__main__':
+    main()
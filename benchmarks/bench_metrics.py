@@ -0,0 +1,72 @@
+"""Measure the per-request CPU cost of recording metrics
+
+Runs the balance, deposit and withdraw routes through the Flask stack and
+the fast path with ATM_METRICS=1 and ATM_METRICS=0, each in a fresh process,
+and reports CPU time per request and the overhead of instrumentation. The
+on and off processes alternate for several rounds and the fastest time of
+each is kept, so machine noise does not land on one side only.
+
+    python benchmarks/bench_metrics.py --requests 20000 --rounds 5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def child(stack, requests, repeats):
+    from bench_fastpath import ROUTES, cpu_per_request, environ_for
+
+    import fastpath
+    from app import app, accounts
+
+    accounts.update({"1001": 100_000_000})
+    wsgi_app = fastpath.FastPathMiddleware(app) if stack == 'fast path' else app.wsgi_app
+    timings = {}
+    for name, method, path, payload in ROUTES:
+        environ, body = environ_for(method, path, payload)
+        cpu_per_request(wsgi_app, environ, body, 200)
+        # Best of several runs to keep scheduler noise out of a small difference
+        timings[name] = min(cpu_per_request(wsgi_app, environ, body, requests) for _ in range(repeats))
+    print(json.dumps(timings))
+
+
+def measure(stack, enabled, args):
+    env = {k: v for k, v in os.environ.items() if not k.startswith('ATM_')}
+    env['ATM_METRICS'] = '1' if enabled else '0'
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', stack,
+                                      '--requests', str(args.requests), '--repeats', str(args.repeats)],
+                                     env=env, text=True)
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20000, help='requests per route and run')
+    parser.add_argument('--repeats', type=int, default=3, help='runs per route in each process')
+    parser.add_argument('--rounds', type=int, default=3, help='alternating on/off processes per stack')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.requests, args.repeats)
+        return
+
+    print(f"{'stack':<10} {'route':<10} {'off us/req':>11} {'on us/req':>10} {'overhead':>9}")
+    for stack in ('flask', 'fast path'):
+        off = {}
+        on = {}
+        for _ in range(args.rounds):
+            for enabled, best in ((False, off), (True, on)):
+                for route, seconds in measure(stack, enabled, args).items():
+                    best[route] = min(seconds, best.get(route, seconds))
+        for route in off:
+            print(f"{stack:<10} {route:<10} {off[route] * 1e6:>11.2f} {on[route] * 1e6:>10.2f} "
+                  f"{(on[route] - off[route]) * 1e6:>+7.2f}us")
+
+
+if __name__ == '__main__':
+    main()
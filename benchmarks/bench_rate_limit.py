@@ -0,0 +1,109 @@
+"""Measure the cost of rate limiting, alone and on the request path, under threads
+
+First times RateLimiter.acquire() from 1 and --threads threads over many
+keys, with the default 64 lock shards and with a single shared lock. Then drives the balance and
+deposit routes from --threads threads through the Flask stack and the fast
+path with both limiters off and on (limits high enough that nothing is
+throttled) and reports requests per second. Off and on runs alternate for
+several rounds and the best of each is kept, so machine noise does not land
+on one side only.
+
+    python benchmarks/bench_rate_limit.py --threads 8 --requests 20000 --rounds 5
+"""
+import argparse
+import io
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_fastpath import ROUTES, environ_for, start_response  # noqa: E402
+
+import banking  # noqa: E402
+import fastpath  # noqa: E402
+from app import app, accounts  # noqa: E402
+from ratelimit import RateLimiter  # noqa: E402
+
+# Never reached, so every request pays for the check and none is rejected
+UNLIMITED = 1e9
+
+
+def run_threads(threads, work):
+    """Run work(index) on threads started together; returns elapsed seconds"""
+    barrier = threading.Barrier(threads + 1)
+
+    def run(index):
+        barrier.wait()
+        work(index)
+
+    workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def acquire_cost(shards, threads, count):
+    limiter = RateLimiter(UNLIMITED, UNLIMITED, shards=shards)
+    keys = [str(10000000 + i) for i in range(10000)]
+
+    def work(index):
+        acquire = limiter.acquire
+        for i in range(count):
+            acquire(keys[(index * 7919 + i) % len(keys)])
+
+    return run_threads(threads, work) / (threads * count)
+
+
+def requests_per_second(wsgi_app, threads, count):
+    prepared = [environ_for(method, path, payload) for name, method, path, payload in ROUTES
+                if name in ('balance', 'deposit')]
+
+    def work(index):
+        for i in range(count):
+            environ, body = prepared[i & 1]
+            environ = environ.copy()
+            environ['wsgi.input'] = io.BytesIO(body)
+            environ['REMOTE_ADDR'] = f'10.0.{index}.{i % 250}'
+            for _ in wsgi_app(environ, start_response):
+                pass
+
+    return threads * count / run_threads(threads, work)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=20000, help='requests per thread')
+    parser.add_argument('--rounds', type=int, default=3, help='alternating off/on runs per stack')
+    args = parser.parse_args()
+
+    print(f"{'acquire':<22}{'1 thread ns':>12}{f'{args.threads} threads ns':>14}")
+    for shards in (64, 1):
+        single = acquire_cost(shards, 1, args.requests * 5)
+        many = acquire_cost(shards, args.threads, args.requests * 5)
+        print(f"{f'{shards} shard(s)':<22}{single * 1e9:>12.0f}{many * 1e9:>14.0f}")
+
+    accounts.update({"1001": 10 ** 12})
+    stacks = [('flask', app.wsgi_app), ('fast path', fastpath.FastPathMiddleware(app))]
+    print(f"\n{'stack':<12}{'off req/s':>12}{'on req/s':>12}{'change':>9}")
+    for name, wsgi_app in stacks:
+        requests_per_second(wsgi_app, args.threads, 200)
+        off = on = 0
+        for _ in range(args.rounds):
+            banking.account_limiter = banking.client_limiter = None
+            off = max(off, requests_per_second(wsgi_app, args.threads, args.requests))
+            banking.account_limiter = RateLimiter(UNLIMITED, UNLIMITED)
+            banking.client_limiter = RateLimiter(UNLIMITED, UNLIMITED)
+            on = max(on, requests_per_second(wsgi_app, args.threads, args.requests))
+        print(f"{name:<12}{off:>12,.0f}{on:>12,.0f}{on / off - 1:>+9.1%}")
+
+
+if __name__ == '__main__':
+    main()
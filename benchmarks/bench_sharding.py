@@ -0,0 +1,240 @@
+"""Measure req/s through the shard router with 1, 2 and 4 shards, then a live rebalance
+
+Each run starts the shards as separate gunicorn processes with the
+Dockerfile's settings (one worker, 8 threads) and the router in front of
+them (one worker, 32 threads). --accounts accounts are imported into the
+shard owning each one, then client processes drive the router over
+keep-alive connections with a mix of balance reads and deposits to random
+accounts.
+
+The rebalance run starts one shard more than the largest count, routes to
+all but that one, and adds it with PUT /router/shards while the clients keep
+running. Afterwards every shard's export is read back to confirm each
+account is on its new shard and no deposit was lost.
+
+    python benchmarks/bench_sharding.py --shards 1 2 4 --seconds 10 --accounts 100000
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sharding import HashRing  # noqa: E402
+
+# app.py pins SERVER_NAME, so requests must carry the production host name
+HOST = 'atm-api-435429241525.us-central1.run.app'
+TOKEN = 'bench'
+FIRST_ACCOUNT = 10000000
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'gunicorn did not start on port {port}')
+
+
+def start(module, threads, env=None):
+    port = free_port()
+    env = dict({k: v for k, v in os.environ.items() if not k.startswith('ATM_')}, **(env or {}))
+    server = subprocess.Popen(
+        ['gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', '1', '--threads', str(threads),
+         '--timeout', '0', module],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return server, port
+
+
+def cpu_seconds(server):
+    """CPU time used so far by a gunicorn master and its workers (Linux only)"""
+    pids = [server.pid]
+    with open(f'/proc/{server.pid}/task/{server.pid}/children') as f:
+        pids += f.read().split()
+    total = 0
+    for pid in pids:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        total += int(fields[11]) + int(fields[12])
+    return total / os.sysconf('SC_CLK_TCK')
+
+
+def call(port, method, path, body=None, headers=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+    try:
+        conn.request(method, path, body, dict({'Host': HOST}, **(headers or {})))
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def seed(ports, ring, count):
+    # 100.00 in every account, imported straight into the shard owning it
+    owned = {url: [] for url in ring.nodes}
+    for number in range(FIRST_ACCOUNT, FIRST_ACCOUNT + count):
+        owned[ring.node_for(str(number))].append(f'{number},100\n')
+    for url, lines in owned.items():
+        status, body = call(ports[url], 'POST', '/accounts/import?format=csv', ''.join(lines),
+                            {'Content-Type': 'text/csv', 'Authorization': f'Bearer {TOKEN}'})
+        if status != 200:
+            raise RuntimeError(f'seeding {url} failed: {body[:200]!r}')
+
+
+def client(port, seconds, connections, write_ratio, count, results):
+    from concurrent.futures import ThreadPoolExecutor
+
+    def drive(n):
+        rng = random.Random(n)
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        body = json.dumps({"amount": 1.0})
+        done = deposits = 0
+        stop = time.perf_counter() + seconds
+        while time.perf_counter() < stop:
+            account = FIRST_ACCOUNT + rng.randrange(count)
+            if rng.random() < write_ratio:
+                conn.request('POST', f'/accounts/{account}/deposit', body,
+                             {'Host': HOST, 'Content-Type': 'application/json'})
+                deposits += 1
+            else:
+                conn.request('GET', f'/accounts/{account}/balance', headers={'Host': HOST})
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                raise RuntimeError(f'unexpected status {response.status}')
+            done += 1
+        conn.close()
+        return done, deposits
+
+    with ThreadPoolExecutor(connections) as pool:
+        totals = list(pool.map(drive, range(connections)))
+    results.put((sum(t[0] for t in totals), sum(t[1] for t in totals)))
+
+
+class Cluster:
+    """Shard processes plus the router, routing to the first routed shards"""
+
+    def __init__(self, shards, routed, args):
+        self.servers = []
+        self.ports = {}
+        for _ in range(shards):
+            server, port = start('app:app', 8, {'ATM_ADMIN_TOKEN': TOKEN})
+            self.servers.append(server)
+            self.ports[f'http://127.0.0.1:{port}'] = port
+        self.urls = list(self.ports)
+        for port in self.ports.values():
+            wait_until_up(port)
+        self.ring = HashRing(self.urls[:routed])
+        seed(self.ports, self.ring, args.accounts)
+        server, self.port = start('router:application', 32, {'ATM_SHARDS': ','.join(self.urls[:routed]),
+                                                             'ATM_ROUTER_ADMIN_TOKEN': TOKEN,
+                                                             'ATM_ADMIN_TOKEN': TOKEN})
+        self.servers.append(server)
+        wait_until_up(self.port)
+
+    def cpu(self):
+        """CPU seconds used by the router and by all shards together"""
+        shards = sum(cpu_seconds(server) for server in self.servers[:-1])
+        return cpu_seconds(self.servers[-1]), shards
+
+    def load(self, args):
+        results = multiprocessing.Queue()
+        clients = [multiprocessing.Process(target=client, args=(self.port, args.seconds, args.connections,
+                                                                args.write_ratio, args.accounts, results))
+                   for _ in range(args.clients)]
+        for process in clients:
+            process.start()
+        return clients, results
+
+    def close(self):
+        for server in self.servers:
+            server.terminate()
+            server.wait()
+
+
+def collect(clients, results):
+    totals = [results.get() for _ in clients]
+    for process in clients:
+        process.join()
+    return sum(t[0] for t in totals), sum(t[1] for t in totals)
+
+
+def check_placement(cluster, ring, count):
+    """Return (accounts on their shard, total cents) as read from every shard's export"""
+    placed = total = 0
+    for url, port in cluster.ports.items():
+        _, body = call(port, 'GET', '/accounts/export?format=csv', headers={'Authorization': f'Bearer {TOKEN}'})
+        for line in body.decode().splitlines()[1:]:
+            number, balance = line.split(',')
+            if FIRST_ACCOUNT <= int(number) < FIRST_ACCOUNT + count and ring.node_for(number) == url:
+                placed += 1
+                total += round(float(balance) * 100)
+    return placed, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--accounts', type=int, default=100000)
+    parser.add_argument('--clients', type=int, default=4, help='load generator processes')
+    parser.add_argument('--connections', type=int, default=8, help='keep-alive connections per client')
+    parser.add_argument('--write-ratio', type=float, default=0.5)
+    args = parser.parse_args()
+
+    print(f"cores: {os.cpu_count()}")
+    print(f"{'shards':>8}{'req/s':>12}{'scaling':>9}{'router CPU us/req':>19}{'shard CPU us/req':>18}")
+    baseline = None
+    for shards in args.shards:
+        cluster = Cluster(shards, shards, args)
+        try:
+            router_cpu, shard_cpu = cluster.cpu()
+            requests = collect(*cluster.load(args))[0]
+            router_cpu, shard_cpu = (after - before for after, before in zip(cluster.cpu(), (router_cpu, shard_cpu)))
+        finally:
+            cluster.close()
+        rate = requests / args.seconds
+        baseline = baseline or rate
+        print(f"{shards:>8}{rate:>12,.0f}{rate / baseline:>8.2f}x"
+              f"{router_cpu / requests * 1e6:>19,.0f}{shard_cpu / requests * 1e6:>18,.0f}")
+
+    shards = max(args.shards)
+    cluster = Cluster(shards + 1, shards, args)
+    try:
+        clients, results = cluster.load(args)
+        time.sleep(args.seconds / 3)
+        status, body = call(cluster.port, 'PUT', '/router/shards', json.dumps({"shards": cluster.urls}),
+                            {'Content-Type': 'application/json', 'Authorization': f'Bearer {TOKEN}'})
+        if status != 200:
+            raise RuntimeError(f'rebalance failed: {body[:200]!r}')
+        result = json.loads(body)
+        requests, deposits = collect(clients, results)
+        placed, total = check_placement(cluster, HashRing(cluster.urls), args.accounts)
+    finally:
+        cluster.close()
+    expected = args.accounts * 10000 + deposits * 100
+    print(f"\nadding shard {shards + 1} under load: moved {result['moved']:,} accounts "
+          f"({result['moved'] / args.accounts:.1%}, ideal {1 / (shards + 1):.1%}) in {result['seconds']:.2f} s")
+    print(f"{requests / args.seconds:,.0f} req/s during the run, all accounts on their shard: "
+          f"{placed == args.accounts}, no lost deposits: {total == expected}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Measure cold-start time to the first served /balance with a large dataset
+
+For each size, the same accounts are written once as a snapshot and once as
+a JSON file. A fresh interpreter then imports the app and serves one balance
+request, either mmap'ing the snapshot (ATM_SNAPSHOT_PATH) or parsing the JSON
+into the store as a plain startup would.
+
+    python benchmarks/bench_snapshot_startup.py --sizes 1000000 10000000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from snapshot import write_snapshot  # noqa: E402
+
+FIRST_REQUEST = r'''
+import json, os, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+from app import app, accounts
+if {json_path!r}:
+    with open({json_path!r}) as f:
+        accounts.update(json.load(f))
+app.config['SERVER_NAME'] = None
+response = app.test_client().get('/accounts/{probe}/balance')
+assert response.status_code == 200, response.data
+print(time.perf_counter() - start)
+'''
+
+
+def dataset(size):
+    return ((str(10000000 + i), (i % 100000) * 100 + 25) for i in range(size))
+
+
+def first_response(size, snapshot_path=None, json_path=None):
+    env = dict(os.environ, ATM_SNAPSHOT_INTERVAL='0')
+    if snapshot_path:
+        env['ATM_SNAPSHOT_PATH'] = snapshot_path
+    script = FIRST_REQUEST.format(root=ROOT, json_path=json_path, probe=10000000 + size // 2)
+    return float(subprocess.check_output([sys.executable, '-c', script], env=env, text=True))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000_000, 10_000_000])
+    parser.add_argument('--dir', default=None, help='directory for generated files (default: a temp dir)')
+    args = parser.parse_args()
+
+    print(f"{'accounts':>12}{'source':>10}{'file MiB':>10}{'write s':>9}{'first /balance s':>18}")
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for size in args.sizes:
+            snapshot_path = os.path.join(tmp, f'{size}.snapshot')
+            start = time.perf_counter()
+            write_snapshot(snapshot_path, dataset(size))
+            written = time.perf_counter() - start
+            elapsed = first_response(size, snapshot_path=snapshot_path)
+            mib = os.path.getsize(snapshot_path) / 2**20
+            print(f"{size:>12,}{'snapshot':>10}{mib:>10.1f}{written:>9.2f}{elapsed:>18.3f}")
+            os.remove(snapshot_path)
+
+            json_path = os.path.join(tmp, f'{size}.json')
+            start = time.perf_counter()
+            with open(json_path, 'w') as f:
+                json.dump(dict(dataset(size)), f)
+            written = time.perf_counter() - start
+            elapsed = first_response(size, json_path=json_path)
+            mib = os.path.getsize(json_path) / 2**20
+            print(f"{size:>12,}{'json':>10}{mib:>10.1f}{written:>9.2f}{elapsed:>18.3f}")
+            os.remove(json_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Compare the SQLite store with the in-memory store, from 1 and several threads
+
+Loads --accounts accounts into each store, then times balance reads,
+deposits and withdrawals called directly on the store (no HTTP), from one
+thread and from --threads threads, and reports operations per second and
+the 99th percentile latency. The SQLite store runs with synchronous=FULL
+(an fsync per commit) and NORMAL (fsync at checkpoints only), on a database
+in --dir.
+
+    python benchmarks/bench_sqlite_store.py --accounts 100000 --ops 20000 --threads 8
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlite_store import SQLiteAccountStore  # noqa: E402
+from store import MemoryAccountStore  # noqa: E402
+
+FIRST_ACCOUNT = 10000000
+
+
+def operation(store, kind):
+    if kind == 'balance':
+        return store.get_cents
+    if kind == 'deposit':
+        return lambda account_number: store.deposit(account_number, 100)
+    return lambda account_number: store.withdraw(account_number, 100)
+
+
+def run(store, kind, threads, ops, accounts):
+    """Return (operations per second, p99 latency in seconds)"""
+    call = operation(store, kind)
+    barrier = threading.Barrier(threads + 1)
+    latencies = []
+
+    def work(seed):
+        rng = random.Random(seed)
+        numbers = [str(FIRST_ACCOUNT + rng.randrange(accounts)) for _ in range(ops)]
+        own = []
+        barrier.wait()
+        for number in numbers:
+            start = time.perf_counter()
+            call(number)
+            own.append(time.perf_counter() - start)
+        latencies.extend(own)
+
+    workers = [threading.Thread(target=work, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return threads * ops / elapsed, latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--accounts', type=int, default=100000)
+    parser.add_argument('--ops', type=int, default=20000, help='operations per thread')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--dir', default=None, help='directory for the database (default: a temporary one)')
+    args = parser.parse_args()
+
+    balances = {str(FIRST_ACCOUNT + i): 10 ** 9 for i in range(args.accounts)}
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        stores = [('memory', MemoryAccountStore(balances))]
+        for synchronous in ('FULL', 'NORMAL'):
+            path = os.path.join(directory, f'{synchronous.lower()}.db')
+            start = time.perf_counter()
+            stores.append((f'sqlite {synchronous}', SQLiteAccountStore(path, balances=balances,
+                                                                       synchronous=synchronous)))
+            print(f"sqlite {synchronous}: loaded {args.accounts:,} accounts in {time.perf_counter() - start:.1f} s")
+
+        print(f"\n{'store':<14}{'operation':<10}{'threads':>8}{'ops/s':>12}{'p99 us':>10}")
+        for name, store in stores:
+            for kind in ('balance', 'deposit', 'withdraw'):
+                for threads in (1, args.threads):
+                    rate, p99 = run(store, kind, threads, args.ops, args.accounts)
+                    print(f"{name:<14}{kind:<10}{threads:>8}{rate:>12,.0f}{p99 * 1e6:>10,.0f}")
+            if name != 'memory':
+                store.close()
+
+
+if __name__ == '__main__':
+    main()
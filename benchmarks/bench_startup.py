@@ -0,0 +1,105 @@
+"""Compare cold-start cost of the app:app and wsgi:application entry points
+
+For each entry point, a fresh interpreter is started repeatedly and reports
+the time to import the entry point and the time until its first /balance
+response (both measured inside the process). With --gunicorn, gunicorn is
+also started with the Dockerfile's settings and the wall-clock time from
+spawning it to the first 200 response is measured.
+
+    python benchmarks/bench_startup.py --runs 10 --gunicorn
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# app.py pins SERVER_NAME, so requests must carry the production host name
+HOST = 'atm-api-435429241525.us-central1.run.app'
+ENTRY_POINTS = [('app', 'app'), ('wsgi', 'application')]
+
+FIRST_REQUEST = r'''
+import io, json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+from {module} import {name} as application
+imported = time.perf_counter()
+environ = {{'REQUEST_METHOD': 'GET', 'PATH_INFO': '/accounts/1001/balance', 'SCRIPT_NAME': '',
+            'QUERY_STRING': '', 'SERVER_NAME': {host!r}, 'SERVER_PORT': '443', 'HTTP_HOST': {host!r},
+            'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.url_scheme': 'https', 'wsgi.input': io.BytesIO(),
+            'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+            'wsgi.run_once': False, 'wsgi.version': (1, 0)}}
+statuses = []
+body = b''.join(application(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+assert statuses == ['200 OK'], (statuses, body)
+print(json.dumps([imported - start, time.perf_counter() - start, 'flask' in sys.modules]))
+'''
+
+
+def environment():
+    # Measure the default configuration whatever the caller's shell exports
+    return {k: v for k, v in os.environ.items() if not k.startswith('ATM_')}
+
+
+def first_response(module, name):
+    script = FIRST_REQUEST.format(root=ROOT, module=module, name=name, host=HOST)
+    return json.loads(subprocess.check_output([sys.executable, '-c', script], env=environment(), text=True))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def gunicorn_first_response(module, name, timeout=30):
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        ['gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', '1', '--threads', '8', '--timeout', '0',
+         f'{module}:{name}'], cwd=ROOT, env=environment(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+                conn.request('GET', '/accounts/1001/balance', headers={'Host': HOST})
+                status = conn.getresponse().status
+                conn.close()
+                if status == 200:
+                    return time.perf_counter() - start
+            except OSError:
+                pass
+            time.sleep(0.005)
+        raise RuntimeError(f'gunicorn did not answer on port {port}')
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10, help='cold starts per entry point')
+    parser.add_argument('--gunicorn', action='store_true', help='also time gunicorn from spawn to first 200')
+    args = parser.parse_args()
+
+    columns = f"{'entry point':<18}{'import ms':>11}{'first response ms':>19}{'flask loaded':>14}"
+    if args.gunicorn:
+        columns += f"{'gunicorn ms':>13}"
+    print(columns)
+    for module, name in ENTRY_POINTS:
+        runs = [first_response(module, name) for _ in range(args.runs)]
+        line = (f"{module + ':' + name:<18}{statistics.median(r[0] for r in runs) * 1e3:>11.1f}"
+                f"{statistics.median(r[1] for r in runs) * 1e3:>19.1f}{str(runs[0][2]):>14}")
+        if args.gunicorn:
+            elapsed = statistics.median(gunicorn_first_response(module, name) for _ in range(args.runs))
+            line += f"{elapsed * 1e3:>13.1f}"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Compare memory used by the dict-of-dicts layout and MemoryAccountStore
+
+Each measurement runs in a fresh interpreter and reports the growth in
+resident memory while the accounts are loaded, so allocator overhead and
+the per-account key strings are included.
+
+    python benchmarks/bench_store_memory.py --sizes 1000000 10000000
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEASURE = r'''
+import os, sys, time
+sys.path.insert(0, {root!r})
+from store import MemoryAccountStore
+
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+size = {size}
+keys = [str(10000000 + i) for i in range(size)]
+before = rss()
+start = time.perf_counter()
+if {layout!r} == 'dict':
+    accounts = {{key: {{"balance": float(i % 100000) + 0.25}} for i, key in enumerate(keys)}}
+else:
+    accounts = MemoryAccountStore()
+    for i, key in enumerate(keys):
+        accounts.create(key, (i % 100000) * 100 + 25)
+elapsed = time.perf_counter() - start
+print(rss() - before, elapsed)
+'''
+
+
+def measure(layout, size):
+    output = subprocess.check_output(
+        [sys.executable, '-c', MEASURE.format(root=ROOT, size=size, layout=layout)], text=True)
+    grown, elapsed = output.split()
+    return int(grown), float(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000_000, 10_000_000])
+    args = parser.parse_args()
+
+    print(f"{'accounts':>12}{'layout':>10}{'MiB':>10}{'bytes/acct':>12}{'load s':>9}")
+    for size in args.sizes:
+        for layout in ('dict', 'store'):
+            grown, elapsed = measure(layout, size)
+            print(f"{size:>12,}{layout:>10}{grown / 2**20:>10.1f}{grown / size:>12.1f}{elapsed:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
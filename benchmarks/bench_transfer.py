@@ -0,0 +1,72 @@
+"""Contention benchmark for transfers among a small set of hot accounts
+
+Many threads move money between randomly chosen pairs of a few hot
+accounts, in both directions, through MemoryAccountStore.transfer. Reports
+transfers/sec, lock wait and hold times, and checks that the total balance
+is conserved, which also confirms that no thread deadlocked.
+
+    python benchmarks/bench_transfer.py --threads 1 8 32 --hot-accounts 2 4 16
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from store import MemoryAccountStore, StripedLockManager  # noqa: E402
+
+STARTING_BALANCE = 1_000_000
+
+
+def run(threads, hot_accounts, seconds, stripes):
+    numbers = [str(1001 + i) for i in range(hot_accounts)]
+    store = MemoryAccountStore({number: STARTING_BALANCE for number in numbers},
+                               locks=StripedLockManager(stripes))
+    stop = time.perf_counter() + seconds
+    counts = [0] * threads
+
+    def worker(n):
+        rng = random.Random(n)
+        done = 0
+        while time.perf_counter() < stop:
+            source, destination = rng.sample(numbers, 2)
+            store.transfer(source, destination, rng.randint(1, 500))
+            done += 1
+        counts[n] = done
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join(seconds + 30)
+        if thread.is_alive():
+            raise RuntimeError('transfer thread did not finish: deadlock')
+    conserved = sum(cents for _, cents in store.items()) == STARTING_BALANCE * hot_accounts
+    return sum(counts) / seconds, store.locks.stats(), conserved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--hot-accounts', type=int, nargs='+', default=[2, 4, 16])
+    parser.add_argument('--seconds', type=float, default=2.0)
+    parser.add_argument('--stripes', type=int, default=64)
+    args = parser.parse_args()
+
+    print(f"{'threads':>8}{'hot':>5}{'transfers/s':>13}{'avg wait us':>13}{'max wait ms':>13}"
+          f"{'avg hold us':>13}{'conserved':>11}")
+    for hot in args.hot_accounts:
+        for threads in args.threads:
+            rate, locks, conserved = run(threads, hot, args.seconds, args.stripes)
+            acquisitions = max(locks['acquisitions'], 1)
+            print(f"{threads:>8}{hot:>5}{rate:>13,.0f}"
+                  f"{locks['wait_seconds_total'] / acquisitions * 1e6:>13.1f}"
+                  f"{locks['wait_seconds_max'] * 1e3:>13.2f}"
+                  f"{locks['hold_seconds_total'] / acquisitions * 1e6:>13.1f}{str(conserved):>11}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Measure req/s of gunicorn with 1, 2, 4 and 8 workers on the shared store
+
+Each run starts gunicorn with the Dockerfile's settings (8 threads per
+worker) and ATM_STORE=shared, then drives it from several client processes
+over keep-alive connections with a mix of balance reads and deposits. The
+balances are checked afterwards to confirm no deposit was lost between
+workers.
+
+    python benchmarks/bench_workers.py --workers 1 2 4 8 --seconds 5
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# app.py pins SERVER_NAME, so requests must carry the production host name
+HOST = 'atm-api-435429241525.us-central1.run.app'
+ACCOUNTS = ('1001', '1002', '1003')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'gunicorn did not start on port {port}')
+
+
+def client(port, seconds, connections, write_ratio, results):
+    from concurrent.futures import ThreadPoolExecutor
+
+    def drive(n):
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        body = json.dumps({"amount": 1.0})
+        done = deposits = 0
+        stop = time.perf_counter() + seconds
+        while time.perf_counter() < stop:
+            account = ACCOUNTS[done % len(ACCOUNTS)]
+            if (done % 100) < write_ratio * 100:
+                conn.request('POST', f'/accounts/{account}/deposit', body,
+                             {'Host': HOST, 'Content-Type': 'application/json'})
+                deposits += 1
+            else:
+                conn.request('GET', f'/accounts/{account}/balance', headers={'Host': HOST})
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                raise RuntimeError(f'unexpected status {response.status}')
+            done += 1
+        conn.close()
+        return done, deposits
+
+    with ThreadPoolExecutor(connections) as pool:
+        totals = list(pool.map(drive, range(connections)))
+    results.put((sum(t[0] for t in totals), sum(t[1] for t in totals)))
+
+
+def run(workers, args):
+    port = free_port()
+    shared_path = os.path.join(tempfile.mkdtemp(), 'accounts')
+    env = dict(os.environ, ATM_STORE='shared', ATM_SHARED_PATH=shared_path, PORT=str(port))
+    server = subprocess.Popen(
+        ['gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(workers), '--threads', '8',
+         '--timeout', '0', 'app:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up(port)
+        time.sleep(0.5 * workers)
+        results = multiprocessing.Queue()
+        clients = [multiprocessing.Process(target=client,
+                                           args=(port, args.seconds, args.connections, args.write_ratio, results))
+                   for _ in range(args.clients)]
+        for process in clients:
+            process.start()
+        totals = [results.get() for _ in clients]
+        for process in clients:
+            process.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    sys.path.insert(0, ROOT)
+    from shared_store import SharedAccountStore
+    store = SharedAccountStore(shared_path)
+    deposited = sum(store.get_cents(account) for account in ACCOUNTS) - 225000
+    store.close()
+    os.remove(shared_path)
+    requests = sum(t[0] for t in totals)
+    deposits = sum(t[1] for t in totals)
+    return requests / args.seconds, deposited == deposits * 100
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--clients', type=int, default=4, help='load generator processes')
+    parser.add_argument('--connections', type=int, default=8, help='keep-alive connections per client')
+    parser.add_argument('--write-ratio', type=float, default=0.5)
+    args = parser.parse_args()
+
+    print(f"cores: {os.cpu_count()}")
+    print(f"{'workers':>8}{'req/s':>12}{'scaling':>9}{'no lost deposits':>18}")
+    baseline = None
+    for workers in args.workers:
+        rate, consistent = run(workers, args)
+        baseline = baseline or rate
+        print(f"{workers:>8}{rate:>12,.0f}{rate / baseline:>8.2f}x{str(consistent):>18}")
+
+
+if __name__ == '__main__':
+    main()
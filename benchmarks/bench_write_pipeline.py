@@ -0,0 +1,108 @@
+"""Compare the write pipeline with direct locking on a Zipfian hot-account workload
+
+Threads deposit to and withdraw from accounts drawn from a Zipf
+distribution (--skew, over --accounts accounts), so a few hot accounts get
+most of the writes. Each run calls the store directly (every thread takes
+the account lock itself) or goes through MutationPipeline with each
+--max-delays setting, without a journal and with one (durable mode, an
+fsync per group commit). Reports acknowledged writes per second, p50/p99
+latency and, for the pipeline, the mean batch size.
+
+    python benchmarks/bench_write_pipeline.py --threads 8 32 --seconds 3 --max-delays 0 0.0005
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from itertools import accumulate
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from journal import Journal  # noqa: E402
+from pipeline import MutationPipeline  # noqa: E402
+from store import MemoryAccountStore  # noqa: E402
+
+
+def zipf_accounts(accounts, skew, count, seed):
+    weights = list(accumulate(1 / rank ** skew for rank in range(1, accounts + 1)))
+    return [str(10000000 + i) for i in random.Random(seed).choices(range(accounts), cum_weights=weights, k=count)]
+
+
+def run(writer, threads, seconds, workload):
+    """Return (writes per second, p50, p99 latency in seconds)"""
+    barrier = threading.Barrier(threads + 1)
+    latencies = [None] * threads
+    stop = []
+
+    def work(n):
+        numbers = workload[n]
+        own = []
+        deposit = writer.deposit
+        withdraw = writer.withdraw
+        barrier.wait()
+        i = 0
+        while not stop:
+            number = numbers[i % len(numbers)]
+            start = time.perf_counter()
+            if i & 1:
+                withdraw(number, 100)
+            else:
+                deposit(number, 100)
+            own.append(time.perf_counter() - start)
+            i += 1
+        latencies[n] = own
+
+    workers = [threading.Thread(target=work, args=(n,)) for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    time.sleep(seconds)
+    stop.append(True)
+    for worker in workers:
+        worker.join()
+    merged = sorted(latency for own in latencies for latency in own)
+    return len(merged) / seconds, merged[len(merged) // 2], merged[int(len(merged) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, nargs='+', default=[8, 32])
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--accounts', type=int, default=10000)
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent')
+    parser.add_argument('--max-batch', type=int, default=256)
+    parser.add_argument('--max-delays', type=float, nargs='+', default=[0.0, 0.0005])
+    parser.add_argument('--dir', default=None, help='directory for journal files (default: a temp dir)')
+    args = parser.parse_args()
+
+    workload = [zipf_accounts(args.accounts, args.skew, 20000, n) for n in range(max(args.threads))]
+    hottest = max(set(workload[0]), key=workload[0].count)
+    print(f"hottest account gets {workload[0].count(hottest) / len(workload[0]):.0%} of the writes")
+    print(f"{'journal':<9}{'threads':>8}  {'mode':<24}{'writes/s':>10}{'p50 us':>9}{'p99 us':>9}{'batch':>7}")
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for durable in (False, True):
+            for threads in args.threads:
+                modes = [('direct locking', None)] + [(f'pipeline, delay {delay * 1e3:g} ms', delay)
+                                                      for delay in args.max_delays]
+                for name, delay in modes:
+                    store = MemoryAccountStore({str(10000000 + i): 10 ** 12 for i in range(args.accounts)})
+                    if durable:
+                        store.journal = Journal(os.path.join(tmp, f'journal-{threads}-{delay}'))
+                    writer = store
+                    if delay is not None:
+                        writer = MutationPipeline(store, max_batch=args.max_batch, max_delay=delay).start()
+                    rate, p50, p99 = run(writer, threads, args.seconds, workload)
+                    batch = '-'
+                    if delay is not None:
+                        writer.stop()
+                        stats = writer.stats()
+                        batch = f"{stats['operations'] / stats['batches']:.1f}"
+                    print(f"{'on' if durable else 'off':<9}{threads:>8}  {name:<24}{rate:>10,.0f}"
+                          f"{p50 * 1e6:>9,.0f}{p99 * 1e6:>9,.0f}{batch:>7}")
+
+
+if __name__ == '__main__':
+    main()
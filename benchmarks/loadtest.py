@@ -0,0 +1,318 @@
+"""Load-test the balance, deposit and withdraw endpoints and report JSON
+
+Drives GET /balance and POST /deposit and /withdraw with a configurable
+read/write mix over a population of accounts picked uniformly or with a
+Zipfian skew towards a few hot accounts, at one or more concurrency levels.
+The target is either the Flask test client in this process or a gunicorn
+started with the Dockerfile's settings (wsgi:application, 8 threads per
+worker; more than one worker uses ATM_STORE=shared). Each level runs for a fixed time and reports
+throughput, latency percentiles, error rate and status counts as JSON, to
+stdout or --output. Pass a previous report as --baseline to print the
+change in throughput and p99 per level to stderr.
+
+    python benchmarks/loadtest.py --target testclient --concurrency 1 8 --seconds 5
+    python benchmarks/loadtest.py --target gunicorn --distribution zipf --read-ratio 0.9 --output run.json
+    python benchmarks/loadtest.py --target gunicorn --baseline run.json
+"""
+import argparse
+import bisect
+import http.client
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import partial
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# app.py pins SERVER_NAME, so requests must carry the production host name
+HOST = 'atm-api-435429241525.us-central1.run.app'
+# Seed balance large enough that withdrawals never run out of funds
+SEED_CENTS = 10 ** 12
+AMOUNT_BODY = json.dumps({"amount": 1.25})
+
+
+def account_numbers(count):
+    return [str(10000000 + i) for i in range(count)]
+
+
+class AccountPicker:
+    """Draws account numbers uniformly or from a Zipf distribution over their rank"""
+
+    def __init__(self, numbers, distribution, zipf_s, seed):
+        self.numbers = numbers
+        self.random = random.Random(seed)
+        self.cumulative = None
+        if distribution == 'zipf':
+            self.cumulative = list(itertools.accumulate(1 / rank ** zipf_s for rank in range(1, len(numbers) + 1)))
+
+    def __call__(self):
+        if self.cumulative is None:
+            return self.numbers[self.random.randrange(len(self.numbers))]
+        point = self.random.random() * self.cumulative[-1]
+        return self.numbers[bisect.bisect_left(self.cumulative, point)]
+
+
+def next_request(pick, rng, read_ratio):
+    # Returns (method, path, body); writes are split evenly between deposits and withdrawals
+    account_number = pick()
+    if rng.random() < read_ratio:
+        return 'GET', f'/accounts/{account_number}/balance', None
+    action = 'deposit' if rng.random() < 0.5 else 'withdraw'
+    return 'POST', f'/accounts/{account_number}/{action}', AMOUNT_BODY
+
+
+def test_client_sender():
+    from app import app
+
+    client = app.test_client()
+
+    def send(method, path, body):
+        response = client.open(path, method=method, data=body,
+                               content_type='application/json' if body else None)
+        response.close()
+        return response.status_code
+    return send
+
+
+def http_sender(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+
+    def send(method, path, body):
+        headers = {'Host': HOST}
+        if body:
+            headers['Content-Type'] = 'application/json'
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            raise
+    return send
+
+
+def drive(make_sender, seconds, args, seed):
+    """Send requests back to back until seconds elapse; returns (latencies_ns, statuses)"""
+    send = make_sender()
+    rng = random.Random(seed)
+    pick = AccountPicker(account_numbers(args.accounts), args.distribution, args.zipf_s, seed)
+    latencies = []
+    statuses = Counter()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        method, path, body = next_request(pick, rng, args.read_ratio)
+        start = time.perf_counter_ns()
+        try:
+            status = send(method, path, body)
+        except (OSError, http.client.HTTPException) as exc:
+            status = type(exc).__name__
+        latencies.append(time.perf_counter_ns() - start)
+        statuses[str(status)] += 1
+    return latencies, statuses
+
+
+def drive_threads(make_sender, threads, seconds, args, seed, results=None):
+    outcomes = [None] * threads
+
+    def run(index):
+        outcomes[index] = drive(make_sender, seconds, args, seed * 1000 + index)
+
+    workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    latencies = [latency for outcome in outcomes for latency in outcome[0]]
+    statuses = sum((outcome[1] for outcome in outcomes), Counter())
+    if results is not None:
+        results.put((latencies, statuses))
+    return latencies, statuses
+
+
+def percentile(ordered, fraction):
+    # Nearest-rank percentile of an already sorted list
+    return ordered[max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+def summarize(target, concurrency, seconds, latencies, statuses):
+    ordered = sorted(latencies)
+    requests = len(ordered)
+    errors = requests - statuses.get('200', 0)
+    ms = 1e6
+    return {
+        'target': target,
+        'concurrency': concurrency,
+        'seconds': seconds,
+        'requests': requests,
+        'errors': errors,
+        'error_rate': errors / requests if requests else 0.0,
+        'throughput': requests / seconds,
+        'latency_ms': {
+            'p50': percentile(ordered, 0.50) / ms if requests else None,
+            'p95': percentile(ordered, 0.95) / ms if requests else None,
+            'p99': percentile(ordered, 0.99) / ms if requests else None,
+            'mean': sum(ordered) / requests / ms if requests else None,
+            'max': ordered[-1] / ms if requests else None,
+        },
+        'statuses': dict(statuses),
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def seed_environment(args, tmp):
+    """Write the seed accounts where the server will load them from; returns env overrides"""
+    numbers = account_numbers(args.accounts)
+    if args.workers > 1:
+        from shared_store import SharedAccountStore
+
+        path = os.path.join(tmp, 'accounts')
+        capacity = 1 << max(10, (int(args.accounts / 0.75)).bit_length())
+        store = SharedAccountStore(path, capacity=capacity,
+                                   balances={number: SEED_CENTS for number in numbers})
+        store.close()
+        return {'ATM_STORE': 'shared', 'ATM_SHARED_PATH': path, 'ATM_SHARED_CAPACITY': str(capacity)}
+    from snapshot import write_snapshot
+
+    path = os.path.join(tmp, 'accounts.snapshot')
+    write_snapshot(path, ((number, SEED_CENTS) for number in numbers))
+    return {'ATM_SNAPSHOT_PATH': path, 'ATM_SNAPSHOT_INTERVAL': '0'}
+
+
+@contextmanager
+def gunicorn(args):
+    """Run gunicorn with the Dockerfile's settings until the block exits; yields its port"""
+    with tempfile.TemporaryDirectory() as tmp:
+        port = free_port()
+        env = {k: v for k, v in os.environ.items() if not k.startswith('ATM_')}
+        env.update(seed_environment(args, tmp), WEB_CONCURRENCY=str(args.workers), PORT=str(port))
+        server = subprocess.Popen(
+            ['gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(args.workers), '--threads', '8',
+             '--timeout', '0', args.entry_point],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = time.time() + 60
+            probe = f'/accounts/{account_numbers(1)[0]}/balance'
+            while True:
+                try:
+                    if http_sender(port)('GET', probe, None) == 200:
+                        break
+                except (OSError, http.client.HTTPException):
+                    pass
+                if time.time() > deadline or server.poll() is not None:
+                    raise RuntimeError('gunicorn did not start')
+                time.sleep(0.05)
+            # Let every worker finish booting before measuring
+            time.sleep(0.2 * args.workers)
+            yield port
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def run_test_client(args):
+    from app import app, accounts
+
+    app.config['SERVER_NAME'] = None
+    accounts.clear()
+    accounts.update({number: SEED_CENTS for number in account_numbers(args.accounts)})
+    results = []
+    for concurrency in args.concurrency:
+        latencies, statuses = drive_threads(test_client_sender, concurrency, args.seconds, args, args.seed)
+        results.append(summarize('testclient', concurrency, args.seconds, latencies, statuses))
+    return results
+
+
+def run_gunicorn(args):
+    results = []
+    with gunicorn(args) as port:
+        for concurrency in args.concurrency:
+            # Spread connections over client processes so the load generator is not GIL-bound
+            processes = max(1, min(args.processes, concurrency))
+            queue = multiprocessing.Queue()
+            clients = [multiprocessing.Process(
+                target=drive_threads,
+                args=(partial(http_sender, port), len(range(i, concurrency, processes)), args.seconds, args,
+                      args.seed + i, queue)) for i in range(processes)]
+            for client in clients:
+                client.start()
+            outcomes = [queue.get() for _ in clients]
+            for client in clients:
+                client.join()
+            latencies = [latency for outcome in outcomes for latency in outcome[0]]
+            statuses = sum((outcome[1] for outcome in outcomes), Counter())
+            results.append(summarize('gunicorn', concurrency, args.seconds, latencies, statuses))
+    return results
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {(r['target'], r['concurrency']): r for r in json.load(f)['results']}
+    print(f"{'target':<12}{'conc':>6}{'req/s':>12}{'change':>9}{'p99 ms':>10}{'change':>9}", file=sys.stderr)
+    for result in results:
+        before = baseline.get((result['target'], result['concurrency']))
+        p99 = result['latency_ms']['p99'] or 0.0
+        line = f"{result['target']:<12}{result['concurrency']:>6}{result['throughput']:>12,.0f}"
+        if before is None:
+            print(f"{line}{'-':>9}{p99:>10.2f}{'-':>9}", file=sys.stderr)
+            continue
+        throughput_change = result['throughput'] / before['throughput'] - 1 if before['throughput'] else 0.0
+        p99_change = p99 / before['latency_ms']['p99'] - 1 if before['latency_ms']['p99'] else 0.0
+        print(f"{line}{throughput_change:>+9.1%}{p99:>10.2f}{p99_change:>+9.1%}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', choices=['testclient', 'gunicorn'], nargs='+', default=['testclient'])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--seconds', type=float, default=5.0, help='duration of each concurrency level')
+    parser.add_argument('--read-ratio', type=float, default=0.8, help='fraction of requests that are balance reads')
+    parser.add_argument('--accounts', type=int, default=10000, help='number of accounts to spread load over')
+    parser.add_argument('--distribution', choices=['uniform', 'zipf'], default='uniform')
+    parser.add_argument('--zipf-s', type=float, default=1.1, help='Zipf exponent; higher means hotter top accounts')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn workers')
+    parser.add_argument('--entry-point', default='wsgi:application',
+                        help='WSGI entry point gunicorn serves (the Dockerfile default; app:app loads Flask at boot)')
+    parser.add_argument('--processes', type=int, default=4, help='load generator processes for gunicorn')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='previous JSON report to compare against')
+    args = parser.parse_args()
+
+    results = []
+    for target in args.target:
+        results.extend(run_test_client(args) if target == 'testclient' else run_gunicorn(args))
+    report = {
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'environment': {'python': platform.python_version(), 'cpus': os.cpu_count(),
+                        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+import importlib
+import io
+import json
+import re
+import threading
+import time
+
+import banking
+from banking import (accounts, check_rate_limit, client_identity, etag, from_cents, metrics, overflow_message,
+                     parse_amount, parse_etags, to_cents)
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from store import BalanceOverflowError
+
+# Account routes served without Flask; other paths and unusual account numbers fall through
+_ROUTE = re.compile(r'^/accounts/([0-9A-Za-z_.-]+)/(balance|deposit|withdraw)$')
+_METHODS = {'balance': 'GET', 'deposit': 'POST', 'withdraw': 'POST'}
+_LABELS = {'deposit': 'Deposit', 'withdraw': 'Withdrawal'}
+# Headers whose handling lives in Flask extensions or resources, not here
+_FALLBACK_HEADERS = ('HTTP_ORIGIN', 'HTTP_IDEMPOTENCY_KEY', 'HTTP_IF_MATCH')
+_STATUS = {200: '200 OK', 304: '304 NOT MODIFIED', 400: '400 BAD REQUEST', 404: '404 NOT FOUND',
+           429: '429 TOO MANY REQUESTS'}
+# Response bodies exactly as flask-restx renders them (json.dumps plus a newline).
+# Account numbers matched by _ROUTE need no escaping and %r of a float is its JSON form.
+_BALANCE = '{"account_number": "%s", "balance": %r}\n'
+_DEPOSITED = '{"message": "Deposit successful. $%r added to account %s", "balance": %r}\n'
+_WITHDRAWN = '{"message": "Withdrawal successful. $%r withdrawn from account %s", "balance": %r}\n'
+_INSUFFICIENT = '{"error": "Insufficient funds. Current balance: $%r, Requested: $%r"}\n'
+_NOT_FOUND = b'{"error": "Account not found"}\n'
+
+
+class FastPathMiddleware:
+    """WSGI middleware answering the balance, deposit and withdraw routes directly.
+
+    Requests are matched with one regex and answered from pre-formatted body
+    templates, skipping Flask routing, flask-restx dispatch and the JSON
+    provider. Responses are byte-for-byte those of the Flask stack, and are
+    recorded in the same request metrics, which it also serves at /metrics.
+    Anything the templates do not cover (other routes and methods, CORS
+    preflights or origins, idempotency keys, If-Match, non-JSON or malformed
+    bodies, a foreign Host) is passed to the wrapped Flask application
+    unchanged. Conditional balance reads (If-None-Match) are answered here.
+    """
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi_app = flask_app.wsgi_app
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        match = _ROUTE.match(path)
+        if match is None:
+            if path == '/metrics' and metrics is not None and self._plain(environ, 'GET'):
+                return _respond(start_response, 200, metrics.render().encode(), METRICS_CONTENT_TYPE)
+            return self.wsgi_app(environ, start_response)
+        account_number, action = match.groups()
+        if not self._plain(environ, _METHODS[action]):
+            return self.wsgi_app(environ, start_response)
+        start = time.perf_counter()
+        if banking.client_limiter is not None or banking.account_limiter is not None:
+            throttled = check_rate_limit(account_number, client_identity(environ.get('REMOTE_ADDR'),
+                                                                         environ.get('HTTP_X_FORWARDED_FOR')))
+            if throttled is not None:
+                body, status, headers = throttled
+                if metrics is not None:
+                    metrics.observe(action, status, time.perf_counter() - start)
+                return _respond(start_response, status, (json.dumps(body) + "\n").encode(),
+                                extra_headers=list(headers.items()))
+        response = self._serve(account_number, action, environ)
+        if response is None:
+            return self.wsgi_app(environ, start_response)
+        status, body, headers = response
+        if metrics is not None:
+            metrics.observe(action, status, time.perf_counter() - start)
+        if status == 304:
+            # Werkzeug drops the body and its headers from a 304 the same way
+            start_response(_STATUS[304], [headers[0], ('Access-Control-Allow-Origin', '*')])
+            return []
+        return _respond(start_response, status, body, extra_headers=headers)
+
+    def _plain(self, environ, method):
+        # Whether the request is one the fast path may answer without Flask
+        if environ['REQUEST_METHOD'] != method or any(name in environ for name in _FALLBACK_HEADERS):
+            return False
+        server_name = self.server_name()
+        return server_name is None or environ.get('HTTP_HOST') == server_name
+
+    def _serve(self, account_number, action, environ):
+        # Returns (status, body, extra headers), or None to hand the request to Flask
+        if action == 'balance':
+            state = accounts.get_versioned(account_number)
+            if state is None:
+                return 404, _NOT_FOUND, ()
+            balance, version = state
+            headers = [('ETag', etag(balance, version))]
+            if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+            if if_none_match is not None:
+                tags = parse_etags(if_none_match, weak=True)
+                if tags is None or (version, balance) in tags:
+                    return 304, b'', headers
+            return 200, (_BALANCE % (account_number, from_cents(balance))).encode(), headers
+
+        if account_number not in accounts:
+            return 404, _NOT_FOUND, ()
+        data = _load_json(environ)
+        if data is _UNHANDLED:
+            return None
+        amount, error = parse_amount(data, _LABELS[action])
+        if error:
+            return 400, (json.dumps({"error": error}) + "\n").encode(), ()
+        writer = banking.write_pipeline or accounts
+        if action == 'deposit':
+            try:
+                balance = writer.deposit(account_number, to_cents(amount))
+            except BalanceOverflowError:
+                return 400, (json.dumps({"error": overflow_message(amount)}) + "\n").encode(), ()
+            return 200, (_DEPOSITED % (amount, account_number, from_cents(balance))).encode(), ()
+        ok, balance = writer.withdraw(account_number, to_cents(amount))
+        if not ok:
+            if metrics is not None:
+                metrics.count_insufficient_funds('withdraw')
+            return 400, (_INSUFFICIENT % (from_cents(balance), amount)).encode(), ()
+        return 200, (_WITHDRAWN % (amount, account_number, from_cents(balance))).encode(), ()
+
+    def server_name(self):
+        return self.flask_app.config['SERVER_NAME']
+
+
+class LazyApplication(FastPathMiddleware):
+    """Fast-startup WSGI entry point that imports the Flask app on demand.
+
+    The fast path serves the account routes from the first request without
+    importing Flask, flask-restx or building the API models and Swagger UI.
+    The Flask application is imported once, on the first request the fast
+    path cannot answer (/docs, other routes, error cases). If openapi_path
+    names a file written by app.export_openapi(), /swagger.json is served
+    from it without importing Flask either.
+    """
+
+    def __init__(self, server_name, module='app', openapi_path=None):
+        self._server_name = server_name
+        self._module = module
+        self._flask_wsgi = None
+        self._load_lock = threading.Lock()
+        self._openapi = None
+        if openapi_path:
+            with open(openapi_path, 'rb') as f:
+                self._openapi = f.read()
+
+    def __call__(self, environ, start_response):
+        if (self._openapi is not None and environ.get('PATH_INFO') == '/swagger.json'
+                and environ['REQUEST_METHOD'] == 'GET' and 'HTTP_ORIGIN' not in environ
+                and self._server_name in (None, environ.get('HTTP_HOST'))):
+            return _respond(start_response, 200, self._openapi)
+        return super().__call__(environ, start_response)
+
+    def server_name(self):
+        return self._server_name
+
+    def wsgi_app(self, environ, start_response):
+        if self._flask_wsgi is None:
+            with self._load_lock:
+                if self._flask_wsgi is None:
+                    self._flask_wsgi = importlib.import_module(self._module).app.wsgi_app
+        return self._flask_wsgi(environ, start_response)
+
+
+# Returned by _load_json when Flask has to produce the response
+_UNHANDLED = object()
+
+
+def _load_json(environ):
+    # Only plain application/json bodies with a Content-Length are parsed here;
+    # the body is put back so Flask can reproduce its own errors for the rest
+    content_type = environ.get('CONTENT_TYPE', '')
+    length = environ.get('CONTENT_LENGTH')
+    if content_type.split(';', 1)[0].strip().lower() != 'application/json' or not length or not length.isdigit():
+        return _UNHANDLED
+    body = environ['wsgi.input'].read(int(length))
+    try:
+        return json.loads(body)
+    except ValueError:
+        environ['wsgi.input'] = io.BytesIO(body)
+        return _UNHANDLED
+
+
+def _respond(start_response, status, body, content_type='application/json', extra_headers=()):
+    start_response(_STATUS[status], [('Content-Type', content_type), ('Content-Length', str(len(body))),
+                                     *extra_headers, ('Access-Control-Allow-Origin', '*')])
+    return [body]
+
+
+def install(flask_app):
+    """Route flask_app's WSGI entry point through the fast path"""
+    flask_app.wsgi_app = FastPathMiddleware(flask_app)
+    return flask_app
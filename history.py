@@ -0,0 +1,62 @@
+import struct
+import time
+
+# Transaction types, stored as a one-byte code (index + 1)
+KINDS = ('deposit', 'withdraw', 'transfer_out', 'transfer_in')
+_CODES = {kind: code for code, kind in enumerate(KINDS, 1)}
+# Record layout: sequence number, unix timestamp, type code, amount and
+# resulting balance in cents. Each account's buffer starts with the latest
+# sequence number, followed by `capacity` record slots used as a ring.
+_RECORD = struct.Struct('<QdBqq')
+_LATEST = struct.Struct('<Q')
+
+
+class TransactionHistory:
+    """Fixed-capacity ring buffer of recent transactions per account.
+
+    Each account gets one bytearray of packed records the first time it
+    sees a transaction, so memory per account is bounded by capacity no
+    matter how many operations hit it. record() must be called with the
+    account's lock held; readers need no lock because each record is packed
+    and unpacked in a single step and carries its own sequence number.
+    """
+
+    def __init__(self, capacity=50):
+        self.capacity = capacity
+        self._buffers = {}
+
+    def record(self, account_number, kind, cents, balance):
+        buffer = self._buffers.get(account_number)
+        if buffer is None:
+            buffer = self._buffers.setdefault(
+                account_number, bytearray(_LATEST.size + self.capacity * _RECORD.size))
+        seq = _LATEST.unpack_from(buffer)[0] + 1
+        offset = _LATEST.size + (seq - 1) % self.capacity * _RECORD.size
+        _RECORD.pack_into(buffer, offset, seq, time.time(), _CODES[kind], cents, balance)
+        _LATEST.pack_into(buffer, 0, seq)
+
+    def iter_records(self, account_number, before=None):
+        """Yield (seq, timestamp, kind, cents, balance) newest first
+
+        Only records with a sequence number below before are returned when it
+        is given. Iteration stops early if newer transactions overwrite the
+        slots still to be read.
+        """
+        buffer = self._buffers.get(account_number)
+        if buffer is None:
+            return
+        latest = _LATEST.unpack_from(buffer)[0]
+        start = latest if before is None else min(latest, before - 1)
+        oldest = max(1, latest - self.capacity + 1)
+        for seq in range(start, oldest - 1, -1):
+            offset = _LATEST.size + (seq - 1) % self.capacity * _RECORD.size
+            stored_seq, timestamp, code, cents, balance = _RECORD.unpack_from(buffer, offset)
+            if stored_seq != seq:
+                return
+            yield seq, timestamp, KINDS[code - 1], cents, balance
+
+    def clear(self):
+        self._buffers.clear()
+
+    def memory_bytes(self):
+        return len(self._buffers) * (_LATEST.size + self.capacity * _RECORD.size)
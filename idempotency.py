@@ -0,0 +1,144 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Bookkeeping charged to every cached response on top of its key and body
+_ENTRY_OVERHEAD = 200
+
+
+def _body_size(body):
+    # Response bodies are flat dicts of strings and numbers
+    return sys.getsizeof(body) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in body.items())
+
+
+class _InFlight:
+    # A request being executed, which duplicates arriving meanwhile wait for
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.response = None
+
+
+class IdempotencyCache:
+    """Stored responses of requests made with an Idempotency-Key.
+
+    Entries are evicted least recently used first once the estimated size
+    of all cached responses exceeds max_bytes, and expire ttl seconds after
+    they were stored. A key seen again while its first request is still
+    executing waits for that execution and gets its response instead of
+    running the request a second time.
+    """
+
+    def __init__(self, max_bytes=64 << 20, ttl=86400.0, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._clock = clock
+        # key -> (fingerprint, body, status, expires_at, size), least recently used first
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._conflicts = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def run(self, key, fingerprint, handler):
+        """Return (body, status, replayed) for the request identified by key
+
+        handler is called to produce (body, status) only if no response is
+        stored or being produced for key. A key reused for a request with a
+        different fingerprint is answered with a 422 error instead.
+        """
+        while True:
+            with self._lock:
+                entry = self._lookup(key)
+                if entry is not None:
+                    if entry[0] != fingerprint:
+                        return self._conflict()
+                    self._hits += 1
+                    return entry[1], entry[2], True
+                pending = self._in_flight.get(key)
+                if pending is None:
+                    pending = self._in_flight[key] = _InFlight(fingerprint)
+                    self._misses += 1
+                    break
+                if pending.fingerprint != fingerprint:
+                    return self._conflict()
+                self._coalesced += 1
+            pending.done.wait()
+            if pending.response is not None:
+                return pending.response[0], pending.response[1], True
+            # The first execution raised; take over as the executing request
+
+        try:
+            body, status = handler()
+        except BaseException:
+            with self._lock:
+                del self._in_flight[key]
+            pending.done.set()
+            raise
+        with self._lock:
+            del self._in_flight[key]
+            self._store(key, fingerprint, body, status)
+        pending.response = (body, status)
+        pending.done.set()
+        return body, status, False
+
+    def _conflict(self):
+        self._conflicts += 1
+        return {"error": "Idempotency-Key was already used for a different request"}, 422, False
+
+    def _lookup(self, key):
+        # Called with the lock held
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[3] <= self._clock():
+            self._discard(key)
+            self._expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, fingerprint, body, status):
+        # Called with the lock held
+        now = self._clock()
+        size = _ENTRY_OVERHEAD + sys.getsizeof(key) + _body_size(body)
+        self._entries[key] = (fingerprint, body, status, now + self.ttl, size)
+        self._bytes += size
+        entries = self._entries
+        while entries:
+            oldest = next(iter(entries))
+            if entries[oldest][3] <= now:
+                self._expirations += 1
+            elif self._bytes > self.max_bytes:
+                self._evictions += 1
+            else:
+                break
+            self._discard(oldest)
+
+    def _discard(self, key):
+        self._bytes -= self._entries.pop(key)[4]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'coalesced': self._coalesced,
+                'conflicts': self._conflicts,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
@@ -0,0 +1,211 @@
+import os
+import struct
+import threading
+import time
+import zlib
+
+# Record layout: crc32 of the rest, key length, key bytes, balance in cents.
+# Records carry the absolute balance, so replaying is idempotent and only the
+# last record for each account matters. A key length of 0 (account numbers
+# are never empty) starts a group record instead: a uint32 count, then that
+# many key length, key, balance entries under the one crc32, so every balance
+# a transfer or batch changed is replayed together or not at all.
+_HEADER = struct.Struct('<IB')
+_CENTS = struct.Struct('<q')
+_COUNT = struct.Struct('<I')
+
+
+def _entry(account_number, cents):
+    key = account_number.encode('utf-8')
+    return bytes((len(key),)) + key + _CENTS.pack(cents)
+
+
+def encode_record(account_number, cents):
+    body = _entry(account_number, cents)
+    return struct.pack('<I', zlib.crc32(body)) + body
+
+
+def encode_group(balances):
+    """Encode (account_number, cents) pairs as one all-or-nothing record"""
+    body = b'\0' + _COUNT.pack(len(balances)) + b''.join([_entry(*pair) for pair in balances])
+    return struct.pack('<I', zlib.crc32(body)) + body
+
+
+def _parse_entries(data, offset, count, end):
+    # Return ([(account_number, cents)], offset past them), or None if the
+    # entries run past end
+    entries = []
+    for _ in range(count):
+        if offset >= end:
+            return None
+        stop = offset + 1 + data[offset] + _CENTS.size
+        if stop > end:
+            return None
+        entries.append((data[offset + 1:stop - _CENTS.size], _CENTS.unpack_from(data, stop - _CENTS.size)[0]))
+        offset = stop
+    return entries, offset
+
+
+def replay(path):
+    """Return the balances recorded in the journal at path, keyed by account
+
+    A torn or corrupt tail (from a crash mid-write) is truncated so that new
+    records are appended after the last complete one.
+    """
+    balances = {}
+    if not os.path.exists(path):
+        return balances
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    end = len(data)
+    while offset + _HEADER.size <= end:
+        crc, key_length = _HEADER.unpack_from(data, offset)
+        if key_length:
+            parsed = _parse_entries(data, offset + 4, 1, end)
+        elif offset + _HEADER.size + _COUNT.size <= end:
+            count = _COUNT.unpack_from(data, offset + _HEADER.size)[0]
+            parsed = _parse_entries(data, offset + _HEADER.size + _COUNT.size, count, end)
+        else:
+            parsed = None
+        if parsed is None or zlib.crc32(data[offset + 4:parsed[1]]) != crc:
+            break
+        entries, offset = parsed
+        for key, cents in entries:
+            balances[key.decode('utf-8')] = cents
+    if offset != end:
+        with open(path, 'r+b') as f:
+            f.truncate(offset)
+    return balances
+
+
+def segment_paths(path):
+    """Return the retired segments of the journal at path, oldest first,
+    followed by path itself"""
+    directory, base = os.path.split(os.path.abspath(path))
+    retired = []
+    for name in os.listdir(directory or '.'):
+        suffix = name[len(base) + 1:]
+        if name.startswith(base + '.') and suffix.isdigit():
+            retired.append((int(suffix), os.path.join(directory, name)))
+    return [segment for _, segment in sorted(retired)] + [path]
+
+
+class Journal:
+    """Append-only write-ahead journal with group commit.
+
+    Writers call append() while holding the account lock, which only queues
+    the encoded record, then wait() after releasing it. The first waiter to
+    find no flush in progress becomes the leader: it lingers for up to
+    fsync_interval seconds (or until batch_size records are queued), writes
+    the queued records and fsyncs once on behalf of every waiter.
+    """
+
+    def __init__(self, path, fsync_interval=0.0, batch_size=512):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.batch_size = batch_size
+        self._file = open(path, 'ab')
+        self._cond = threading.Condition()
+        self._queue = []
+        self._appended = 0
+        self._durable = 0
+        self._flushing = False
+        self._fsyncs = 0
+
+    def append(self, account_number, cents):
+        """Queue a balance record and return its sequence number"""
+        return self._enqueue(encode_record(account_number, cents))
+
+    def append_group(self, balances):
+        """Queue (account_number, cents) pairs as one record replayed all or nothing; returns its sequence number"""
+        return self._enqueue(encode_group(balances))
+
+    def _enqueue(self, record):
+        with self._cond:
+            self._queue.append(record)
+            self._appended += 1
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+            return self._appended
+
+    def wait(self, seq):
+        """Block until the record with sequence number seq is on disk"""
+        with self._cond:
+            while self._durable < seq:
+                if self._flushing:
+                    self._cond.wait()
+                else:
+                    self._flush()
+
+    def _flush(self):
+        # Called with the condition held; releases it around the disk I/O
+        self._flushing = True
+        try:
+            deadline = time.monotonic() + self.fsync_interval
+            while len(self._queue) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            records = self._queue[:self.batch_size]
+            del self._queue[:self.batch_size]
+            self._cond.release()
+            try:
+                self._file.write(b''.join(records))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except BaseException:
+                self._cond.acquire()
+                # Requeue so the next leader retries; replaying a duplicate is harmless
+                self._queue[:0] = records
+                raise
+            self._cond.acquire()
+            self._durable += len(records)
+            self._fsyncs += 1
+        finally:
+            self._flushing = False
+            self._cond.notify_all()
+
+    def rotate(self):
+        """Retire the current segment and continue in a fresh file
+
+        Every record appended before the call is durable in the retired
+        segment, whose path is returned. Appends wait while this runs.
+        """
+        with self._cond:
+            while self._flushing:
+                self._cond.wait()
+            records = self._queue
+            self._queue = []
+            self._file.write(b''.join(records))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            retired = segment_paths(self.path)[:-1]
+            number = int(retired[-1].rsplit('.', 1)[1]) + 1 if retired else 1
+            retired_path = f'{self.path}.{number}'
+            os.replace(self.path, retired_path)
+            self._file = open(self.path, 'ab')
+            self._durable += len(records)
+            self._fsyncs += 1
+            self._cond.notify_all()
+        return retired_path
+
+    def sync(self):
+        """Make every record appended so far durable"""
+        with self._cond:
+            seq = self._appended
+        self.wait(seq)
+
+    def close(self):
+        self.sync()
+        self._file.close()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'records': self._durable,
+                'pending': self._appended - self._durable,
+                'fsyncs': self._fsyncs,
+            }
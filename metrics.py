@@ -0,0 +1,155 @@
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+# Upper bounds in seconds of the request duration histogram buckets
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _Shard:
+    # Counters written only by the thread owning the shard. routes maps each
+    # route to [bucket counts (last one +Inf), {status: count}, duration sum].
+    __slots__ = ('routes', 'insufficient_funds')
+
+    def __init__(self):
+        self.routes = {}
+        self.insufficient_funds = {}
+
+    def merge(self, other):
+        for route, (counts, statuses, total) in other.routes.copy().items():
+            merged = self.routes.get(route)
+            if merged is None:
+                merged = self.routes[route] = [[0] * len(counts), {}, 0.0]
+            for index, count in enumerate(list(counts)):
+                merged[0][index] += count
+            for status, count in statuses.copy().items():
+                merged[1][status] = merged[1].get(status, 0) + count
+            merged[2] += total
+        for route, count in other.insufficient_funds.copy().items():
+            self.insufficient_funds[route] = self.insufficient_funds.get(route, 0) + count
+
+
+class Metrics:
+    """Request counters and latency histograms rendered in the Prometheus text format.
+
+    Every thread records into a shard of its own, so recording takes no lock
+    and threads never contend on shared counters. A scrape sums the shards;
+    shards of threads that have exited are folded into one retired shard so
+    the totals survive thread turnover. Gauges and store-level counters are
+    read from callbacks at scrape time.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._local = threading.local()
+        self._shards = []
+        self._retired = _Shard()
+        self._lock = threading.Lock()
+        self._collectors = []
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def observe(self, route, status, seconds):
+        """Record one handled request"""
+        try:
+            stats = self._local.shard.routes[route]
+        except (AttributeError, KeyError):
+            stats = self._shard().routes.setdefault(route, [[0] * (len(self.buckets) + 1), {}, 0.0])
+        stats[0][bisect_left(self.buckets, seconds)] += 1
+        statuses = stats[1]
+        statuses[status] = statuses.get(status, 0) + 1
+        stats[2] += seconds
+
+    def count_insufficient_funds(self, route):
+        counts = self._shard().insufficient_funds
+        counts[route] = counts.get(route, 0) + 1
+
+    def instrument(self, route):
+        """Decorator recording duration and status of a handler returning (body, status[, headers])"""
+        def decorator(handler):
+            @wraps(handler)
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                status = 500
+                try:
+                    result = handler(*args, **kwargs)
+                    status = result[1] if isinstance(result, tuple) else 200
+                    return result
+                except Exception as exc:
+                    # werkzeug HTTP errors (bad JSON, wrong content type) carry their status
+                    status = getattr(exc, 'code', 500)
+                    raise
+                finally:
+                    self.observe(route, status, time.perf_counter() - start)
+            return timed
+        return decorator
+
+    def register(self, name, kind, help_text, collect):
+        """Add a metric read at scrape time
+
+        collect() returns a number, or a list of (labels dict, number) pairs.
+        """
+        self._collectors.append((name, kind, help_text, collect))
+
+    def _totals(self):
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    self._retired.merge(shard)
+            self._shards = live
+            totals = _Shard()
+            totals.merge(self._retired)
+        for _, shard in live:
+            totals.merge(shard)
+        return totals
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        totals = self._totals()
+        lines = [
+            '# HELP atm_http_requests_total Requests handled, by route and status',
+            '# TYPE atm_http_requests_total counter',
+        ]
+        routes = sorted(totals.routes.items())
+        for route, (_, statuses, _) in routes:
+            for status, count in sorted(statuses.items()):
+                lines.append(f'atm_http_requests_total{{route="{route}",status="{status}"}} {count}')
+        lines += [
+            '# HELP atm_http_request_duration_seconds Time spent handling requests, by route',
+            '# TYPE atm_http_request_duration_seconds histogram',
+        ]
+        for route, (counts, _, total) in routes:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'atm_http_request_duration_seconds_bucket{{route="{route}",le="{le}"}} {cumulative}')
+            lines.append(f'atm_http_request_duration_seconds_sum{{route="{route}"}} {total!r}')
+            lines.append(f'atm_http_request_duration_seconds_count{{route="{route}"}} {cumulative}')
+        lines += [
+            '# HELP atm_insufficient_funds_total Operations rejected for insufficient funds, by route',
+            '# TYPE atm_insufficient_funds_total counter',
+        ]
+        for route, count in sorted(totals.insufficient_funds.items()):
+            lines.append(f'atm_insufficient_funds_total{{route="{route}"}} {count}')
+        for name, kind, help_text, collect in self._collectors:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            values = collect()
+            if not isinstance(values, list):
+                values = [({}, values)]
+            for labels, value in values:
+                label_text = ','.join(f'{key}="{label}"' for key, label in labels.items())
+                lines.append(f'{name}{{{label_text}}} {value!r}' if label_text else f'{name} {value!r}')
+        return '\n'.join(lines) + '\n'
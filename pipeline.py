@@ -0,0 +1,163 @@
+import threading
+import time
+
+
+class _Waiter:
+    # One per request thread, reused for each of its mutations: the lock is
+    # held until the applier has stored the outcome and released it
+    __slots__ = ('lock', 'result', 'error')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lock.acquire()
+        self.result = None
+        self.error = None
+
+
+class MutationPipeline:
+    """Single applier thread applying deposits and withdrawals in micro-batches.
+
+    Request threads put (account_number, type, cents) onto a fixed-capacity
+    ring buffer and block until their mutation has been applied. The applier
+    takes up to max_batch queued mutations at a time and applies them in
+    queue order with one store.apply_batch() call, so a batch costs one
+    acquisition of the account locks involved and one journal wait however
+    many requests it serves. Request threads never contend for an account
+    lock with each other. When the queue holds fewer than max_batch
+    mutations, the applier waits up to max_delay seconds for more; with
+    the default of 0 it takes whatever queued up while the previous batch
+    was being applied. A full queue blocks new mutations until the applier
+    catches up.
+    """
+
+    def __init__(self, store, max_batch=256, max_delay=0.0, capacity=4096):
+        if capacity & (capacity - 1) or max_batch < 1 or max_delay < 0:
+            raise ValueError('capacity must be a power of two, max_batch at least 1 and max_delay not negative')
+        self.store = store
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._slots = [None] * capacity
+        self._mask = capacity - 1
+        # Mutations are taken from head and added at tail; both only grow
+        self._head = 0
+        self._tail = 0
+        lock = threading.Lock()
+        self._not_empty = threading.Condition(lock)
+        self._not_full = threading.Condition(lock)
+        self._local = threading.local()
+        self._thread = None
+        self._stopping = False
+        self.batches = 0
+        self.operations = 0
+        self.largest_batch = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='mutation-pipeline', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Apply what is queued, then stop the applier thread"""
+        with self._not_empty:
+            self._stopping = True
+            self._not_empty.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def deposit(self, account_number, cents):
+        return self.submit(account_number, 'deposit', cents)[1]
+
+    def withdraw(self, account_number, cents):
+        return self.submit(account_number, 'withdraw', cents)
+
+    def submit(self, account_number, kind, cents):
+        """Queue one mutation and return its (ok, balance) once applied"""
+        waiter = getattr(self._local, 'waiter', None)
+        if waiter is None:
+            waiter = self._local.waiter = _Waiter()
+        with self._not_empty:
+            if self._stopping:
+                raise RuntimeError('mutation pipeline is stopped')
+            while self._tail - self._head > self._mask:
+                self._not_full.wait()
+            self._slots[self._tail & self._mask] = (account_number, kind, cents, waiter)
+            self._tail += 1
+            queued = self._tail - self._head
+            # The applier sleeps on an empty queue, or waits for a full batch
+            if queued == 1 or queued == self.max_batch:
+                self._not_empty.notify()
+        waiter.lock.acquire()
+        if waiter.error is not None:
+            error, waiter.error = waiter.error, None
+            raise error
+        return waiter.result
+
+    def _take(self):
+        # Return the next batch of queued mutations, or None once stopped and drained
+        with self._not_empty:
+            while self._head == self._tail:
+                if self._stopping:
+                    return None
+                self._not_empty.wait()
+            if self.max_delay and self._tail - self._head < self.max_batch and not self._stopping:
+                deadline = time.monotonic() + self.max_delay
+                while self._tail - self._head < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._not_empty.wait(remaining)
+            count = min(self._tail - self._head, self.max_batch)
+            slots = self._slots
+            mask = self._mask
+            batch = []
+            for seq in range(self._head, self._head + count):
+                batch.append(slots[seq & mask])
+                slots[seq & mask] = None
+            full = self._tail - self._head > mask
+            self._head += count
+            if full:
+                self._not_full.notify_all()
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            if batch is None:
+                return
+            try:
+                results = self._apply(batch)
+            except Exception as e:
+                # Whatever went wrong is reported to every request in the batch
+                results = [None] * len(batch)
+                for mutation in batch:
+                    mutation[3].error = e
+            self.batches += 1
+            self.operations += len(batch)
+            if len(batch) > self.largest_batch:
+                self.largest_batch = len(batch)
+            for mutation, result in zip(batch, results):
+                waiter = mutation[3]
+                waiter.result = result
+                waiter.lock.release()
+
+    def _apply(self, batch):
+        try:
+            return self.store.apply_batch([mutation[:3] for mutation in batch], atomic=False)
+        except Exception:
+            # Stores look up every account and check every new balance before
+            # writing anything, and SQLite rolls the transaction back, so the
+            # batch can be retried one mutation at a time to report each error
+            # only to the request that caused it
+            results = []
+            for mutation in batch:
+                try:
+                    results.append(self.store.apply_batch([mutation[:3]], atomic=False)[0])
+                except Exception as e:
+                    mutation[3].error = e
+                    results.append(None)
+            return results
+
+    def stats(self):
+        return {'batches': self.batches, 'operations': self.operations, 'largest_batch': self.largest_batch,
+                'queued': self._tail - self._head}
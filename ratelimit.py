@@ -0,0 +1,100 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Shard:
+    # Buckets of the keys hashing to one lock, least recently used first:
+    # key -> [tokens, last update]
+    __slots__ = ('lock', 'buckets', 'allowed', 'throttled', 'evictions')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+        self.allowed = 0
+        self.throttled = 0
+        self.evictions = 0
+
+
+class RateLimiter:
+    """Token buckets per key: rate requests per second, bursts of up to burst.
+
+    Keys hash onto a fixed number of shards, each with its own lock and
+    buckets, so concurrent requests for different keys rarely wait on each
+    other and each check is O(1). Each shard keeps its buckets in least
+    recently used order. A bucket left alone for burst / rate seconds has
+    refilled completely and behaves exactly like a new one, so when a key
+    gets a new bucket such idle buckets are dropped from the front. A shard
+    holding more than max_keys / shards buckets then drops the least
+    recently used one, which only lets that key start over with a full
+    bucket.
+    """
+
+    def __init__(self, rate, burst, max_keys=100000, shards=64, clock=time.monotonic):
+        # Written so that NaN fails too
+        if not (0 < rate < math.inf and 1 <= burst < math.inf):
+            raise ValueError('rate must be positive and burst at least 1, both finite')
+        if shards & (shards - 1):
+            raise ValueError('shards must be a power of two')
+        self.rate = rate
+        self.burst = burst
+        self.idle = burst / rate
+        self._shard_keys = max(1, max_keys // shards)
+        self._shards = [_Shard() for _ in range(shards)]
+        self._mask = shards - 1
+        self._clock = clock
+
+    def acquire(self, key):
+        """Take a token for key; returns 0.0, or the seconds until one is available"""
+        shard = self._shards[hash(key) & self._mask]
+        now = self._clock()
+        with shard.lock:
+            buckets = shard.buckets
+            bucket = buckets.get(key)
+            if bucket is None:
+                tokens = self.burst
+                bucket = buckets[key] = [tokens, now]
+                self._evict(shard, now)
+            else:
+                tokens = bucket[0] + (now - bucket[1]) * self.rate
+                if tokens > self.burst:
+                    tokens = self.burst
+                bucket[1] = now
+                buckets.move_to_end(key)
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                shard.allowed += 1
+                return 0.0
+            bucket[0] = tokens
+            shard.throttled += 1
+        return (1 - tokens) / self.rate
+
+    def _evict(self, shard, now):
+        # Called with the shard lock held after adding a bucket at the end;
+        # O(1) per bucket dropped, since the idle ones are all at the front
+        buckets = shard.buckets
+        evicted = 0
+        while True:
+            last = next(iter(buckets.values()))[1]
+            if now - last < self.idle and len(buckets) <= self._shard_keys:
+                break
+            buckets.popitem(last=False)
+            evicted += 1
+        shard.evictions += evicted
+
+    def stats(self):
+        """Return bucket count and allowed, throttled and evicted totals"""
+        totals = {'buckets': 0, 'allowed': 0, 'throttled': 0, 'evictions': 0}
+        for shard in self._shards:
+            with shard.lock:
+                totals['buckets'] += len(shard.buckets)
+                totals['allowed'] += shard.allowed
+                totals['throttled'] += shard.throttled
+                totals['evictions'] += shard.evictions
+        return totals
+
+    def clear(self):
+        for shard in self._shards:
+            with shard.lock:
+                shard.buckets.clear()
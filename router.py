@@ -0,0 +1,28 @@
+"""Shard router entry point: ATM_SHARDS=http://10.0.0.1:8080,... gunicorn router:application
+
+Forwards each account's balance, deposit, withdraw and transactions requests
+to the backend instance of app.py that owns it on a consistent hash ring.
+Set ATM_ROUTER_ADMIN_TOKEN to enable PUT /router/shards for rebalancing, which
+needs a single router worker; without it any number of workers share the ring.
+Rebalancing moves accounts through the shards' bulk import and export, so
+ATM_ADMIN_TOKEN must then be set to the shards' token as well.
+"""
+import os
+
+from sharding import DEFAULT_VNODES, ShardRouter
+
+# Host name the shards serve (banking.SERVER_NAME). Not imported from banking,
+# which would build an account store and refuse several workers.
+SHARD_HOST = os.environ.get("ATM_SHARD_HOST", "atm-api-435429241525.us-central1.run.app")
+ADMIN_TOKEN = os.environ.get("ATM_ROUTER_ADMIN_TOKEN")
+if ADMIN_TOKEN and int(os.environ.get("WEB_CONCURRENCY", 1)) > 1:
+    # A rebalance would only change the ring of the worker that received it
+    raise RuntimeError("ATM_ROUTER_ADMIN_TOKEN requires a single router worker")
+
+application = ShardRouter([url.strip() for url in os.environ["ATM_SHARDS"].split(",") if url.strip()],
+                          vnodes=int(os.environ.get("ATM_SHARD_VNODES", DEFAULT_VNODES)),
+                          host=SHARD_HOST,
+                          admin_token=ADMIN_TOKEN,
+                          shard_token=os.environ.get("ATM_ADMIN_TOKEN"),
+                          pool_size=int(os.environ.get("ATM_SHARD_POOL_SIZE", 32)),
+                          timeout=float(os.environ.get("ATM_SHARD_TIMEOUT", 10)))
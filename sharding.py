@@ -0,0 +1,348 @@
+import hashlib
+import hmac
+import http.client
+import json
+import re
+import threading
+import time
+from bisect import bisect_right
+from collections import Counter
+from urllib.parse import urlsplit
+
+# Points each shard gets on the ring; more points spread accounts more evenly
+DEFAULT_VNODES = 160
+# Account routes forwarded to the shard owning the account
+_ROUTE = re.compile(r'^/accounts/([0-9A-Za-z_.-]+)/(balance|deposit|withdraw|transactions)$')
+# Connection-level headers that must not be passed through a proxy
+_HOP_BY_HOP = frozenset(('connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te',
+                         'trailer', 'trailers', 'transfer-encoding', 'upgrade'))
+_STATUS = {200: '200 OK', 400: '400 BAD REQUEST', 401: '401 UNAUTHORIZED', 404: '404 NOT FOUND',
+           502: '502 BAD GATEWAY'}
+# Moved accounts sent to their new shard per import request while rebalancing
+MOVE_BATCH_ROWS = 100000
+
+
+def _hash(value):
+    # Stable across processes and restarts, unlike the built-in str hash
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent hash ring assigning account numbers to shards.
+
+    Every shard is hashed onto the ring at vnodes points and an account
+    belongs to the first point at or after its own hash. Adding a shard
+    therefore only moves the accounts that land on its new points, about
+    1/N of them, and removing one only moves the accounts it held.
+    """
+
+    def __init__(self, nodes, vnodes=DEFAULT_VNODES):
+        nodes = tuple(dict.fromkeys(nodes))
+        if not nodes or vnodes < 1:
+            raise ValueError('a hash ring needs at least one node and one virtual node per node')
+        self.nodes = nodes
+        self.vnodes = vnodes
+        points = sorted((_hash(f'{node}#{i}'), node) for node in nodes for i in range(vnodes))
+        self._points = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def node_for(self, key):
+        i = bisect_right(self._points, _hash(key))
+        return self._owners[i if i < len(self._owners) else 0]
+
+
+class ShardPool:
+    """Keep-alive HTTP connections to one shard, reused across requests.
+
+    Idle connections are handed out most recently used first. One idle for
+    longer than idle_timeout is closed instead of reused, since the shard's
+    server may have dropped it already (gunicorn keeps connections for 2
+    seconds). At most size idle connections are kept.
+    """
+
+    def __init__(self, url, size=32, timeout=10.0, idle_timeout=1.0, clock=time.monotonic):
+        parts = urlsplit(url)
+        if parts.scheme != 'http' or not parts.hostname:
+            raise ValueError(f'shard URL must be http://host[:port], got {url!r}')
+        self.url = url
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.size = size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._clock = clock
+        self._idle = []
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def connect(self):
+        with self._lock:
+            self.created += 1
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method, path, body=None, headers=None, retry=False):
+        """Send one request; returns (status, reason, headers, body)
+
+        With retry, a request that fails on a reused connection is sent once
+        more on a new one. Only safe for requests that may run twice.
+        """
+        conn = self._checkout()
+        reused = conn is not None
+        if conn is None:
+            conn = self.connect()
+        try:
+            conn.request(method, path, body, headers or {})
+            response = conn.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            if not (reused and retry):
+                raise
+            conn = self.connect()
+            try:
+                conn.request(method, path, body, headers or {})
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                raise
+        if response.will_close:
+            conn.close()
+        else:
+            self._checkin(conn)
+        return response.status, response.reason, response.getheaders(), data
+
+    def _checkout(self):
+        now = self._clock()
+        with self._lock:
+            while self._idle:
+                conn, returned = self._idle.pop()
+                if now - returned < self.idle_timeout:
+                    self.reused += 1
+                    return conn
+                conn.close()
+        return None
+
+    def _checkin(self, conn):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((conn, self._clock()))
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+
+class ShardRouter:
+    """WSGI app forwarding account requests to the shard that owns the account.
+
+    The balance, deposit, withdraw and transactions routes of an account are
+    proxied to the shard a HashRing assigns it to, over pooled keep-alive
+    connections. Other routes span accounts on several shards and get a 404.
+    With an admin_token, PUT /router/shards replaces the shard list and
+    moves the affected accounts (see rebalance()), through the shards' bulk
+    import and export routes, which take shard_token.
+    """
+
+    def __init__(self, shards, vnodes=DEFAULT_VNODES, host=None, admin_token=None, pool_size=32,
+                 timeout=10.0, shard_token=None):
+        self.host = host
+        self.admin_token = admin_token
+        self.shard_token = shard_token
+        self._pool_options = {'size': pool_size, 'timeout': timeout}
+        self.ring = HashRing(shards, vnodes)
+        self.pools = {url: ShardPool(url, **self._pool_options) for url in self.ring.nodes}
+        # Ring being moved to while a rebalance copies accounts, and the
+        # account numbers of the requests being forwarded right now
+        self._pending = None
+        self._in_flight = Counter()
+        self._cond = threading.Condition()
+        self._rebalance_lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        match = _ROUTE.match(path)
+        if match is None:
+            if path == '/router/shards' and self.admin_token:
+                return self._admin(environ, start_response)
+            return _respond(start_response, 404, {"error": "Route not served by the shard router"})
+        account_number = match.group(1)
+        pool = self._enter(account_number)
+        try:
+            return self._forward(pool, path, environ, start_response)
+        finally:
+            self._leave(account_number)
+
+    def _enter(self, account_number):
+        # Requests for an account that a rebalance is moving wait until it has moved
+        with self._cond:
+            while self._pending is not None and self._moves(account_number):
+                self._cond.wait()
+            self._in_flight[account_number] += 1
+            return self.pools[self.ring.node_for(account_number)]
+
+    def _leave(self, account_number):
+        with self._cond:
+            self._in_flight[account_number] -= 1
+            if not self._in_flight[account_number]:
+                del self._in_flight[account_number]
+            if self._pending is not None:
+                self._cond.notify_all()
+
+    def _moves(self, account_number):
+        return self._pending.node_for(account_number) != self.ring.node_for(account_number)
+
+    def _forward(self, pool, path, environ, start_response):
+        headers = {name[5:].replace('_', '-').title(): value for name, value in environ.items()
+                   if name.startswith('HTTP_') and name[5:].replace('_', '-').lower() not in _HOP_BY_HOP}
+        if environ.get('CONTENT_TYPE'):
+            headers['Content-Type'] = environ['CONTENT_TYPE']
+        remote_addr = environ.get('REMOTE_ADDR')
+        if remote_addr:
+            forwarded = headers.get('X-Forwarded-For')
+            headers['X-Forwarded-For'] = f'{forwarded}, {remote_addr}' if forwarded else remote_addr
+        length = environ.get('CONTENT_LENGTH')
+        body = environ['wsgi.input'].read(int(length)) if length and length.isdigit() else None
+        query = environ.get('QUERY_STRING')
+        method = environ['REQUEST_METHOD']
+        # Reads and keyed retries are safe to send twice; other writes are not
+        retry = method in ('GET', 'HEAD') or 'Idempotency-Key' in headers
+        try:
+            status, reason, response_headers, data = pool.request(method, f'{path}?{query}' if query else path,
+                                                                  body, headers, retry=retry)
+        except (http.client.HTTPException, OSError):
+            return _respond(start_response, 502, {"error": "Shard unavailable"})
+        start_response(f'{status} {reason}', [(name, value) for name, value in response_headers
+                                              if name.lower() not in _HOP_BY_HOP])
+        return [data]
+
+    def rebalance(self, shards):
+        """Route to shards from now on, moving the accounts whose shard changes
+
+        Each current shard's accounts are exported, and the ones the new ring
+        assigns elsewhere are imported into their new shard. Requests for
+        those accounts wait from the start until the new ring is in place;
+        requests for every other account keep flowing. Copies left on the old
+        shard are no longer routed to. Returns the number of accounts moved.
+        """
+        with self._rebalance_lock:
+            new_ring = HashRing(shards, self.ring.vnodes)
+            pools = dict(self.pools)
+            for url in new_ring.nodes:
+                if url not in pools:
+                    pools[url] = ShardPool(url, **self._pool_options)
+            with self._cond:
+                self._pending = new_ring
+                # Let requests already forwarded for moving accounts finish first
+                while any(self._moves(account_number) for account_number in self._in_flight):
+                    self._cond.wait()
+            try:
+                moved = sum(self._move_accounts(pools[url], new_ring, pools) for url in self.ring.nodes)
+            except BaseException:
+                with self._cond:
+                    self._pending = None
+                    self._cond.notify_all()
+                raise
+            removed = [pools.pop(url) for url in list(pools) if url not in new_ring.nodes]
+            with self._cond:
+                self.ring = new_ring
+                self.pools = pools
+                self._pending = None
+                self._cond.notify_all()
+            for pool in removed:
+                pool.close()
+            return moved
+
+    def _move_accounts(self, source, new_ring, pools):
+        # Streams the source's CSV export and imports the rows new_ring assigns
+        # elsewhere into their new shard, MOVE_BATCH_ROWS at a time
+        conn = source.connect()
+        try:
+            conn.request('GET', '/accounts/export?format=csv', headers=self._shard_admin_headers())
+            response = conn.getresponse()
+            if response.status != 200:
+                raise RuntimeError(f'export from {source.url} failed with status {response.status}')
+            response.readline()
+            batches = {}
+            moved = 0
+            for line in response:
+                account_number = line.split(b',', 1)[0].decode()
+                # Skip copies left behind by earlier rebalances
+                if self.ring.node_for(account_number) != source.url:
+                    continue
+                destination = new_ring.node_for(account_number)
+                if destination != source.url:
+                    batch = batches.setdefault(destination, [])
+                    batch.append(line)
+                    moved += 1
+                    if len(batch) >= MOVE_BATCH_ROWS:
+                        self._import(pools[destination], batches.pop(destination))
+            for destination, batch in batches.items():
+                self._import(pools[destination], batch)
+            return moved
+        finally:
+            conn.close()
+
+    def _import(self, pool, lines):
+        status, _, _, data = pool.request('POST', '/accounts/import?format=csv', b''.join(lines),
+                                          self._shard_admin_headers({'Content-Type': 'text/csv'}))
+        if status != 200 or json.loads(data)['failed']:
+            raise RuntimeError(f'import into {pool.url} failed with status {status}: {data[:200]!r}')
+
+    def _headers(self, headers=None):
+        headers = dict(headers or {})
+        if self.host:
+            headers['Host'] = self.host
+        return headers
+
+    def _shard_admin_headers(self, headers=None):
+        headers = self._headers(headers)
+        if self.shard_token:
+            headers['Authorization'] = f'Bearer {self.shard_token}'
+        return headers
+
+    def _admin(self, environ, start_response):
+        authorization = environ.get('HTTP_AUTHORIZATION', '')
+        if not hmac.compare_digest(authorization.encode(), f'Bearer {self.admin_token}'.encode()):
+            return _respond(start_response, 401, {"error": "Missing or wrong admin token"})
+        method = environ['REQUEST_METHOD']
+        if method == 'GET':
+            return _respond(start_response, 200, self.stats())
+        if method != 'PUT':
+            return _respond(start_response, 404, {"error": "Route not served by the shard router"})
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+            shards = json.loads(environ['wsgi.input'].read(length))['shards']
+            if not isinstance(shards, list) or not all(isinstance(url, str) for url in shards):
+                raise ValueError
+            for url in shards:
+                ShardPool(url)
+            HashRing(shards, self.ring.vnodes)
+        except (ValueError, KeyError, TypeError):
+            return _respond(start_response, 400,
+                            {"error": "Body must be {\"shards\": [...]} with at least one http:// URL"})
+        started = time.perf_counter()
+        try:
+            moved = self.rebalance(shards)
+        except (RuntimeError, http.client.HTTPException, OSError) as e:
+            return _respond(start_response, 502, {"error": f"Rebalance failed: {e}"})
+        result = self.stats()
+        result.update(moved=moved, seconds=round(time.perf_counter() - started, 3))
+        return _respond(start_response, 200, result)
+
+    def stats(self):
+        pools = self.pools
+        return {'shards': list(self.ring.nodes), 'vnodes': self.ring.vnodes,
+                'connections': {url: {'created': pool.created, 'reused': pool.reused}
+                                for url, pool in pools.items()}}
+
+
+def _respond(start_response, status, body):
+    data = (json.dumps(body) + "\n").encode()
+    start_response(_STATUS[status], [('Content-Type', 'application/json'), ('Content-Length', str(len(data)))])
+    return [data]
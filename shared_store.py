@@ -0,0 +1,331 @@
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from contextlib import contextmanager
+
+from store import MAX_CENTS, AccountStore, BalanceOverflowError, StripedLockManager, record_batch
+
+# Header: magic, capacity (slots, a power of two), key width, slot size, used slots
+MAGIC = b'ATMSHM2\0'
+_HEADER = struct.Struct('<8sQIIQ')
+_HEADER_SIZE = 64
+_COUNT = struct.Struct('<Q')
+_COUNT_OFFSET = 24
+# Each slot is an int64 balance, an int64 version, then the account number
+_KEY_OFFSET = 16
+# fcntl record locks live on byte offsets past the end of any real table
+_LOCK_BASE = 1 << 40
+_GROW_LOCK = _LOCK_BASE - 1
+# Inserts are refused beyond this fill ratio to keep probe sequences short
+MAX_LOAD = 0.9
+
+DEFAULT_PATH = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+                            'atm-accounts')
+
+
+class FileStripedLockManager(StripedLockManager):
+    """Striped locks that also exclude other processes.
+
+    Each stripe pairs a thread lock with an fcntl record lock on one byte of
+    the shared file. POSIX record locks belong to the whole process, so the
+    thread lock is taken first to make sure only one thread per process ever
+    holds a given byte. Stripes come from CRC32 rather than hash() so every
+    process maps an account to the same stripe.
+    """
+
+    def __init__(self, fd, stripes=64):
+        super().__init__(stripes)
+        self._fd = fd
+
+    def stripe_for(self, account_number):
+        return zlib.crc32(account_number.encode('utf-8')) % len(self._locks)
+
+    def _acquire(self, index):
+        self._locks[index].acquire()
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, _LOCK_BASE + index)
+        except BaseException:
+            self._locks[index].release()
+            raise
+
+    def _release(self, index):
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, _LOCK_BASE + index)
+        self._locks[index].release()
+
+
+class SharedAccountStore(AccountStore):
+    """Account store in an mmap'd file shared by every gunicorn worker.
+
+    The file holds a fixed-capacity open-addressing hash table; each slot is
+    an int64 balance and an int64 version, bumped on every balance change,
+    followed by the NUL-padded account number. Slots are
+    never moved or freed, so lookups probe without locking. Balance updates
+    take the account's stripe lock, which excludes threads in this process
+    and, via fcntl, every other process mapping the file. Inserts are
+    serialized by a separate lock. The first process to open the file
+    creates it and loads the seed balances; later ones attach to it.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, capacity=1 << 20, key_width=24, balances=None, stripes=64):
+        if capacity & (capacity - 1):
+            raise ValueError('capacity must be a power of two')
+        self.path = path
+        self.journal = None
+        # Transaction history is kept per process, for the operations it served
+        self.history = None
+        # A per-process balance index would miss other workers' updates
+        self.balance_index = None
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self.locks = FileStripedLockManager(self._fd, stripes)
+        self._grow_lock = threading.Lock()
+        with self._growing():
+            created = os.fstat(self._fd).st_size == 0
+            if created:
+                slot_size = (_KEY_OFFSET + key_width + 7) & ~7
+                os.ftruncate(self._fd, _HEADER_SIZE + capacity * slot_size)
+                os.pwrite(self._fd, _HEADER.pack(MAGIC, capacity, key_width, slot_size, 0), 0)
+            self._mmap = mmap.mmap(self._fd, 0)
+            magic, capacity, key_width, slot_size, _ = _HEADER.unpack_from(self._mmap, 0)
+            if magic != MAGIC:
+                self._mmap.close()
+                raise ValueError(f'{path} is not a shared account store')
+            self.capacity = capacity
+            self.key_width = key_width
+            self._slot_size = slot_size
+            # Balances are read and written as int64 words of the whole map
+            self._words = memoryview(self._mmap).cast('q')
+            if created and balances:
+                for account_number, cents in balances.items():
+                    self._insert(account_number, cents)
+
+    @contextmanager
+    def _growing(self):
+        with self._grow_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, _GROW_LOCK)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, _GROW_LOCK)
+
+    def _probe(self, account_number):
+        # Return (offset of the slot holding the account or of the empty slot
+        # ending its probe sequence, whether it was found); offset -1 if the
+        # key cannot be stored or the table is exhausted
+        key = account_number.encode('utf-8')
+        width = self.key_width
+        if not key or len(key) > width or b'\0' in key:
+            return -1, False
+        slot = zlib.crc32(key) & (self.capacity - 1)
+        key = key.ljust(width, b'\0')
+        data = self._mmap
+        mask = self.capacity - 1
+        slot_size = self._slot_size
+        for _ in range(self.capacity):
+            offset = _HEADER_SIZE + slot * slot_size
+            stored = data[offset + _KEY_OFFSET:offset + _KEY_OFFSET + width]
+            if stored == key:
+                return offset, True
+            if stored[0] == 0:
+                return offset, False
+            slot = (slot + 1) & mask
+        return -1, False
+
+    def _word(self, account_number):
+        offset, found = self._probe(account_number)
+        if not found:
+            raise KeyError(account_number)
+        return offset >> 3
+
+    def _insert(self, account_number, cents):
+        # Called under _growing()
+        offset, found = self._probe(account_number)
+        if found:
+            return False
+        if offset < 0:
+            raise ValueError(f'Account number {account_number!r} cannot be stored')
+        count = _COUNT.unpack_from(self._mmap, _COUNT_OFFSET)[0]
+        if count + 1 > self.capacity * MAX_LOAD:
+            raise RuntimeError(f'Shared account store {self.path} is full ({count} accounts)')
+        # Write the balance before the key so readers never see a key without it
+        self._words[offset >> 3] = cents
+        self._words[(offset >> 3) + 1] = 0
+        key = offset + _KEY_OFFSET
+        self._mmap[key:key + self.key_width] = account_number.encode('utf-8').ljust(self.key_width, b'\0')
+        _COUNT.pack_into(self._mmap, _COUNT_OFFSET, count + 1)
+        return True
+
+    def __contains__(self, account_number):
+        return self._probe(account_number)[1]
+
+    def __len__(self):
+        return _COUNT.unpack_from(self._mmap, _COUNT_OFFSET)[0]
+
+    def get_cents(self, account_number, default=None):
+        offset, found = self._probe(account_number)
+        if not found:
+            return default
+        return self._words[offset >> 3]
+
+    def get_versioned(self, account_number):
+        # Lock-free like get_cents; see MemoryAccountStore.get_versioned
+        offset, found = self._probe(account_number)
+        if not found:
+            return None
+        word = offset >> 3
+        return self._words[word], self._words[word + 1]
+
+    def deposit(self, account_number, cents):
+        word = self._word(account_number)
+        with self.locks.hold(account_number):
+            balance = self._words[word] + cents
+            if balance > MAX_CENTS:
+                raise BalanceOverflowError(account_number)
+            self._words[word] = balance
+            self._words[word + 1] += 1
+            if self.history is not None:
+                self.history.record(account_number, 'deposit', cents, balance)
+        return balance
+
+    def withdraw(self, account_number, cents):
+        word = self._word(account_number)
+        with self.locks.hold(account_number):
+            balance = self._words[word]
+            if balance < cents:
+                return False, balance
+            balance -= cents
+            self._words[word] = balance
+            self._words[word + 1] += 1
+            if self.history is not None:
+                self.history.record(account_number, 'withdraw', cents, balance)
+        return True, balance
+
+    def apply_if(self, account_number, kind, cents, expected):
+        word = self._word(account_number)
+        with self.locks.hold(account_number):
+            balance = self._words[word]
+            if (self._words[word + 1], balance) not in expected:
+                return None, balance
+            if kind == 'deposit':
+                balance += cents
+                if balance > MAX_CENTS:
+                    raise BalanceOverflowError(account_number)
+            elif balance < cents:
+                return False, balance
+            else:
+                balance -= cents
+            self._words[word] = balance
+            self._words[word + 1] += 1
+            if self.history is not None:
+                self.history.record(account_number, kind, cents, balance)
+        return True, balance
+
+    def apply_batch(self, operations, atomic):
+        words = [self._word(op[0]) for op in operations]
+        results = []
+        pending = {}
+        failed = False
+        with self.locks.hold_many([op[0] for op in operations]):
+            for word, (account_number, kind, cents) in zip(words, operations):
+                balance = pending[word] if word in pending else self._words[word]
+                if kind == 'deposit':
+                    balance += cents
+                    if balance > MAX_CENTS:
+                        raise BalanceOverflowError(account_number)
+                elif balance < cents:
+                    results.append((False, balance))
+                    failed = True
+                    continue
+                else:
+                    balance -= cents
+                pending[word] = balance
+                results.append((True, balance))
+            if not (atomic and failed):
+                for word, balance in pending.items():
+                    self._words[word] = balance
+                    self._words[word + 1] += 1
+                if self.history is not None:
+                    record_batch(self.history, operations, results)
+        return results
+
+    def transfer(self, from_account, to_account, cents):
+        from_word = self._word(from_account)
+        to_word = self._word(to_account)
+        with self.locks.hold_many((from_account, to_account)):
+            from_balance = self._words[from_word]
+            if from_balance < cents:
+                return False, from_balance, None
+            from_balance -= cents
+            to_balance = self._words[to_word] + cents
+            if to_balance > MAX_CENTS:
+                raise BalanceOverflowError(to_account)
+            self._words[from_word] = from_balance
+            self._words[to_word] = to_balance
+            self._words[from_word + 1] += 1
+            self._words[to_word + 1] += 1
+            if self.history is not None:
+                self.history.record(from_account, 'transfer_out', cents, from_balance)
+                self.history.record(to_account, 'transfer_in', cents, to_balance)
+        return True, from_balance, to_balance
+
+    def create(self, account_number, cents=0):
+        with self._growing():
+            return self._insert(account_number, cents)
+
+    def update(self, balances):
+        created = 0
+        for account_number, cents in balances.items():
+            if self.create(account_number, cents):
+                created += 1
+            else:
+                word = self._word(account_number)
+                with self.locks.hold(account_number):
+                    self._words[word] = cents
+                    self._words[word + 1] += 1
+        return created
+
+    def clear(self):
+        with self._growing():
+            chunk = 1 << 20
+            for start in range(_HEADER_SIZE, len(self._mmap), chunk):
+                stop = min(start + chunk, len(self._mmap))
+                self._mmap[start:stop] = bytes(stop - start)
+            _COUNT.pack_into(self._mmap, _COUNT_OFFSET, 0)
+        if self.history is not None:
+            self.history.clear()
+
+    def items(self):
+        data = self._mmap
+        width = self.key_width
+        for offset in range(_HEADER_SIZE, len(data), self._slot_size):
+            if data[offset + _KEY_OFFSET]:
+                key = data[offset + _KEY_OFFSET:offset + _KEY_OFFSET + width].rstrip(b'\0').decode('utf-8')
+                yield key, self._words[offset >> 3]
+
+    def capture(self):
+        # The whole table is copied in one step with every stripe held, in
+        # this process and via fcntl in every other, so a concurrent transfer
+        # or batch is either wholly in the copy or not at all
+        with self.locks.hold_all():
+            data = self._mmap[:]
+        words = memoryview(data).cast('q')
+        width = self.key_width
+
+        def pairs():
+            for offset in range(_HEADER_SIZE, len(data), self._slot_size):
+                if data[offset + _KEY_OFFSET]:
+                    key = data[offset + _KEY_OFFSET:offset + _KEY_OFFSET + width].rstrip(b'\0').decode('utf-8')
+                    yield key, words[offset >> 3]
+
+        return pairs()
+
+    def memory_bytes(self):
+        return len(self._mmap)
+
+    def close(self):
+        self._words.release()
+        self._mmap.close()
+        os.close(self._fd)
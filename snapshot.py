@@ -0,0 +1,157 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+
+from journal import segment_paths
+
+# Fixed layout, little-endian:
+#   header   magic, format version, key width, account count
+#   keys     count sorted account numbers, NUL-padded to key width
+#   padding  up to an 8-byte boundary
+#   balances count int64 balances in cents, in key order
+MAGIC = b'ATMSNAP\0'
+VERSION = 1
+_HEADER = struct.Struct('<8sIIQ')
+
+
+def _balances_offset(key_width, count):
+    keys_end = _HEADER.size + key_width * count
+    return (keys_end + 7) & ~7
+
+
+def write_snapshot(path, items):
+    """Write (account_number, cents) pairs to path as a snapshot
+
+    The file is written next to path and renamed into place, so readers
+    never see a partial snapshot.
+    """
+    entries = sorted((account_number.encode('utf-8'), cents) for account_number, cents in items)
+    key_width = max((len(key) for key, _ in entries), default=1)
+    count = len(entries)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, key_width, count))
+        f.write(b''.join(key.ljust(key_width, b'\0') for key, _ in entries))
+        f.write(b'\0' * (_balances_offset(key_width, count) - _HEADER.size - key_width * count))
+        f.write(array('q', [cents for _, cents in entries]).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+
+class Snapshot:
+    """Read-only view of a snapshot file served straight from mmap.
+
+    Opening is O(1): nothing is parsed up front, and pages are faulted in by
+    the OS as lookups binary-search the sorted key block.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, key_width, count = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mmap.close()
+            raise ValueError(f'{path} is not a version {VERSION} account snapshot')
+        self.key_width = key_width
+        self._count = count
+        offset = _balances_offset(key_width, count)
+        self._balances = memoryview(self._mmap)[offset:offset + 8 * count].cast('q')
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, account_number):
+        return self.find(account_number) >= 0
+
+    def find(self, account_number):
+        """Return the position of account_number, or -1 if it is not present"""
+        key = account_number.encode('utf-8')
+        width = self.key_width
+        if len(key) > width:
+            return -1
+        key = key.ljust(width, b'\0')
+        data = self._mmap
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = _HEADER.size + mid * width
+            probe = data[start:start + width]
+            if probe < key:
+                lo = mid + 1
+            elif probe > key:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def get_cents(self, account_number, default=None):
+        position = self.find(account_number)
+        if position < 0:
+            return default
+        return self._balances[position]
+
+    def items(self):
+        """Iterate (account_number, cents) pairs in key order"""
+        data = self._mmap
+        width = self.key_width
+        balances = self._balances
+        for position in range(self._count):
+            start = _HEADER.size + position * width
+            yield data[start:start + width].rstrip(b'\0').decode('utf-8'), balances[position]
+
+    def close(self):
+        self._balances.release()
+        self._mmap.close()
+
+
+class SnapshotWriter:
+    """Background thread that periodically snapshots a store.
+
+    Request threads are blocked only while the store's balances are copied,
+    with every account lock held so that no transfer or batch is caught
+    half-applied; the sorting and writing happen on this thread. When the store
+    has a journal it is rotated first, and the previous segment is deleted
+    once the snapshot is on disk, so the snapshot plus the live journal
+    always describe every acknowledged write.
+    """
+
+    def __init__(self, store, path, interval):
+        self.store = store
+        self.path = path
+        self.interval = interval
+        self.last_written = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='snapshot-writer', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def write(self):
+        """Write a snapshot now and return the number of accounts written"""
+        with self._lock:
+            journal = self.store.journal
+            if journal is not None:
+                journal.rotate()
+            count = write_snapshot(self.path, self.store.capture())
+            if journal is not None:
+                # Everything in the retired segments is now in the snapshot
+                for segment in segment_paths(journal.path)[:-1]:
+                    os.remove(segment)
+            self.last_written = time.time()
+            return count
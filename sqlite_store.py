@@ -0,0 +1,292 @@
+import sqlite3
+import threading
+from contextlib import nullcontext
+
+from store import MAX_CENTS, AccountStore, BalanceOverflowError, StripedLockManager, record_batch
+
+DEFAULT_PATH = 'atm-accounts.db'
+# UPDATE ... RETURNING needs SQLite 3.35
+MIN_SQLITE_VERSION = (3, 35, 0)
+
+# Statements are fixed strings with ? parameters, so each connection's
+# statement cache compiles every one of them only once
+_SCHEMA = ('CREATE TABLE accounts (account_number TEXT PRIMARY KEY, cents INTEGER NOT NULL, '
+           'version INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID')
+_EXISTS = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'accounts'"
+# Databases created before balances were versioned get the column added on open
+_COLUMNS = "SELECT name FROM pragma_table_info('accounts')"
+_ADD_VERSION = 'ALTER TABLE accounts ADD COLUMN version INTEGER NOT NULL DEFAULT 0'
+_GET = 'SELECT cents FROM accounts WHERE account_number = ?'
+_GET_VERSIONED = 'SELECT cents, version FROM accounts WHERE account_number = ?'
+_COUNT = 'SELECT count(*) FROM accounts'
+# Matches no row when the new balance would exceed MAX_CENTS (SQLite would make it a float)
+_DEPOSIT = ('UPDATE accounts SET cents = cents + ?, version = version + 1 WHERE account_number = ? AND cents <= ? '
+            'RETURNING cents')
+# The balance check and the write are one statement, so no lock is needed
+_WITHDRAW = ('UPDATE accounts SET cents = cents - ?, version = version + 1 WHERE account_number = ? AND cents >= ? '
+             'RETURNING cents')
+_SET = 'UPDATE accounts SET cents = ?, version = version + 1 WHERE account_number = ?'
+_INSERT = 'INSERT OR IGNORE INTO accounts (account_number, cents) VALUES (?, ?)'
+_ITEMS = 'SELECT account_number, cents FROM accounts'
+
+
+class SQLiteAccountStore(AccountStore):
+    """Account store in a SQLite database, persisted across restarts.
+
+    The database runs in WAL mode, so readers never block the writer and
+    several processes can open the same file. Each thread gets a connection
+    of its own, opened on first use and kept for the life of the thread.
+    Connections run in autocommit mode: a deposit or withdrawal is a single
+    UPDATE ... RETURNING statement, and a withdrawal only matches while
+    cents >= amount, so SQLite applies the check and the write atomically
+    without a Python-side lock. Batches run in BEGIN IMMEDIATE transactions.
+    Every row carries a version that each of these statements increments.
+
+    synchronous is passed to PRAGMA synchronous: FULL fsyncs every commit,
+    NORMAL only at checkpoints (a power loss may lose the last commits but
+    never corrupts the file). A history, if attached, is kept in process
+    memory like the shared store's; its records are written under the
+    account's stripe lock, so they are in the order the balances changed.
+    The first process to create the database loads the seed balances.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, balances=None, synchronous='FULL', timeout=30.0, stripes=64):
+        if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+            raise RuntimeError(f'The SQLite store needs SQLite 3.35 or newer, found {sqlite3.sqlite_version}')
+        if synchronous.upper() not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+            raise ValueError(f'Unknown synchronous setting: {synchronous}')
+        self.path = path
+        self.synchronous = synchronous.upper()
+        self.timeout = timeout
+        self.journal = None
+        self.history = None
+        # A per-process balance index would miss other processes' updates
+        self.balance_index = None
+        # Only guard history records; balances are protected by SQLite itself
+        self.locks = StripedLockManager(stripes)
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        with _Transaction(conn):
+            if conn.execute(_EXISTS).fetchone() is None:
+                conn.execute(_SCHEMA)
+                conn.executemany(_INSERT, (balances or {}).items())
+            elif ('version',) not in conn.execute(_COLUMNS).fetchall():
+                conn.execute(_ADD_VERSION)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                               check_same_thread=False, cached_statements=256)
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        return conn
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _held(self, account_numbers):
+        # History records must be in balance order; without a history no lock is taken
+        if self.history is None:
+            return nullcontext()
+        return self.locks.hold_many(account_numbers)
+
+    def __contains__(self, account_number):
+        return self.get_cents(account_number) is not None
+
+    def __len__(self):
+        return self._connection().execute(_COUNT).fetchone()[0]
+
+    def get_cents(self, account_number, default=None):
+        row = self._connection().execute(_GET, (account_number,)).fetchone()
+        return default if row is None else row[0]
+
+    def get_versioned(self, account_number):
+        return self._connection().execute(_GET_VERSIONED, (account_number,)).fetchone()
+
+    def deposit(self, account_number, cents):
+        conn = self._connection()
+        with self._held((account_number,)):
+            # fetchall() steps the statement to completion, which commits it
+            rows = conn.execute(_DEPOSIT, (cents, account_number, MAX_CENTS - cents)).fetchall()
+            if not rows:
+                if account_number not in self:
+                    raise KeyError(account_number)
+                raise BalanceOverflowError(account_number)
+            balance = rows[0][0]
+            if self.history is not None:
+                self.history.record(account_number, 'deposit', cents, balance)
+        return balance
+
+    def withdraw(self, account_number, cents):
+        conn = self._connection()
+        with self._held((account_number,)):
+            while True:
+                rows = conn.execute(_WITHDRAW, (cents, account_number, cents)).fetchall()
+                if rows:
+                    balance = rows[0][0]
+                    break
+                balance = self.get_cents(account_number)
+                if balance is None:
+                    raise KeyError(account_number)
+                # A deposit in between may have made the withdrawal possible after all
+                if balance < cents:
+                    return False, balance
+            if self.history is not None:
+                self.history.record(account_number, 'withdraw', cents, balance)
+        return True, balance
+
+    def apply_if(self, account_number, kind, cents, expected):
+        conn = self._connection()
+        with self._held((account_number,)), _Transaction(conn) as transaction:
+            row = conn.execute(_GET_VERSIONED, (account_number,)).fetchone()
+            if row is None:
+                raise KeyError(account_number)
+            balance, version = row
+            if (version, balance) not in expected:
+                transaction.rollback()
+                return None, balance
+            if kind == 'deposit':
+                balance += cents
+                if balance > MAX_CENTS:
+                    raise BalanceOverflowError(account_number)
+            elif balance < cents:
+                transaction.rollback()
+                return False, balance
+            else:
+                balance -= cents
+            conn.execute(_SET, (balance, account_number))
+            if self.history is not None:
+                self.history.record(account_number, kind, cents, balance)
+        return True, balance
+
+    def apply_batch(self, operations, atomic):
+        conn = self._connection()
+        results = []
+        pending = {}
+        failed = False
+        with self._held([op[0] for op in operations]), _Transaction(conn) as transaction:
+            for account_number, kind, cents in operations:
+                balance = pending.get(account_number)
+                if balance is None:
+                    row = conn.execute(_GET, (account_number,)).fetchone()
+                    if row is None:
+                        raise KeyError(account_number)
+                    balance = row[0]
+                if kind == 'deposit':
+                    balance += cents
+                    if balance > MAX_CENTS:
+                        raise BalanceOverflowError(account_number)
+                elif balance < cents:
+                    results.append((False, balance))
+                    failed = True
+                    continue
+                else:
+                    balance -= cents
+                pending[account_number] = balance
+                results.append((True, balance))
+            if atomic and failed:
+                transaction.rollback()
+            else:
+                conn.executemany(_SET, ((balance, account_number) for account_number, balance in pending.items()))
+                if self.history is not None:
+                    record_batch(self.history, operations, results)
+        return results
+
+    def transfer(self, from_account, to_account, cents):
+        conn = self._connection()
+        with self._held((from_account, to_account)), _Transaction(conn) as transaction:
+            rows = conn.execute(_WITHDRAW, (cents, from_account, cents)).fetchall()
+            if not rows:
+                row = conn.execute(_GET, (from_account,)).fetchone()
+                if row is None:
+                    raise KeyError(from_account)
+                transaction.rollback()
+                return False, row[0], None
+            from_balance = rows[0][0]
+            rows = conn.execute(_DEPOSIT, (cents, to_account, MAX_CENTS - cents)).fetchall()
+            if not rows:
+                # Raised inside the transaction, so the withdrawal is rolled back
+                if to_account not in self:
+                    raise KeyError(to_account)
+                raise BalanceOverflowError(to_account)
+            to_balance = rows[0][0]
+            if self.history is not None:
+                self.history.record(from_account, 'transfer_out', cents, from_balance)
+                self.history.record(to_account, 'transfer_in', cents, to_balance)
+        return True, from_balance, to_balance
+
+    def create(self, account_number, cents=0):
+        return self._connection().execute(_INSERT, (account_number, cents)).rowcount == 1
+
+    def update(self, balances):
+        conn = self._connection()
+        created = 0
+        with _Transaction(conn):
+            for account_number, cents in balances.items():
+                if conn.execute(_INSERT, (account_number, cents)).rowcount == 1:
+                    created += 1
+                else:
+                    conn.execute(_SET, (cents, account_number))
+        return created
+
+    def clear(self):
+        self._connection().execute('DELETE FROM accounts')
+        if self.history is not None:
+            self.history.clear()
+
+    def items(self):
+        return self.capture()
+
+    def capture(self):
+        # A read transaction on a connection of its own sees the database as
+        # of its first statement while writers carry on, thanks to WAL
+        conn = self._connect()
+        conn.execute('BEGIN')
+        cursor = conn.execute(_ITEMS)
+
+        def pairs():
+            try:
+                yield from cursor
+            finally:
+                conn.close()
+
+        return pairs()
+
+    def memory_bytes(self):
+        # Size of the database file; SQLite's page cache is bounded separately
+        conn = self._connection()
+        return conn.execute('PRAGMA page_count').fetchone()[0] * conn.execute('PRAGMA page_size').fetchone()[0]
+
+    def close(self):
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+
+class _Transaction:
+    # BEGIN IMMEDIATE ... COMMIT, or ROLLBACK on an exception or rollback()
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._done = False
+
+    def __enter__(self):
+        self._conn.execute('BEGIN IMMEDIATE')
+        return self
+
+    def rollback(self):
+        self._conn.execute('ROLLBACK')
+        self._done = True
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self._done:
+            self._conn.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+        return False
@@ -0,0 +1,688 @@
+import sys
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+
+from balance_index import BalanceIndex
+
+# Largest balance an int64 slot holds
+MAX_CENTS = (1 << 63) - 1
+
+
+def to_cents(amount):
+    """Convert a dollar amount (already rounded to 2 places) to integer cents"""
+    return int(round(amount * 100))
+
+
+def from_cents(cents):
+    """Convert integer cents back to the float dollars returned by the API"""
+    return cents / 100
+
+
+class BalanceOverflowError(OverflowError):
+    """A write would take a balance past MAX_CENTS; raised before anything is written"""
+
+    def __init__(self, account_number):
+        super().__init__(f'Balance of account {account_number} would exceed {MAX_CENTS} cents')
+        self.account_number = account_number
+
+
+def record_batch(history, operations, results):
+    """Record the applied operations of a batch; call with its locks held"""
+    for (account_number, kind, cents), (ok, balance) in zip(operations, results):
+        if ok:
+            history.record(account_number, kind, cents, balance)
+
+
+class StripedLockManager:
+    """Per-account locking striped over a fixed pool of locks.
+
+    Each account number hashes onto one stripe, so operations on the same
+    account are serialized while operations on accounts that land on
+    different stripes run in parallel. Wait and hold times are recorded per
+    stripe while the stripe is held, so the bookkeeping needs no extra lock.
+    """
+
+    def __init__(self, stripes=64):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        # Per-stripe [acquisitions, wait_ns, max_wait_ns, hold_ns, max_hold_ns]
+        self._stats = [[0, 0, 0, 0, 0] for _ in range(stripes)]
+
+    def __len__(self):
+        return len(self._locks)
+
+    def stripe_for(self, account_number):
+        return hash(account_number) % len(self._locks)
+
+    @contextmanager
+    def hold(self, account_number):
+        """Hold the lock guarding account_number for the duration of the block"""
+        with self.hold_many((account_number,)):
+            yield
+
+    def hold_many(self, account_numbers):
+        """Hold the locks guarding every account in account_numbers
+
+        Stripes are always acquired in ascending index order, so two callers
+        locking overlapping sets of accounts can never deadlock.
+        """
+        return self._hold(sorted({self.stripe_for(number) for number in account_numbers}))
+
+    def hold_all(self):
+        """Hold every stripe, pausing all balance updates for the duration of the block"""
+        return self._hold(range(len(self._locks)))
+
+    @contextmanager
+    def _hold(self, indexes):
+        acquired = []
+        try:
+            for index in indexes:
+                requested = time.perf_counter_ns()
+                self._acquire(index)
+                acquired.append((index, requested, time.perf_counter_ns()))
+            yield
+        finally:
+            released = time.perf_counter_ns()
+            for index, requested, granted in reversed(acquired):
+                self._record(index, granted - requested, released - granted)
+                self._release(index)
+
+    def _acquire(self, index):
+        self._locks[index].acquire()
+
+    def _release(self, index):
+        self._locks[index].release()
+
+    def _record(self, index, waited, held):
+        # Called with the stripe still held
+        stats = self._stats[index]
+        stats[0] += 1
+        stats[1] += waited
+        stats[3] += held
+        if waited > stats[2]:
+            stats[2] = waited
+        if held > stats[4]:
+            stats[4] = held
+
+    def stats(self):
+        """Aggregate lock-wait and lock-hold timings across all stripes"""
+        acquisitions = sum(s[0] for s in self._stats)
+        wait_ns = sum(s[1] for s in self._stats)
+        hold_ns = sum(s[3] for s in self._stats)
+        return {
+            'stripes': len(self._locks),
+            'acquisitions': acquisitions,
+            'wait_seconds_total': wait_ns / 1e9,
+            'wait_seconds_max': max(s[2] for s in self._stats) / 1e9,
+            'hold_seconds_total': hold_ns / 1e9,
+            'hold_seconds_max': max(s[4] for s in self._stats) / 1e9,
+        }
+
+    def reset_stats(self):
+        for index, lock in enumerate(self._locks):
+            with lock:
+                self._stats[index] = [0, 0, 0, 0, 0]
+
+
+class AccountStore:
+    """Interface the API resources use to read and update balances.
+
+    Balances are integer cents. Implementations are responsible for making
+    deposit, withdraw and apply_batch atomic per account. A write that
+    would take a balance past MAX_CENTS raises BalanceOverflowError and leaves
+    every balance as it was.
+    """
+
+    def __contains__(self, account_number):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def get_cents(self, account_number, default=None):
+        """Return the balance of account_number in cents, or default if missing"""
+        raise NotImplementedError
+
+    def get_versioned(self, account_number):
+        """Return (cents, version) for account_number, or None if missing
+
+        The version of an account goes up with every change to its balance.
+        """
+        raise NotImplementedError
+
+    def deposit(self, account_number, cents):
+        """Add cents to an existing account and return the new balance"""
+        raise NotImplementedError
+
+    def withdraw(self, account_number, cents):
+        """Remove cents from an existing account if the balance allows it
+
+        Returns (True, new balance) on success, or (False, current balance)
+        when the account has insufficient funds.
+        """
+        raise NotImplementedError
+
+    def apply_if(self, account_number, kind, cents, expected):
+        """Apply one deposit or withdrawal only if the account is in an expected state
+
+        expected is a container of (version, cents) pairs, checked under the
+        account lock. Returns (ok, balance) as for withdraw, with ok None and
+        nothing written when the account is in none of the expected states.
+        """
+        raise NotImplementedError
+
+    def apply_batch(self, operations, atomic):
+        """Apply (account_number, type, cents) operations in order
+
+        Returns one (ok, balance) pair per operation, as for withdraw. In
+        atomic mode nothing is written unless every operation succeeds.
+        """
+        raise NotImplementedError
+
+    def transfer(self, from_account, to_account, cents):
+        """Move cents between two distinct existing accounts atomically
+
+        Returns (True, from balance, to balance) on success, or
+        (False, from balance, None) when the source has insufficient funds.
+        """
+        (ok, from_balance), (_, to_balance) = self.apply_batch(
+            [(from_account, 'withdraw', cents), (to_account, 'deposit', cents)], atomic=True)
+        if not ok:
+            return False, from_balance, None
+        return True, from_balance, to_balance
+
+    def create(self, account_number, cents=0):
+        """Create an account, returning False if it already exists"""
+        raise NotImplementedError
+
+    def update(self, balances):
+        """Create or overwrite accounts from a mapping of account number to cents
+
+        Returns the number of accounts created.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def items(self):
+        """Iterate (account_number, cents) pairs"""
+        raise NotImplementedError
+
+    def capture(self):
+        """Return an iterator of (account_number, cents) pairs as of the call
+
+        Writes made while the iterator is consumed do not show up in it.
+        """
+        raise NotImplementedError
+
+    def memory_bytes(self):
+        """Approximate memory held by the store"""
+        raise NotImplementedError
+
+
+class MemoryAccountStore(AccountStore):
+    """Compact in-process store keeping every balance in one int64 array.
+
+    Each account owns a slot in a contiguous array of cents; a dict maps the
+    account number to its slot and a list maps slots back to account numbers.
+    Slots are append-only, so a slot number stays valid for the life of the
+    account. Updates to a slot happen under that account's stripe lock,
+    which also bumps the slot's version in a parallel array.
+
+    With a journal attached, every new balance is appended to it under the
+    account lock and the call returns only once the record is durable. With
+    a history (history.TransactionHistory) attached, every applied
+    transaction is recorded under the same lock, so each account's history
+    is in the order its balance changed. A balance_index
+    (balance_index.BalanceIndex) attached is likewise moved under the lock
+    on every balance change.
+
+    An optional read-only base (a snapshot.Snapshot) serves accounts that
+    have not been written since it was taken; the first write to such an
+    account copies its balance into a slot.
+    """
+
+    def __init__(self, balances=None, locks=None, journal=None, base=None, history=None):
+        self.locks = locks if locks is not None else StripedLockManager()
+        self.journal = journal
+        self.history = history
+        self.balance_index = None
+        self.base = base
+        self._index = {}
+        self._keys = []
+        self._cents = array('q')
+        self._versions = array('Q')
+        # Number of slots copied in from the base
+        self._promoted = 0
+        # Bumped by clear(), so a suspended index knows to start over
+        self._clears = 0
+        # Serializes slot allocation; balance updates only take stripe locks
+        self._grow_lock = threading.Lock()
+        if balances:
+            self.update(balances)
+
+    def __contains__(self, account_number):
+        if account_number in self._index:
+            return True
+        return self.base is not None and account_number in self.base
+
+    def __len__(self):
+        if self.base is None:
+            return len(self._index)
+        return len(self._index) + len(self.base) - self._promoted
+
+    def get_cents(self, account_number, default=None):
+        slot = self._index.get(account_number)
+        if slot is None:
+            if self.base is None:
+                return default
+            return self.base.get_cents(account_number, default)
+        return self._cents[slot]
+
+    def get_versioned(self, account_number):
+        # Read without the lock: a concurrent write may pair the new balance
+        # with the old version or vice versa, which only makes a tag built
+        # from them one that no later read reproduces
+        slot = self._index.get(account_number)
+        if slot is None:
+            if self.base is None:
+                return None
+            cents = self.base.get_cents(account_number)
+            return None if cents is None else (cents, 0)
+        return self._cents[slot], self._versions[slot]
+
+    def _promote(self, account_number):
+        # Give an account that so far only exists in the base a slot of its own
+        cents = None if self.base is None else self.base.get_cents(account_number)
+        if cents is None:
+            raise KeyError(account_number)
+        with self._grow_lock:
+            slot = self._index.get(account_number)
+            if slot is None:
+                self._keys.append(account_number)
+                self._cents.append(cents)
+                self._versions.append(0)
+                slot = self._index[account_number] = len(self._keys) - 1
+                self._promoted += 1
+        return slot
+
+    def deposit(self, account_number, cents):
+        slot = self._index.get(account_number)
+        if slot is None:
+            slot = self._promote(account_number)
+        journal = self.journal
+        with self.locks.hold(account_number):
+            balance = self._cents[slot] + cents
+            if balance > MAX_CENTS:
+                raise BalanceOverflowError(account_number)
+            self._cents[slot] = balance
+            self._versions[slot] += 1
+            if self.balance_index is not None:
+                self.balance_index.move(account_number, balance - cents, balance)
+            if self.history is not None:
+                self.history.record(account_number, 'deposit', cents, balance)
+            if journal is not None:
+                seq = journal.append(account_number, balance)
+        if journal is not None:
+            journal.wait(seq)
+        return balance
+
+    def withdraw(self, account_number, cents):
+        slot = self._index.get(account_number)
+        if slot is None:
+            slot = self._promote(account_number)
+        journal = self.journal
+        with self.locks.hold(account_number):
+            balance = self._cents[slot]
+            if balance < cents:
+                return False, balance
+            balance -= cents
+            self._cents[slot] = balance
+            self._versions[slot] += 1
+            if self.balance_index is not None:
+                self.balance_index.move(account_number, balance + cents, balance)
+            if self.history is not None:
+                self.history.record(account_number, 'withdraw', cents, balance)
+            if journal is not None:
+                seq = journal.append(account_number, balance)
+        if journal is not None:
+            journal.wait(seq)
+        return True, balance
+
+    def apply_if(self, account_number, kind, cents, expected):
+        slot = self._index.get(account_number)
+        if slot is None:
+            slot = self._promote(account_number)
+        journal = self.journal
+        with self.locks.hold(account_number):
+            previous = self._cents[slot]
+            if (self._versions[slot], previous) not in expected:
+                return None, previous
+            if kind == 'deposit':
+                balance = previous + cents
+                if balance > MAX_CENTS:
+                    raise BalanceOverflowError(account_number)
+            elif previous < cents:
+                return False, previous
+            else:
+                balance = previous - cents
+            self._cents[slot] = balance
+            self._versions[slot] += 1
+            if self.balance_index is not None:
+                self.balance_index.move(account_number, previous, balance)
+            if self.history is not None:
+                self.history.record(account_number, kind, cents, balance)
+            if journal is not None:
+                seq = journal.append(account_number, balance)
+        if journal is not None:
+            journal.wait(seq)
+        return True, balance
+
+    def apply_batch(self, operations, atomic):
+        index = self._index
+        results = []
+        pending = {}
+        failed = False
+        with self.locks.hold_many([op[0] for op in operations]):
+            for account_number, kind, cents in operations:
+                slot = index.get(account_number)
+                if slot is None:
+                    slot = self._promote(account_number)
+                balance = pending[slot] if slot in pending else self._cents[slot]
+                if kind == 'deposit':
+                    balance += cents
+                    # Raised before the first slot is written
+                    if balance > MAX_CENTS:
+                        raise BalanceOverflowError(account_number)
+                elif balance < cents:
+                    results.append((False, balance))
+                    failed = True
+                    continue
+                else:
+                    balance -= cents
+                pending[slot] = balance
+                results.append((True, balance))
+            if atomic and failed:
+                return results
+            journal = self.journal
+            seq = 0
+            balance_index = self.balance_index
+            for slot, balance in pending.items():
+                previous = self._cents[slot]
+                self._cents[slot] = balance
+                self._versions[slot] += 1
+                if balance_index is not None:
+                    balance_index.move(self._keys[slot], previous, balance)
+            if journal is not None and pending:
+                # One record for the whole batch, so a crash never replays part of it
+                seq = journal.append_group([(self._keys[slot], balance) for slot, balance in pending.items()])
+            if self.history is not None:
+                record_batch(self.history, operations, results)
+        if seq:
+            journal.wait(seq)
+        return results
+
+    def transfer(self, from_account, to_account, cents):
+        index = self._index
+        from_slot = index.get(from_account)
+        if from_slot is None:
+            from_slot = self._promote(from_account)
+        to_slot = index.get(to_account)
+        if to_slot is None:
+            to_slot = self._promote(to_account)
+        journal = self.journal
+        # hold_many orders the two stripes, so opposing transfers cannot deadlock
+        with self.locks.hold_many((from_account, to_account)):
+            from_balance = self._cents[from_slot]
+            if from_balance < cents:
+                return False, from_balance, None
+            from_balance -= cents
+            to_balance = self._cents[to_slot] + cents
+            # Checked before either slot is written, so money is never debited without its credit
+            if to_balance > MAX_CENTS:
+                raise BalanceOverflowError(to_account)
+            self._cents[from_slot] = from_balance
+            self._cents[to_slot] = to_balance
+            self._versions[from_slot] += 1
+            self._versions[to_slot] += 1
+            if self.balance_index is not None:
+                self.balance_index.move(from_account, from_balance + cents, from_balance)
+                self.balance_index.move(to_account, to_balance - cents, to_balance)
+            if self.history is not None:
+                self.history.record(from_account, 'transfer_out', cents, from_balance)
+                self.history.record(to_account, 'transfer_in', cents, to_balance)
+            if journal is not None:
+                seq = journal.append_group(((from_account, from_balance), (to_account, to_balance)))
+        if journal is not None:
+            journal.wait(seq)
+        return True, from_balance, to_balance
+
+    def create(self, account_number, cents=0):
+        seq = self._create(account_number, cents)
+        if seq is None:
+            return False
+        if seq:
+            self.journal.wait(seq)
+        return True
+
+    def _create(self, account_number, cents):
+        # Returns None if the account exists, else its journal sequence number
+        # (0 without a journal) so bulk callers can wait once for the last one
+        with self._grow_lock:
+            if account_number in self._index or (self.base is not None and account_number in self.base):
+                return None
+            self._keys.append(account_number)
+            self._cents.append(cents)
+            self._versions.append(0)
+            # Publish the slot last so readers never see a slot without a balance
+            self._index[account_number] = len(self._keys) - 1
+            if self.balance_index is not None:
+                self.balance_index.add(account_number, cents)
+            if self.journal is not None:
+                return self.journal.append(account_number, cents)
+        return 0
+
+    def update(self, balances):
+        journal = self.journal
+        index = self._index
+        # New accounts are added under one hold of the allocation lock, so a
+        # large mapping costs a few list and array extends, not a call each
+        with self._grow_lock:
+            base = self.base
+            # Keys and balances are gathered as two flat lists: transposing a
+            # list of pairs with zip(*pairs) makes an iterator per pair, and
+            # enough of those outlive a young collection to set off full ones
+            created_keys = [account_number for account_number in balances
+                            if account_number not in index and (base is None or account_number not in base)]
+            if created_keys:
+                start = len(self._keys)
+                created_cents = [balances[account_number] for account_number in created_keys]
+                self._keys.extend(created_keys)
+                self._cents.extend(created_cents)
+                self._versions.extend([0] * len(created_cents))
+                if self.balance_index is not None:
+                    self.balance_index.add_many(created_keys, array('q', created_cents))
+                if journal is not None:
+                    for account_number, cents in zip(created_keys, created_cents):
+                        journal.append(account_number, cents)
+                # Publish the slots last so readers never see a slot without a balance
+                index.update(zip(created_keys, range(start, len(self._keys))))
+        existing = []
+        if len(created_keys) < len(balances):
+            new = set(created_keys)
+            existing = [item for item in balances.items() if item[0] not in new]
+        for account_number, cents in existing:
+            slot = index.get(account_number)
+            if slot is None:
+                slot = self._promote(account_number)
+            with self.locks.hold(account_number):
+                previous = self._cents[slot]
+                self._cents[slot] = cents
+                self._versions[slot] += 1
+                if self.balance_index is not None:
+                    self.balance_index.move(account_number, previous, cents)
+                if journal is not None:
+                    journal.append(account_number, cents)
+        if journal is not None:
+            journal.sync()
+        return len(created_keys)
+
+    def index_balances(self):
+        """Build a BalanceIndex of every account and attach it as balance_index
+
+        The base is read-only, so its accounts are indexed without any lock
+        and this can run on a background thread while requests are served;
+        balance_index stays None meanwhile. The accounts holding a slot,
+        which include every one written since boot, are then indexed as
+        resume_index() does, from a copy and a catch-up with every lock held.
+        """
+        base = self.base
+        clears = self._clears
+        index = BalanceIndex(() if base is None else base.items())
+        return self.resume_index((index, base, clears, array('q'), array('Q')))
+
+    def suspend_index(self):
+        """Detach balance_index for a bulk load and return a token for resume_index()
+
+        Writes made while it is detached leave the index alone, so an
+        import of many new accounts costs one sorted insert when it is
+        resumed rather than one per batch. Returns None if no index is
+        attached.
+        """
+        with self.locks.hold_all(), self._grow_lock:
+            index = self.balance_index
+            if index is None:
+                return None
+            self.balance_index = None
+            return index, self.base, self._clears, self._cents[:], self._versions[:]
+
+    def resume_index(self, token):
+        """Bring a suspended index up to date with the store and attach it again
+
+        The slots written since the token was taken are found by their
+        version and applied to the index from copies of the store, without
+        locks, in rounds until few are left. Only those are applied with
+        every lock held, so no write falls between the catch-up and the
+        attach. Returns the attached index.
+        """
+        index, base, clears, cents, versions = token
+        # A few rounds at most, in case writes keep outpacing the catch-up
+        for _ in range(4):
+            with self.locks.hold_all(), self._grow_lock:
+                if self._clears != clears:
+                    break
+                current = self._cents[:]
+                current_versions = self._versions[:]
+                keys = self._keys[:]
+            applied = self._catch_up(index, base, keys, cents, versions, current, current_versions)
+            cents, versions = current, current_versions
+            if applied <= 10000:
+                break
+        # Stripes before the allocation lock, the order apply_batch takes them in
+        with self.locks.hold_all(), self._grow_lock:
+            cleared = self._clears != clears
+            if not cleared:
+                self._catch_up(index, base, self._keys, cents, versions, self._cents, self._versions)
+                self.balance_index = index
+        if cleared:
+            # Cleared since the token was taken: index the store afresh
+            return self.index_balances()
+        return index
+
+    @staticmethod
+    def _catch_up(index, base, keys, cents, versions, current, current_versions):
+        # Move index from the slots as (cents, versions) to the slots as
+        # (current, current_versions) and return the number of slots applied.
+        # Every write bumps the slot's version, so runs of unchanged slots are
+        # skipped with one comparison in C.
+        applied = 0
+        step = 4096
+        for start in range(0, len(cents), step):
+            stop = start + step
+            if versions[start:stop] != current_versions[start:stop]:
+                for slot in range(start, min(stop, len(cents))):
+                    if versions[slot] != current_versions[slot]:
+                        index.move(keys[slot], cents[slot], current[slot])
+                        applied += 1
+        start = len(cents)
+        if base is None:
+            # Every slot added since is a new account
+            index.add_many(keys[start:len(current)], current[start:])
+            return applied + len(current) - start
+        # Slots added since are new accounts, or base accounts promoted
+        # with their base balance, which the index already holds
+        created_keys = []
+        created_cents = array('q')
+        for slot in range(start, len(current)):
+            account_number = keys[slot]
+            old_cents = base.get_cents(account_number)
+            if old_cents is None:
+                created_keys.append(account_number)
+                created_cents.append(current[slot])
+            else:
+                index.move(account_number, old_cents, current[slot])
+        index.add_many(created_keys, created_cents)
+        return applied + len(current) - start
+
+    def clear(self):
+        with self._grow_lock:
+            self._index.clear()
+            del self._keys[:]
+            del self._cents[:]
+            del self._versions[:]
+            self.base = None
+            self._promoted = 0
+            self._clears += 1
+        if self.history is not None:
+            self.history.clear()
+        if self.balance_index is not None:
+            self.balance_index.clear()
+
+    def items(self):
+        keys = self._keys
+        cents = self._cents
+        for slot in range(len(cents)):
+            yield keys[slot], cents[slot]
+        if self.base is not None:
+            index = self._index
+            for account_number, base_cents in self.base.items():
+                if account_number not in index:
+                    yield account_number, base_cents
+
+    def capture(self):
+        """Return a point-in-time iterator of (account_number, cents) pairs
+
+        The balance array is copied in a single step with every account lock
+        held, so a transfer or batch is either wholly in the copy or not at
+        all; writes pause only for the copy itself.
+        """
+        with self.locks.hold_all():
+            cents = self._cents[:]
+        # A slot's key never changes, so the keys need no lock; they are
+        # appended before balances, so there is a key for every slot
+        keys = self._keys[:len(cents)]
+        base = self.base
+        index = self._index
+
+        def pairs():
+            yield from zip(keys, cents)
+            if base is not None:
+                captured = len(cents)
+                for account_number, base_cents in base.items():
+                    slot = index.get(account_number)
+                    # Accounts promoted after the copy still had their base balance
+                    if slot is None or slot >= captured:
+                        yield account_number, base_cents
+
+        return pairs()
+
+    def memory_bytes(self):
+        count = len(self._keys)
+        # Account number strings are estimated from the first one to stay O(1)
+        key_size = sys.getsizeof(self._keys[0]) if count else 0
+        return (sys.getsizeof(self._index) + sys.getsizeof(self._keys)
+                + self._cents.buffer_info()[1] * self._cents.itemsize
+                + self._versions.buffer_info()[1] * self._versions.itemsize
+                + count * (key_size + sys.getsizeof(count)))
@@ -1,12 +1,35 @@
 import unittest
+import asyncio
 import json
 import os
 import sys
+import threading
+
+from werkzeug.datastructures import Headers
 
 # Add current directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app import app, accounts
+import asgi_app
+import banking
+import fastpath
+from app import app, accounts, account_locks
+from history import TransactionHistory
+from pipeline import MutationPipeline
+from ratelimit import RateLimiter
+from store import StripedLockManager
+from test_metrics import samples
+from test_ratelimit import FakeClock
+
+
+def reset_accounts():
+    """Reset accounts to the initial seed balances"""
+    accounts.clear()
+    accounts.update({
+        "1001": 50000,
+        "1002": 100000,
+        "1003": 75000
+    })
 
 
 class TestATMBankingAPI(unittest.TestCase):
@@ -22,12 +45,7 @@ class TestATMBankingAPI(unittest.TestCase):
         self.app.testing = True
 
         # Reset accounts to initial state before each test
-        accounts.clear()
-        accounts.update({
-            "1001": {"balance": 500.0},
-            "1002": {"balance": 1000.0},
-            "1003": {"balance": 750.0}
-        })
+        reset_accounts()
 
     def tearDown(self):
         """Clean up after each test method."""
@@ -132,6 +150,26 @@ class TestATMBankingAPI(unittest.TestCase):
         data = json.loads(response.data)
         self.assertEqual(data['error'], 'Deposit amount must be a positive number')
 
+    def test_deposit_non_finite_or_huge_amount(self):
+        """Test NaN, Infinity and amounts beyond the largest balance are refused"""
+        for body, error in (('{"amount": NaN}', 'Deposit amount must be a positive number'),
+                            ('{"amount": Infinity}', f'Deposit amount must not exceed ${banking.MAX_BALANCE}'),
+                            ('{"amount": 1e17}', f'Deposit amount must not exceed ${banking.MAX_BALANCE}'),
+                            ('{"amount": %d}' % 10 ** 400, f'Deposit amount must not exceed ${banking.MAX_BALANCE}')):
+            with self.subTest(body=body[:30]):
+                response = self.app.post('/accounts/1001/deposit', data=body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(json.loads(response.data)['error'], error)
+
+    def test_deposit_past_largest_balance(self):
+        """Test a deposit that would overflow the balance is refused and writes nothing"""
+        accounts.update({"1001": banking.MAX_CENTS - 50})
+        response = self.app.post('/accounts/1001/deposit', data=json.dumps({"amount": 1}),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Balance would exceed the maximum', json.loads(response.data)['error'])
+        self.assertEqual(accounts.get_cents("1001"), banking.MAX_CENTS - 50)
+
     def test_deposit_invalid_amount_type(self):
         """Test deposit with invalid amount type returns 400"""
         deposit_data = {"amount": "not_a_number"}
@@ -381,6 +419,55 @@ class TestATMBankingAPI(unittest.TestCase):
         data = json.loads(response.data)
         self.assertEqual(data['balance'], 500.0)
 
+    # ============= Conditional Request Tests =============
+    def test_balance_etag_and_not_modified(self):
+        """Test balances carry an ETag and polls with it get 304 until the balance changes"""
+        response = self.app.get('/accounts/1001/balance')
+        tag = response.headers['ETag']
+        for if_none_match in (tag, f'W/{tag}', f'"0-1", {tag}', '*'):
+            with self.subTest(if_none_match=if_none_match):
+                response = self.app.get('/accounts/1001/balance', headers={'If-None-Match': if_none_match})
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.data, b'')
+                self.assertEqual(response.headers['ETag'], tag)
+
+        self.app.post('/accounts/1001/deposit', data=json.dumps({"amount": 1}), content_type='application/json')
+        response = self.app.get('/accounts/1001/balance', headers={'If-None-Match': tag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['balance'], 501.0)
+        self.assertNotEqual(response.headers['ETag'], tag)
+        response = self.app.get('/accounts/9999/balance', headers={'If-None-Match': '*'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_conditional_deposit_and_withdraw(self):
+        """Test If-Match writes apply at the current ETag and get 412 once it is stale"""
+        tag = self.app.get('/accounts/1001/balance').headers['ETag']
+        response = self.app.post('/accounts/1001/withdraw', data=json.dumps({"amount": 100}),
+                                 content_type='application/json', headers={'If-Match': tag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['balance'], 400.0)
+
+        for if_match in (tag, f'W/{tag}', 'not-a-tag'):
+            with self.subTest(if_match=if_match):
+                response = self.app.post('/accounts/1001/deposit', data=json.dumps({"amount": 50}),
+                                         content_type='application/json', headers={'If-Match': if_match})
+                self.assertEqual(response.status_code, 412)
+                self.assertEqual(json.loads(response.data)['error'],
+                                 'Account has changed. Current balance: $400.0')
+
+        tag = self.app.get('/accounts/1001/balance').headers['ETag']
+        response = self.app.post('/accounts/1001/withdraw', data=json.dumps({"amount": 500}),
+                                 content_type='application/json', headers={'If-Match': tag})
+        self.assertEqual(response.status_code, 400)
+        response = self.app.post('/accounts/1001/deposit', data=json.dumps({"amount": 50}),
+                                 content_type='application/json', headers={'If-Match': '*'})
+        self.assertEqual(response.status_code, 200)
+        response = self.app.post('/accounts/9999/deposit', data=json.dumps({"amount": 50}),
+                                 content_type='application/json', headers={'If-Match': tag})
+        self.assertEqual(response.status_code, 404)
+        response = self.app.get('/accounts/1001/balance')
+        self.assertEqual(json.loads(response.data)['balance'], 450.0)
+
     # ============= Edge Case Tests =============
     def test_account_balance_persistence_across_requests(self):
         """Test that account balances persist across multiple requests"""
@@ -412,6 +499,1064 @@ class TestATMBankingAPI(unittest.TestCase):
         self.assertIn(response.status_code, [400, 500])  # Different Flask versions handle this differently
 
 
+class AsgiResponse:
+    """Response returned by AsgiTestClient, shaped like Flask's test response"""
+
+    def __init__(self, status_code, headers, data):
+        self.status_code = status_code
+        self.headers = Headers([(name.decode('latin-1'), value.decode('latin-1')) for name, value in headers])
+        self.data = data
+
+
+class AsgiTestClient:
+    """Drives an ASGI app in-process with the subset of Flask's test client API the tests use"""
+
+    def __init__(self, application):
+        self.application = application
+        self.loop = asyncio.new_event_loop()
+
+    def get(self, path, headers=None):
+        return self.open('GET', path, headers=headers)
+
+    def post(self, path, data=None, content_type=None, headers=None):
+        return self.open('POST', path, data=data, content_type=content_type, headers=headers)
+
+    def open(self, method, path, data=None, content_type=None, headers=None):
+        body = data.encode() if isinstance(data, str) else (data or b'')
+        raw_headers = [(b'content-length', str(len(body)).encode())]
+        if content_type:
+            raw_headers.append((b'content-type', content_type.encode()))
+        for name, value in (headers or {}).items():
+            raw_headers.append((name.lower().encode(), value.encode()))
+        path, _, query = path.partition('?')
+        scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+                 'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+                 'root_path': '', 'headers': raw_headers, 'client': ('127.0.0.1', 50000)}
+        status, response_headers, response_body = self.loop.run_until_complete(
+            asgi_app._call(self.application, scope, body))
+        return AsgiResponse(status, response_headers, response_body)
+
+    def close(self):
+        self.loop.close()
+
+
+class TestATMBankingAPIAsgi(TestATMBankingAPI):
+    """Runs every TestATMBankingAPI scenario against the ASGI entry point"""
+
+    def setUp(self):
+        super().setUp()
+        self.app = AsgiTestClient(asgi_app.app)
+
+    def tearDown(self):
+        self.app.close()
+
+    def test_error_bodies_match_flask(self):
+        """Test routing and payload errors are identical to the Flask stack"""
+        flask_client = app.test_client()
+        requests = [
+            ('GET', '/accounts/1001/deposit', None, None),
+            ('POST', '/accounts/1001/balance', None, None),
+            ('GET', '/accounts/1001', None, None),
+            ('POST', '/accounts/1001/deposit', '{"amount": 1}', None),
+            ('POST', '/accounts/1001/withdraw', '{bad', 'application/json'),
+            ('POST', '/accounts/9999/withdraw', '{bad', 'application/json'),
+        ]
+        for method, path, data, content_type in requests:
+            with self.subTest(method=method, path=path):
+                expected = flask_client.open(path, method=method, data=data, content_type=content_type)
+                actual = self.app.open(method, path, data=data, content_type=content_type)
+                self.assertEqual(actual.status_code, expected.status_code)
+                self.assertEqual(actual.data, expected.data)
+                self.assertEqual(actual.headers['Content-Type'], expected.headers['Content-Type'])
+
+
+class TestATMBankingAPIFastPath(TestATMBankingAPI):
+    """Runs every TestATMBankingAPI scenario through the fast-path WSGI dispatcher"""
+
+    def setUp(self):
+        super().setUp()
+        fastpath.install(app)
+
+    def tearDown(self):
+        app.wsgi_app = app.wsgi_app.wsgi_app
+
+    def test_responses_match_flask(self):
+        """Test bodies, status codes and headers are identical to the Flask stack"""
+        flask_client = app.test_client()
+        requests = [
+            ('GET', '/accounts/1001/balance', None, None),
+            ('GET', '/accounts/9999/balance', None, None),
+            ('POST', '/accounts/1001/deposit', '{"amount": 100.456}', 'application/json'),
+            ('POST', '/accounts/1001/withdraw', '{"amount": 0.1}', 'application/json'),
+            ('POST', '/accounts/1001/withdraw', '{"amount": 100000}', 'application/json'),
+            ('POST', '/accounts/1001/withdraw', '{"amount": "x"}', 'application/json'),
+            ('POST', '/accounts/1001/deposit', '[1]', 'application/json'),
+            ('POST', '/accounts/9999/deposit', '{bad', 'application/json'),
+            ('POST', '/accounts/1001/deposit', '{bad', 'application/json'),
+            ('POST', '/accounts/1001/deposit', '{"amount": 1}', 'text/plain'),
+            ('GET', '/accounts/1001/deposit', None, None),
+        ]
+        for method, path, data, content_type in requests:
+            with self.subTest(method=method, path=path, data=data):
+                reset_accounts()
+                app.wsgi_app, fast = app.wsgi_app.wsgi_app, app.wsgi_app
+                expected = flask_client.open(path, method=method, data=data, content_type=content_type)
+                app.wsgi_app = fast
+                reset_accounts()
+                actual = self.app.open(path, method=method, data=data, content_type=content_type)
+                self.assertEqual(actual.status, expected.status)
+                self.assertEqual(actual.data, expected.data)
+                self.assertEqual(sorted(actual.headers.items()), sorted(expected.headers.items()))
+
+    def test_not_modified_matches_flask(self):
+        """Test 304 answers carry the same headers as the Flask stack's"""
+        flask_client = app.test_client()
+        tag = self.app.get('/accounts/1002/balance').headers['ETag']
+        actual = self.app.get('/accounts/1002/balance', headers={'If-None-Match': tag})
+        app.wsgi_app, fast = app.wsgi_app.wsgi_app, app.wsgi_app
+        expected = flask_client.get('/accounts/1002/balance', headers={'If-None-Match': tag})
+        app.wsgi_app = fast
+        self.assertEqual(actual.status, expected.status)
+        self.assertEqual(sorted(actual.headers.items()), sorted(expected.headers.items()))
+
+    def test_falls_back_to_flask(self):
+        """Test requests the fast path does not cover are still served"""
+        response = self.app.get('/accounts/1001/balance', headers={'Origin': 'http://example.com'})
+        self.assertEqual(response.headers['Access-Control-Allow-Origin'], 'http://example.com')
+        response = self.app.post('/accounts/1001/deposit', data=json.dumps({"amount": 1}),
+                                 content_type='application/json', headers={'Idempotency-Key': 'k'})
+        self.assertEqual(response.status_code, 200)
+        app.config['SERVER_NAME'] = 'atm.example.com'
+        try:
+            # Flask warns that the Host does not match SERVER_NAME
+            with self.assertWarns(UserWarning):
+                response = self.app.get('/accounts/1001/balance', headers={'Host': 'other.example.com'})
+            self.assertEqual(response.status_code, 404)
+            response = self.app.get('/accounts/1001/balance', headers={'Host': 'atm.example.com'})
+            self.assertEqual(json.loads(response.data)['balance'], 501.0)
+        finally:
+            app.config['SERVER_NAME'] = None
+
+
+class TestATMBankingAPIPipeline(TestATMBankingAPI):
+    """Runs every TestATMBankingAPI scenario with deposits and withdrawals on the write pipeline"""
+
+    def setUp(self):
+        super().setUp()
+        banking.write_pipeline = MutationPipeline(accounts).start()
+
+    def tearDown(self):
+        banking.write_pipeline.stop()
+        banking.write_pipeline = None
+
+
+class TestBatchTransactions(unittest.TestCase):
+    """Tests for POST /accounts/batch"""
+
+    def setUp(self):
+        app.config['SERVER_NAME'] = None
+        app.config['TESTING'] = True
+        self.app = app.test_client()
+        reset_accounts()
+
+    def _post_batch(self, operations, mode=None):
+        payload = {"operations": operations}
+        if mode:
+            payload["mode"] = mode
+        return self.app.post('/accounts/batch',
+                             data=json.dumps(payload),
+                             content_type='application/json')
+
+    def test_batch_overflow_writes_nothing(self):
+        """Test an atomic batch overflowing one balance leaves every account as it was"""
+        accounts.update({"1002": banking.MAX_CENTS - 50})
+        operations = [{"account_number": "1001", "type": "deposit", "amount": 1},
+                      {"account_number": "1002", "type": "deposit", "amount": 1}]
+        response = self._post_batch(operations)
+        self.assertEqual(response.status_code, 400)
+        data = json.loads(response.data)
+        self.assertEqual([result['status'] for result in data['results']], [424, 400])
+        self.assertEqual(accounts.get_cents("1001"), 50000)
+        self.assertEqual(accounts.get_cents("1002"), banking.MAX_CENTS - 50)
+
+        response = self._post_batch(operations, mode='independent')
+        data = json.loads(response.data)
+        self.assertEqual([result['status'] for result in data['results']], [200, 400])
+        self.assertEqual(accounts.get_cents("1001"), 50100)
+
+    def test_batch_atomic_success(self):
+        """Test atomic batch applies all operations in order"""
+        response = self._post_batch([
+            {"account_number": "1001", "type": "deposit", "amount": 100.0},
+            {"account_number": "1001", "type": "withdraw", "amount": 550.0},
+            {"account_number": "1002", "type": "withdraw", "amount": 0.456},
+        ])
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['mode'], 'atomic')
+        self.assertEqual(data['applied'], 3)
+        self.assertEqual(data['failed'], 0)
+        self.assertEqual([r['balance'] for r in data['results']], [600.0, 50.0, 999.54])
+        self.assertEqual(accounts.get_cents('1001'), 5000)
+        self.assertEqual(accounts.get_cents('1002'), 99954)
+
+    def test_batch_atomic_rolls_back_on_failure(self):
+        """Test atomic batch applies nothing when one operation fails"""
+        response = self._post_batch([
+            {"account_number": "1001", "type": "deposit", "amount": 100.0},
+            {"account_number": "1002", "type": "withdraw", "amount": 5000.0},
+        ])
+        self.assertEqual(response.status_code, 400)
+        data = json.loads(response.data)
+        self.assertEqual(data['applied'], 0)
+        self.assertEqual(data['results'][0]['status'], 424)
+        self.assertEqual(data['results'][1]['status'], 400)
+        self.assertIn('Insufficient funds', data['results'][1]['error'])
+        self.assertEqual(accounts.get_cents('1001'), 50000)
+        self.assertEqual(accounts.get_cents('1002'), 100000)
+
+    def test_batch_independent_reports_per_item(self):
+        """Test independent batch applies valid operations and reports failures"""
+        response = self._post_batch([
+            {"account_number": "1001", "type": "deposit", "amount": 100.0},
+            {"account_number": "9999", "type": "deposit", "amount": 100.0},
+            {"account_number": "1002", "type": "withdraw", "amount": -5},
+            {"account_number": "1003", "type": "withdraw"},
+            {"account_number": "1003", "type": "transfer", "amount": 1.0},
+            {"account_number": "1003", "type": "withdraw", "amount": 800.0},
+        ], mode='independent')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['applied'], 1)
+        self.assertEqual(data['failed'], 5)
+        self.assertEqual([r['status'] for r in data['results']], [200, 404, 400, 400, 400, 400])
+        self.assertEqual(data['results'][1]['error'], 'Account not found')
+        self.assertEqual(data['results'][2]['error'], 'Withdrawal amount must be a positive number')
+        self.assertEqual(data['results'][3]['error'], 'Amount is required')
+        self.assertEqual(accounts.get_cents('1001'), 60000)
+        self.assertEqual(accounts.get_cents('1003'), 75000)
+
+    def test_batch_invalid_payload(self):
+        """Test malformed batch requests return 400"""
+        for payload in ({}, {"operations": []}, {"operations": "nope"}):
+            with self.subTest(payload=payload):
+                response = self.app.post('/accounts/batch', json=payload)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(json.loads(response.data)['error'], 'Operations must be a non-empty list')
+
+        response = self._post_batch([{"account_number": "1001", "type": "deposit", "amount": 1}], mode='eventually')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)['error'], "Mode must be 'atomic' or 'independent'")
+
+
+class TestTransfers(unittest.TestCase):
+    """Tests for POST /accounts/<id>/transfer"""
+
+    def setUp(self):
+        app.config['SERVER_NAME'] = None
+        app.config['TESTING'] = True
+        self.app = app.test_client()
+        reset_accounts()
+
+    def _transfer(self, account_number, payload):
+        return self.app.post(f'/accounts/{account_number}/transfer',
+                             data=json.dumps(payload),
+                             content_type='application/json')
+
+    def test_transfer_success(self):
+        """Test a transfer debits the source and credits the destination"""
+        response = self._transfer('1001', {"to_account": "1002", "amount": 100.456})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['message'], 'Transfer successful. $100.46 moved from account 1001 to account 1002')
+        self.assertEqual(data['balance'], 399.54)
+        self.assertEqual(data['to_balance'], 1100.46)
+        self.assertEqual(accounts.get_cents('1001') + accounts.get_cents('1002'), 150000)
+
+    def test_transfer_overflowing_destination(self):
+        """Test a transfer the destination cannot hold is refused without debiting the source"""
+        accounts.update({"1002": banking.MAX_CENTS - 50})
+        response = self._transfer('1001', {"to_account": "1002", "amount": 100})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Balance would exceed the maximum', json.loads(response.data)['error'])
+        self.assertEqual(accounts.get_cents('1001'), 50000)
+        self.assertEqual(accounts.get_cents('1002'), banking.MAX_CENTS - 50)
+
+    def test_transfer_insufficient_funds(self):
+        """Test a transfer larger than the source balance changes nothing"""
+        response = self._transfer('1001', {"to_account": "1002", "amount": 500.01})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)['error'],
+                         'Insufficient funds. Current balance: $500.0, Requested: $500.01')
+        self.assertEqual(accounts.get_cents('1001'), 50000)
+        self.assertEqual(accounts.get_cents('1002'), 100000)
+
+    def test_transfer_errors(self):
+        """Test invalid transfers return the matching error"""
+        cases = [
+            ('9999', {"to_account": "1002", "amount": 1}, 404, 'Account not found'),
+            ('1001', {"to_account": "9999", "amount": 1}, 404, 'Destination account not found'),
+            ('1001', {"to_account": "1001", "amount": 1}, 400, 'Cannot transfer to the same account'),
+            ('1001', {"amount": 1}, 400, 'Destination account is required'),
+            ('1001', {"to_account": "1002"}, 400, 'Amount is required'),
+            ('1001', {"to_account": "1002", "amount": -1}, 400, 'Transfer amount must be a positive number'),
+        ]
+        for account_number, payload, status, error in cases:
+            with self.subTest(payload=payload):
+                response = self._transfer(account_number, payload)
+                self.assertEqual(response.status_code, status)
+                self.assertEqual(json.loads(response.data)['error'], error)
+
+
+class TestIdempotencyKeys(unittest.TestCase):
+    """Tests for retried deposits and withdrawals carrying an Idempotency-Key"""
+
+    def setUp(self):
+        app.config['SERVER_NAME'] = None
+        app.config['TESTING'] = True
+        self.app = app.test_client()
+        reset_accounts()
+        banking.idempotency_cache.clear()
+
+    def _post(self, action, amount, key, account_number='1001'):
+        return self.app.post(f'/accounts/{account_number}/{action}',
+                             data=json.dumps({"amount": amount}),
+                             content_type='application/json',
+                             headers={'Idempotency-Key': key})
+
+    def test_retry_is_not_applied_twice(self):
+        """Test a retried deposit returns the original response without depositing again"""
+        first = self._post('deposit', 100, 'deposit-1')
+        retry = self._post('deposit', 100, 'deposit-1')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(json.loads(retry.data), json.loads(first.data))
+        self.assertNotIn('Idempotent-Replayed', first.headers)
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(accounts.get_cents('1001'), 60000)
+
+    def test_failures_are_replayed(self):
+        """Test a rejected withdrawal is replayed even if it would now succeed"""
+        first = self._post('withdraw', 600, 'withdraw-1')
+        self.assertEqual(first.status_code, 400)
+        self._post('deposit', 100, 'deposit-1')
+        retry = self._post('withdraw', 600, 'withdraw-1')
+        self.assertEqual(retry.status_code, 400)
+        self.assertEqual(json.loads(retry.data), json.loads(first.data))
+        self.assertEqual(accounts.get_cents('1001'), 60000)
+
+    def test_distinct_keys_apply(self):
+        """Test requests without a key or with different keys are each applied"""
+        self._post('withdraw', 50, 'withdraw-1')
+        self._post('withdraw', 50, 'withdraw-2')
+        self.app.post('/accounts/1001/withdraw', data=json.dumps({"amount": 50}), content_type='application/json')
+        self.assertEqual(accounts.get_cents('1001'), 35000)
+
+    def test_key_reuse_is_rejected(self):
+        """Test a key reused with another amount, account or action is rejected"""
+        self._post('deposit', 100, 'key-1')
+        for action, amount, account_number in [('deposit', 200, '1001'), ('deposit', 100, '1002'),
+                                               ('withdraw', 100, '1001')]:
+            with self.subTest(action=action, amount=amount, account_number=account_number):
+                response = self._post(action, amount, 'key-1', account_number)
+                self.assertEqual(response.status_code, 422)
+                self.assertEqual(json.loads(response.data)['error'],
+                                 'Idempotency-Key was already used for a different request')
+        self.assertEqual(accounts.get_cents('1001'), 60000)
+        self.assertEqual(accounts.get_cents('1002'), 100000)
+
+    def test_key_too_long(self):
+        """Test oversized keys are rejected"""
+        response = self._post('deposit', 100, 'k' * 256)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)['error'], 'Idempotency-Key must be 1 to 255 characters')
+        self.assertEqual(accounts.get_cents('1001'), 50000)
+
+    def test_stats(self):
+        """Test hits and misses are counted"""
+        before = banking.idempotency_cache.stats()
+        self._post('deposit', 100, 'deposit-1')
+        self._post('deposit', 100, 'deposit-1')
+        stats = banking.idempotency_cache.stats()
+        self.assertEqual(stats['entries'], 1)
+        self.assertEqual(stats['misses'] - before['misses'], 1)
+        self.assertEqual(stats['hits'] - before['hits'], 1)
+
+
+class TestIdempotencyKeysAsgi(TestIdempotencyKeys):
+    """Runs every TestIdempotencyKeys scenario against the ASGI entry point"""
+
+    def setUp(self):
+        super().setUp()
+        self.app = AsgiTestClient(asgi_app.app)
+
+    def tearDown(self):
+        self.app.close()
+
+
+class TestRateLimits(unittest.TestCase):
+    """Tests for the per-account and per-client rate limits"""
+
+    def setUp(self):
+        app.config['SERVER_NAME'] = None
+        app.config['TESTING'] = True
+        self.app = app.test_client()
+        reset_accounts()
+        self.clock = FakeClock()
+        self._settings = banking.account_limiter, banking.client_limiter, banking.TRUSTED_PROXY_HOPS
+        banking.account_limiter = RateLimiter(rate=1, burst=2, clock=self.clock)
+        banking.client_limiter = None
+        self.addCleanup(self._restore)
+
+    def _restore(self):
+        banking.account_limiter, banking.client_limiter, banking.TRUSTED_PROXY_HOPS = self._settings
+
+    def _deposit(self, account_number, headers=None):
+        return self.app.post(f'/accounts/{account_number}/deposit', data=json.dumps({"amount": 1}),
+                             content_type='application/json', headers=headers)
+
+    def test_account_limit(self):
+        """Test requests for an account over its limit get 429 with Retry-After"""
+        self.assertEqual(self._deposit('1001').status_code, 200)
+        self.assertEqual(self.app.get('/accounts/1001/balance').status_code, 200)
+        response = self._deposit('1001')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertEqual(json.loads(response.data)['error'], 'Too many requests for account 1001')
+        self.assertEqual(self.app.get('/accounts/1001/balance').status_code, 429)
+        self.assertEqual(accounts.get_cents('1001'), 50100)
+        # Other accounts have buckets of their own
+        self.assertEqual(self._deposit('1002').status_code, 200)
+        self.clock.now += 1
+        self.assertEqual(self._deposit('1001').status_code, 200)
+
+    def test_unknown_account_has_no_bucket(self):
+        """Test requests for accounts that do not exist get 404 without creating buckets"""
+        for _ in range(5):
+            self.assertEqual(self._deposit('9999').status_code, 404)
+        self.assertEqual(banking.account_limiter.stats()['buckets'], 0)
+
+    def test_retry_after_rounds_up(self):
+        """Test Retry-After is the wait in whole seconds, rounded up"""
+        banking.account_limiter = RateLimiter(rate=0.25, burst=1, clock=self.clock)
+        self._deposit('1001')
+        self.clock.now += 1.5
+        self.assertEqual(self._deposit('1001').headers['Retry-After'], '3')
+
+    def test_client_limit(self):
+        """Test clients are told apart by the address the trusted proxy appended"""
+        banking.account_limiter = None
+        banking.client_limiter = RateLimiter(rate=1, burst=1, clock=self.clock)
+        banking.TRUSTED_PROXY_HOPS = 1
+        first = {'X-Forwarded-For': 'spoofed, 203.0.113.7'}
+        self.assertEqual(self._deposit('1001', first).status_code, 200)
+        response = self._deposit('1002', {'X-Forwarded-For': 'other, 203.0.113.7'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(json.loads(response.data)['error'], 'Too many requests from this client')
+        self.assertEqual(self._deposit('1001', {'X-Forwarded-For': '203.0.113.8'}).status_code, 200)
+
+
+class TestRateLimitsFastPath(TestRateLimits):
+    """Runs the rate limit scenarios through the fast-path WSGI dispatcher"""
+
+    def setUp(self):
+        super().setUp()
+        fastpath.install(app)
+
+    def tearDown(self):
+        app.wsgi_app = app.wsgi_app.wsgi_app
+
+
+class TestRateLimitsAsgi(TestRateLimits):
+    """Runs the rate limit scenarios against the ASGI entry point"""
+
+    def setUp(self):
+        super().setUp()
+        self.app = AsgiTestClient(asgi_app.app)
+
+    def tearDown(self):
+        self.app.close()
+
+class TestMetricsEndpoint(unittest.TestCase):
+    """Tests for GET /metrics"""
+
+    def setUp(self):
+        app.config['SERVER_NAME'] = None
+        app.config['TESTING'] = True
+        self.app = app.test_client()
+        reset_accounts()
+
+    def _scrape(self):
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        return samples(response.data.decode())
+
+    def test_requests_are_counted(self):
+        """Test per-route status counts, latency counts and insufficient funds are reported"""
+        before = self._scrape()
+        self.app.get('/accounts/1001/balance')
+        self.app.get('/accounts/9999/balance')
+        self.app.post('/accounts/1001/withdraw', data=json.dumps({"amount": 1000}), content_type='application/json')
+        self.app.post('/accounts/1001/deposit', data=json.dumps({"amount": 1}), content_type='application/json')
+        after = self._scrape()
+
+        def delta(name):
+            return after.get(name, 0) - before.get(name, 0)
+
+        self.assertEqual(delta('atm_http_requests_total{route="balance",status="200"}'), 1)
+        self.assertEqual(delta('atm_http_requests_total{route="balance",status="404"}'), 1)
+        self.assertEqual(delta('atm_http_requests_total{route="withdraw",status="400"}'), 1)
+        self.assertEqual(delta('atm_http_requests_total{route="deposit",status="200"}'), 1)
+        self.assertEqual(delta('atm_http_request_duration_seconds_count{route="balance"}'), 2)
+        self.assertEqual(delta('atm_insufficient_funds_total{route="withdraw"}'), 1)
+        self.assertEqual(after['atm_accounts'], 3)
+        self.assertGreater(after['atm_store_memory_bytes'], 0)
+
+
+class TestMetricsEndpointFastPath(TestMetricsEndpoint):
+    """Runs the /metrics scenarios through the fast-path WSGI dispatcher"""
+
+    def setUp(self):
+        super().setUp()
+        fastpath.install(app)
+
+    def tearDown(self):
+        app.wsgi_app = app.wsgi_app.wsgi_app
+
+
+class TestMetricsEndpointAsgi(TestMetricsEndpoint):
+    """Runs the /metrics scenarios against the ASGI entry point"""
+
+    def setUp(self):
+        super().setUp()
+        self.app = AsgiTestClient(asgi_app.app)
+
+    def tearDown(self):
+        self.app.close()
+
+
+class TestTransactionHistory(unittest.TestCase):
+    """Tests for GET /accounts/<id>/transactions"""
+
+    def setUp(self):
+        app.config['SERVER_NAME'] = None
+        app.config['TESTING'] = True
+        self.app = app.test_client()
+        # Off by default with ATM_STORE=sqlite
+        if accounts.history is None:
+            accounts.history = TransactionHistory(50)
+            self.addCleanup(setattr, accounts, 'history', None)
+        reset_accounts()
+
+    def _deposit(self, account_number, amount):
+        return self.app.post(f'/accounts/{account_number}/deposit',
+                             data=json.dumps({"amount": amount}),
+                             content_type='application/json')
+
+    def test_history_pages(self):
+        """Test transactions are listed newest first and paginated by cursor"""
+        for amount in (1, 2, 3):
+            self._deposit('1001', amount)
+        self.app.post('/accounts/1001/withdraw', data=json.dumps({"amount": 600}),
+                      content_type='application/json')
+        self.app.post('/accounts/1001/transfer', data=json.dumps({"to_account": "1002", "amount": 4}),
+                      content_type='application/json')
+
+        response = self.app.get('/accounts/1001/transactions?limit=2')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['account_number'], '1001')
+        self.assertEqual([(t['id'], t['type'], t['amount'], t['balance']) for t in data['transactions']],
+                         [(4, 'transfer_out', 4.0, 502.0), (3, 'deposit', 3.0, 506.0)])
+        self.assertEqual(data['next_cursor'], 3)
+
+        data = json.loads(self.app.get('/accounts/1001/transactions?limit=2&cursor=3').data)
+        self.assertEqual([t['id'] for t in data['transactions']], [2, 1])
+        self.assertIsNone(data['next_cursor'])
+
+        data = json.loads(self.app.get('/accounts/1002/transactions').data)
+        self.assertEqual([(t['type'], t['balance']) for t in data['transactions']], [('transfer_in', 1004.0)])
+        data = json.loads(self.app.get('/accounts/1003/transactions').data)
+        self.assertEqual(data['transactions'], [])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_history_ndjson(self):
+        """Test format=ndjson streams one transaction per line"""
+        for amount in (1, 2, 3):
+            self._deposit('1001', amount)
+        response = self.app.get('/accounts/1001/transactions?format=ndjson&cursor=3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.data.decode().splitlines()
+        self.assertEqual([json.loads(line)['amount'] for line in lines], [2.0, 1.0])
+
+    def test_history_is_bounded(self):
+        """Test only the most recent transactions are retained"""
+        capacity = accounts.history.capacity
+        for _ in range(capacity + 5):
+            self._deposit('1001', 1)
+        response = self.app.get('/accounts/1001/transactions?format=ndjson')
+        ids = [json.loads(line)['id'] for line in response.data.decode().splitlines()]
+        self.assertEqual(ids, list(range(capacity + 5, 5, -1)))
+
+    def test_history_errors(self):
+        """Test invalid history requests return the matching error"""
+        cases = [
+            ('/accounts/9999/transactions', 404, 'Account not found'),
+            ('/accounts/9999/transactions?format=ndjson', 404, 'Account not found'),
+            ('/accounts/1001/transactions?limit=0', 400, 'Limit must be an integer between 1 and 100'),
+            ('/accounts/1001/transactions?limit=abc', 400, 'Limit must be an integer between 1 and 100'),
+            ('/accounts/1001/transactions?limit=101', 400, 'Limit must be an integer between 1 and 100'),
+            ('/accounts/1001/transactions?cursor=-1', 400, 'Cursor must be a positive integer'),
+            ('/accounts/1001/transactions?format=xml', 400, "Format must be 'json' or 'ndjson'"),
+        ]
+        for url, status, error in cases:
+            with self.subTest(url=url):
+                response = self.app.get(url)
+                self.assertEqual(response.status_code, status)
+                self.assertEqual(json.loads(response.data)['error'], error)
+
+
+class TestBulkBalances(unittest.TestCase):
+    """Tests for GET and POST /accounts/balances"""
+
+    def setUp(self):
+        app.config['SERVER_NAME'] = None
+        app.config['TESTING'] = True
+        self.app = app.test_client()
+        reset_accounts()
+
+    def test_get_balances(self):
+        """Test balances are streamed as a JSON array in request order, missing accounts inline"""
+        response = self.app.get('/accounts/balances?ids=1002,9999,1001&ids=1003')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertEqual(json.loads(response.data), [
+            {"account_number": "1002", "balance": 1000.0},
+            {"account_number": "9999", "error": "Account not found"},
+            {"account_number": "1001", "balance": 500.0},
+            {"account_number": "1003", "balance": 750.0},
+        ])
+
+    def test_post_balances_ndjson(self):
+        """Test a JSON account list can be streamed back as NDJSON"""
+        response = self.app.post('/accounts/balances?format=ndjson',
+                                 data=json.dumps({"account_numbers": ["1001", 1001, "9999"]}),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual([json.loads(line) for line in response.data.decode().splitlines()], [
+            {"account_number": "1001", "balance": 500.0},
+            {"account_number": 1001, "error": "Account number must be a string"},
+            {"account_number": "9999", "error": "Account not found"},
+        ])
+
+    def test_post_balances_text(self):
+        """Test a text/plain body of one account number per line, across several chunks"""
+        # Long enough to span several streamed chunks
+        ids = ['1001', '9999', '1002'] * 400
+        response = self.app.post('/accounts/balances', data='\r\n'.join(ids) + '\n\n',
+                                 content_type='text/plain')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual([item['account_number'] for item in data], ids)
+        self.assertEqual(data[:3], [
+            {"account_number": "1001", "balance": 500.0},
+            {"account_number": "9999", "error": "Account not found"},
+            {"account_number": "1002", "balance": 1000.0},
+        ])
+
+    def test_empty_list(self):
+        """Test an empty account list streams an empty array"""
+        response = self.app.post('/accounts/balances', data=json.dumps({"account_numbers": []}),
+                                  content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data), [])
+
+    def test_bulk_balance_errors(self):
+        """Test invalid bulk balance requests return the matching error"""
+        cases = [
+            ('GET', '/accounts/balances', None, 'ids is required'),
+            ('GET', '/accounts/balances?ids=,', None, 'ids is required'),
+            ('GET', '/accounts/balances?ids=1001&format=xml', None, "Format must be 'json' or 'ndjson'"),
+            ('POST', '/accounts/balances', {"accounts": ["1001"]}, 'account_numbers must be a list'),
+            ('POST', '/accounts/balances', ["1001"], 'account_numbers must be a list'),
+        ]
+        for method, url, payload, error in cases:
+            with self.subTest(method=method, url=url, payload=payload):
+                response = self.app.open(url, method=method,
+                                         data=None if payload is None else json.dumps(payload),
+                                         content_type=None if payload is None else 'application/json')
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(json.loads(response.data)['error'], error)
+
+    def test_json_list_is_capped(self):
+        """Test JSON bodies over the limit are rejected"""
+        limit = banking.BULK_MAX_IDS
+        banking.BULK_MAX_IDS = 2
+        try:
+            response = self.app.post('/accounts/balances',
+                                     data=json.dumps({"account_numbers": ["1001", "1002", "1003"]}),
+                                     content_type='application/json')
+        finally:
+            banking.BULK_MAX_IDS = limit
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('At most 2 account numbers', json.loads(response.data)['error'])
+
+class TestBalanceStats(unittest.TestCase):
+    """Tests for GET /accounts/stats and /accounts/top"""
+
+    def setUp(self):
+        app.config['SERVER_NAME'] = None
+        app.config['TESTING'] = True
+        self.app = app.test_client()
+        reset_accounts()
+
+    def test_stats_follow_writes(self):
+        """Test aggregates reflect deposits, withdrawals and transfers"""
+        data = json.loads(self.app.get('/accounts/stats').data)
+        self.assertEqual(data, {"accounts": 3, "total": 2250.0, "mean": 750.0,
+                                "min": 500.0, "median": 750.0, "max": 1000.0})
+        self.app.post('/accounts/1001/deposit', data=json.dumps({"amount": 600}), content_type='application/json')
+        self.app.post('/accounts/1002/withdraw', data=json.dumps({"amount": 0.5}), content_type='application/json')
+        self.app.post('/accounts/1002/transfer', data=json.dumps({"to_account": "1003", "amount": 1}),
+                      content_type='application/json')
+        data = json.loads(self.app.get('/accounts/stats?below=999').data)
+        self.assertEqual(data, {"accounts": 3, "total": 2849.5, "mean": 949.83, "min": 751.0,
+                                "median": 998.5, "max": 1100.0, "below": 999.0, "accounts_below": 2})
+
+    def test_top(self):
+        """Test the largest balances are listed first"""
+        data = json.loads(self.app.get('/accounts/top?n=2').data)
+        self.assertEqual(data['accounts'], [{"account_number": "1002", "balance": 1000.0},
+                                            {"account_number": "1003", "balance": 750.0}])
+        self.app.post('/accounts/1001/deposit', data=json.dumps({"amount": 600}), content_type='application/json')
+        data = json.loads(self.app.get('/accounts/top').data)
+        self.assertEqual([a['account_number'] for a in data['accounts']], ['1001', '1002', '1003'])
+
+    def test_without_index(self):
+        """Test the endpoints scan the store when no index is maintained, with the same answers"""
+        accounts.create("1004", 90000)
+        indexed = [json.loads(self.app.get(url).data) for url in ('/accounts/stats?below=800', '/accounts/top?n=3')]
+        index = accounts.balance_index
+        accounts.balance_index = None
+        try:
+            self.assertEqual(json.loads(self.app.get('/accounts/stats?below=800').data)['accounts_below'], 2)
+            data = json.loads(self.app.get('/accounts/top?n=1').data)
+            self.assertEqual(data['accounts'], [{"account_number": "1002", "balance": 1000.0}])
+            self.assertEqual([json.loads(self.app.get(url).data) for url in ('/accounts/stats?below=800',
+                                                                               '/accounts/top?n=3')], indexed)
+            accounts.clear()
+            data = json.loads(self.app.get('/accounts/stats?below=800').data)
+            self.assertEqual(data, {"accounts": 0, "total": 0.0, "mean": None, "min": None, "median": None,
+                                    "max": None, "below": 800.0, "accounts_below": 0})
+            self.assertEqual(json.loads(self.app.get('/accounts/top').data), {"accounts": []})
+        finally:
+            accounts.balance_index = index
+
+    def test_empty_store(self):
+        """Test stats of a store without accounts"""
+        accounts.clear()
+        data = json.loads(self.app.get('/accounts/stats').data)
+        self.assertEqual(data, {"accounts": 0, "total": 0.0, "mean": None, "min": None, "median": None, "max": None})
+        self.assertEqual(json.loads(self.app.get('/accounts/top').data), {"accounts": []})
+
+    def test_stats_errors(self):
+        """Test invalid stats and top requests return the matching error"""
+        cases = [
+            ('/accounts/stats?below=abc', 'Below must be a number'),
+            ('/accounts/stats?below=inf', 'Below must be a number'),
+            ('/accounts/top?n=0', 'N must be an integer between 1 and 1000'),
+            ('/accounts/top?n=1001', 'N must be an integer between 1 and 1000'),
+            ('/accounts/top?n=two', 'N must be an integer between 1 and 1000'),
+        ]
+        for url, error in cases:
+            with self.subTest(url=url):
+                response = self.app.get(url)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(json.loads(response.data)['error'], error)
+
+
+class TestImportExport(unittest.TestCase):
+    """Tests for POST /accounts/import and GET /accounts/export"""
+
+    def setUp(self):
+        app.config['SERVER_NAME'] = None
+        app.config['TESTING'] = True
+        self.app = app.test_client()
+        self.app.environ_base['HTTP_AUTHORIZATION'] = 'Bearer secret'
+        self.admin_token = banking.ADMIN_TOKEN
+        banking.ADMIN_TOKEN = 'secret'
+        reset_accounts()
+
+    def tearDown(self):
+        banking.ADMIN_TOKEN = self.admin_token
+        self.wait_for_index()
+
+    def wait_for_index(self):
+        # Let the balance index an import detached be attached again
+        for thread in threading.enumerate():
+            if thread.name == 'balance-index':
+                thread.join()
+
+    def test_import_csv(self):
+        """Test CSV rows create and overwrite accounts, and invalid rows are reported"""
+        body = ('account_number,balance\n2001,10.5\n1001,7\n2002,abc\nbad number,1\n'
+                '2003,1,2\n2004,-1\n"2005",0.015\n')
+        response = self.app.post('/accounts/import', data=body, content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data), {
+            "imported": 3, "created": 2, "updated": 1, "failed": 4, "errors": [
+                {"row": 3, "error": "Balance must be a number between 0 and 92233720368547758"},
+                {"row": 4, "error": "Account number must be 1 to 24 letters, digits, '-' or '_'"},
+                {"row": 5, "error": "Row must be account_number,balance"},
+                {"row": 6, "error": "Balance must be a number between 0 and 92233720368547758"},
+            ]})
+        self.assertEqual(accounts.get_cents("2001"), 1050)
+        self.assertEqual(accounts.get_cents("1001"), 700)
+        self.assertEqual(accounts.get_cents("2005"), 2)
+        # The statistics follow imported accounts, before and after the index is attached again
+        data = json.loads(self.app.get('/accounts/stats').data)
+        self.assertEqual((data['accounts'], data['min'], data['max']), (5, 0.02, 1000.0))
+        self.wait_for_index()
+        data = json.loads(self.app.get('/accounts/stats').data)
+        self.assertEqual((data['accounts'], data['min'], data['max']), (5, 0.02, 1000.0))
+
+    def test_import_ndjson_in_batches(self):
+        """Test an NDJSON upload spanning several batches and read blocks is applied in full"""
+        lines = [json.dumps({"account_number": str(3000 + i), "balance": i}) for i in range(2500)]
+        lines[10] = '[1, 2]'
+        lines[11] = '{"account_number": 12, "balance": 1}'
+        lines[12] = '{"account_number": "3012", "balance": true}'
+        batch_size = banking.IMPORT_BATCH_SIZE
+        banking.IMPORT_BATCH_SIZE = 100
+        try:
+            response = self.app.post('/accounts/import', data='\n'.join(lines), content_type='application/x-ndjson')
+        finally:
+            banking.IMPORT_BATCH_SIZE = batch_size
+        data = json.loads(response.data)
+        self.assertEqual((data['imported'], data['created'], data['failed']), (2497, 2497, 3))
+        self.assertEqual([error['row'] for error in data['errors']], [11, 12, 13])
+        self.assertEqual(len(accounts), 2500)
+        self.assertEqual(accounts.get_cents("5499"), 249900)
+
+    def test_import_errors(self):
+        """Test an empty upload or unknown format is rejected"""
+        response = self.app.post('/accounts/import', data='account_number,balance\n', content_type='text/csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)['error'], 'No accounts to import')
+        response = self.app.post('/accounts/import?format=xml', data='<accounts/>', content_type='text/xml')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)['error'], "Format must be 'csv' or 'ndjson'")
+
+    def test_export_round_trip(self):
+        """Test both export formats list every account and can be imported back"""
+        accounts.update({str(4000 + i): i for i in range(5000)})
+        for output, mimetype in (('csv', 'text/csv'), ('ndjson', 'application/x-ndjson')):
+            with self.subTest(output=output):
+                response = self.app.get(f'/accounts/export?format={output}')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.mimetype, mimetype)
+                exported = response.data
+                reset_accounts()
+                data = json.loads(self.app.post(f'/accounts/import?format={output}', data=exported,
+                                                content_type=mimetype).data)
+                self.assertEqual((data['imported'], data['created'], data['failed']), (5003, 5000, 0))
+                self.assertEqual(accounts.get_cents("1002"), 100000)
+                self.assertEqual(accounts.get_cents("8999"), 4999)
+        self.assertEqual(self.app.get('/accounts/export').data.decode().splitlines()[:2],
+                         ['account_number,balance', '1001,500.0'])
+
+    def test_export_is_point_in_time(self):
+        """Test writes made while an export streams do not show up in it"""
+        accounts.update({str(4000 + i): 100 for i in range(10000)})
+        response = self.app.get('/accounts/export?format=ndjson', buffered=False)
+        chunks = iter(response.response)
+        first = next(chunks)
+        accounts.deposit("13999", 5)
+        accounts.create("20000", 1)
+        body = first + b''.join(chunks)
+        response.close()
+        records = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual(len(records), 10003)
+        self.assertEqual(records[-1], {"account_number": "13999", "balance": 1.0})
+
+    def test_export_bad_format(self):
+        """Test an unknown export format is rejected"""
+        response = self.app.get('/accounts/export?format=xml')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)['error'], "Format must be 'csv' or 'ndjson'")
+
+    def test_admin_token_required(self):
+        """Test import and export need the admin token, and are off without one configured"""
+        requests = [('post', '/accounts/import', {'data': '2001,10\n', 'content_type': 'text/csv'}),
+                    ('get', '/accounts/export', {})]
+        for authorization in (None, 'Bearer wrong', 'secret', 'Bearer secretx'):
+            headers = {} if authorization is None else {'Authorization': authorization}
+            client = app.test_client()
+            for method, url, options in requests:
+                response = getattr(client, method)(url, headers=headers, **options)
+                self.assertEqual(response.status_code, 401)
+                self.assertEqual(json.loads(response.data), {"error": "Missing or wrong admin token"})
+        banking.ADMIN_TOKEN = None
+        for method, url, options in requests:
+            response = getattr(self.app, method)(url, **options)
+            self.assertEqual(response.status_code, 403)
+            self.assertEqual(json.loads(response.data), {"error": "Bulk import and export are disabled"})
+        self.assertIsNone(accounts.get_cents("2001"))
+
+
+class TestConcurrentTransactions(unittest.TestCase):
+    """Stress tests for per-account locking under many request threads"""
+
+    THREADS = 16
+
+    def setUp(self):
+        app.config['SERVER_NAME'] = None
+        app.config['TESTING'] = True
+        reset_accounts()
+        # Switch threads as often as possible to widen any race window
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+
+    def tearDown(self):
+        sys.setswitchinterval(self._switch_interval)
+
+    def _run_threads(self, worker):
+        barrier = threading.Barrier(self.THREADS)
+        results = []
+
+        def run():
+            client = app.test_client()
+            barrier.wait()
+            results.extend(worker(client))
+
+        threads = [threading.Thread(target=run) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_deposits_lose_no_updates(self):
+        """Test parallel deposits to one account are all applied"""
+        per_thread = 50
+
+        def worker(client):
+            return [client.post('/accounts/1001/deposit', json={"amount": 1.0}).status_code
+                    for _ in range(per_thread)]
+
+        statuses = self._run_threads(worker)
+        self.assertEqual(statuses, [200] * self.THREADS * per_thread)
+        self.assertEqual(accounts.get_cents('1001'), 50000 + self.THREADS * per_thread * 100)
+
+    def test_concurrent_withdrawals_never_overdraw(self):
+        """Test parallel withdrawals stop exactly at a zero balance"""
+        per_thread = 60  # 960 attempts against a $750 balance
+
+        def worker(client):
+            return [client.post('/accounts/1003/withdraw', json={"amount": 1.0}).status_code
+                    for _ in range(per_thread)]
+
+        statuses = self._run_threads(worker)
+        self.assertEqual(statuses.count(200), 750)
+        self.assertEqual(statuses.count(400), self.THREADS * per_thread - 750)
+        self.assertEqual(accounts.get_cents('1003'), 0)
+
+    def test_concurrent_mixed_operations_across_accounts(self):
+        """Test deposits and withdrawals on several accounts balance out"""
+        per_thread = 40
+
+        def worker(client):
+            statuses = []
+            for i in range(per_thread):
+                account = ('1001', '1002', '1003')[i % 3]
+                statuses.append(client.post(f'/accounts/{account}/deposit', json={"amount": 2.5}).status_code)
+                statuses.append(client.post(f'/accounts/{account}/withdraw', json={"amount": 1.25}).status_code)
+            return statuses
+
+        statuses = self._run_threads(worker)
+        self.assertTrue(all(status == 200 for status in statuses))
+        total = sum(accounts.get_cents(a) for a in ('1001', '1002', '1003'))
+        self.assertEqual(total, 225000 + self.THREADS * per_thread * 125)
+        self.assertEqual(json.loads(app.test_client().get('/accounts/stats').data)['total'], total / 100)
+
+    def test_lock_stats_record_wait_and_hold(self):
+        """Test the lock manager reports acquisitions and timings"""
+        locks = StripedLockManager(stripes=4)
+        with locks.hold('1001'):
+            pass
+        with locks.hold('1002'):
+            pass
+        stats = locks.stats()
+        self.assertEqual(stats['stripes'], 4)
+        self.assertEqual(stats['acquisitions'], 2)
+        self.assertGreaterEqual(stats['hold_seconds_total'], 0)
+        self.assertGreaterEqual(stats['wait_seconds_max'], 0)
+        self.assertGreater(account_locks.stats()['stripes'], 1)
+
+    def test_hold_many_locks_each_stripe_once(self):
+        """Test locking several accounts that share a stripe does not self-deadlock"""
+        locks = StripedLockManager(stripes=1)
+        with locks.hold_many(['1001', '1002', '1001']):
+            pass
+        self.assertEqual(locks.stats()['acquisitions'], 1)
+
+    def test_concurrent_opposing_batches(self):
+        """Test atomic batches touching accounts in opposite order don't deadlock"""
+        per_thread = 20
+
+        def worker(client):
+            statuses = []
+            for i in range(per_thread):
+                pair = ('1001', '1002') if i % 2 else ('1002', '1001')
+                statuses.append(client.post('/accounts/batch', json={"operations": [
+                    {"account_number": pair[0], "type": "withdraw", "amount": 1.0},
+                    {"account_number": pair[1], "type": "deposit", "amount": 1.0},
+                ]}).status_code)
+            return statuses
+
+        statuses = self._run_threads(worker)
+        self.assertEqual(statuses, [200] * self.THREADS * per_thread)
+        self.assertEqual(accounts.get_cents('1001') + accounts.get_cents('1002'), 150000)
+
+    def test_concurrent_opposing_transfers(self):
+        """Test transfers in both directions between hot accounts never deadlock or lose money"""
+        per_thread = 30
+
+        def worker(client):
+            statuses = []
+            for i in range(per_thread):
+                source, destination = (('1001', '1002'), ('1002', '1001'), ('1003', '1001'))[i % 3]
+                statuses.append(client.post(f'/accounts/{source}/transfer',
+                                            json={"to_account": destination, "amount": 3.0}).status_code)
+            return statuses
+
+        statuses = self._run_threads(worker)
+        self.assertTrue(all(status in (200, 400) for status in statuses))
+        total = sum(accounts.get_cents(a) for a in ('1001', '1002', '1003'))
+        self.assertEqual(total, 225000)
+
+    def test_same_account_always_maps_to_same_stripe(self):
+        """Test an account number is always guarded by the same lock"""
+        locks = StripedLockManager(stripes=8)
+        self.assertEqual(locks.stripe_for('1001'), locks.stripe_for('1001'))
+        self.assertLess(locks.stripe_for('1001'), len(locks))
+
+
+
+class TestConcurrentTransactionsPipeline(TestConcurrentTransactions):
+    """Runs the concurrency stress tests with deposits and withdrawals on the write pipeline"""
+
+    def setUp(self):
+        super().setUp()
+        banking.write_pipeline = MutationPipeline(accounts).start()
+
+    def tearDown(self):
+        banking.write_pipeline.stop()
+        banking.write_pipeline = None
+        super().tearDown()
 
 
 if __name__ == '__main__':
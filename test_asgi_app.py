@@ -0,0 +1,167 @@
+import unittest
+import asyncio
+import http.client
+import json
+import os
+import socket
+import sys
+import threading
+from functools import partial
+
+# Add current directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import asgi_app
+import banking
+from banking import accounts
+
+
+class TestAsyncServer(unittest.TestCase):
+    """Tests for the built-in asyncio HTTP/1.1 server"""
+
+    @classmethod
+    def setUpClass(cls):
+        started = threading.Event()
+        cls.loop = asyncio.new_event_loop()
+
+        def ready(server):
+            cls.port = server.sockets[0].getsockname()[1]
+            started.set()
+
+        cls.task = cls.loop.create_task(asgi_app.serve('127.0.0.1', 0, ready=ready))
+        cls.thread = threading.Thread(target=cls.loop.run_forever, daemon=True)
+        cls.thread.start()
+        started.wait(5)
+
+    @classmethod
+    def tearDownClass(cls):
+        async def shutdown():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(shutdown(), cls.loop).result(5)
+        cls.loop.call_soon_threadsafe(cls.loop.stop)
+        cls.thread.join(5)
+        cls.loop.close()
+
+    def setUp(self):
+        accounts.clear()
+        accounts.update({"1001": 50000, "1002": 100000, "1003": 75000})
+
+    def test_keep_alive_connection_serves_several_requests(self):
+        """Test one connection carries a read, a deposit and a withdrawal"""
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        conn.request('GET', '/accounts/1001/balance')
+        response = conn.getresponse()
+        self.assertEqual(json.loads(response.read()), {"account_number": "1001", "balance": 500.0})
+        sock = conn.sock
+
+        conn.request('POST', '/accounts/1001/deposit', json.dumps({"amount": 100.0}),
+                     {'Content-Type': 'application/json'})
+        self.assertEqual(json.loads(conn.getresponse().read())['balance'], 600.0)
+        conn.request('POST', '/accounts/1001/withdraw', json.dumps({"amount": 1000.0}),
+                     {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        self.assertEqual(response.status, 400)
+        self.assertEqual(json.loads(response.read())['error'],
+                         'Insufficient funds. Current balance: $600.0, Requested: $1000.0')
+        self.assertIs(conn.sock, sock)
+        conn.close()
+
+    def test_blocking_store_writes_run_off_the_loop(self):
+        """Test writes to the SQLite and shared stores are not made on the event loop thread"""
+        threads = []
+        deposit = accounts.deposit
+
+        def recording_deposit(account_number, cents):
+            threads.append(threading.get_ident())
+            return deposit(account_number, cents)
+
+        backend = banking.STORE_BACKEND
+        self.addCleanup(setattr, banking, 'STORE_BACKEND', backend)
+        accounts.deposit = recording_deposit
+        self.addCleanup(delattr, accounts, 'deposit')
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        for store_backend in ('memory', 'sqlite', 'shared'):
+            banking.STORE_BACKEND = store_backend
+            conn.request('POST', '/accounts/1001/deposit', json.dumps({"amount": 1.0}),
+                         {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            response.read()
+            self.assertEqual(response.status, 200)
+        conn.close()
+        self.assertEqual(threads[0], self.thread.ident)
+        self.assertNotIn(self.thread.ident, threads[1:])
+
+    def test_connection_close_is_honoured(self):
+        """Test the server closes the connection when asked to"""
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        conn.request('GET', '/accounts/9999/balance', headers={'Connection': 'close'})
+        response = conn.getresponse()
+        self.assertEqual(response.status, 404)
+        self.assertEqual(response.getheader('connection'), 'close')
+        conn.close()
+
+    def read_until_closed(self, sock):
+        data = b''
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                return data
+            data += chunk
+
+    def test_negative_content_length(self):
+        """Test a negative Content-Length is refused with 400 and the connection closed"""
+        with socket.create_connection(('127.0.0.1', self.port), timeout=5) as sock:
+            sock.sendall(b'POST /accounts/1001/deposit HTTP/1.1\r\nHost: x\r\nContent-Length: -5\r\n\r\n')
+            self.assertEqual(self.read_until_closed(sock),
+                             b'HTTP/1.1 400 Bad Request\r\ncontent-length: 0\r\nconnection: close\r\n\r\n')
+        self.assertEqual(accounts.get_cents("1001"), 50000)
+
+    def test_app_error_answers_500(self):
+        """Test an exception raised by the app is answered with 500 and the connection closed"""
+        async def failing_app(scope, receive, send):
+            raise RuntimeError("boom")
+
+        async def close(server):
+            server.close()
+            await server.wait_closed()
+
+        reported = []
+        handler = self.loop.get_exception_handler()
+        self.loop.set_exception_handler(lambda loop, context: reported.append(context['exception']))
+        self.addCleanup(self.loop.set_exception_handler, handler)
+        server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(partial(asgi_app._serve_connection, failing_app), '127.0.0.1', 0), self.loop).result(5)
+        self.addCleanup(lambda: asyncio.run_coroutine_threadsafe(close(server), self.loop).result(5))
+        with socket.create_connection(server.sockets[0].getsockname(), timeout=5) as sock:
+            sock.sendall(b'GET /accounts/1001/balance HTTP/1.1\r\nHost: x\r\n\r\n')
+            self.assertEqual(self.read_until_closed(sock),
+                             b'HTTP/1.1 500 Internal Server Error\r\ncontent-length: 0\r\nconnection: close\r\n\r\n')
+        self.assertEqual([str(error) for error in reported], ["boom"])
+
+    def test_many_concurrent_connections(self):
+        """Test hundreds of open connections are served concurrently"""
+        async def client(n):
+            reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+            body = json.dumps({"amount": 1.0}).encode()
+            for _ in range(3):
+                writer.write(b'POST /accounts/1002/deposit HTTP/1.1\r\nHost: test\r\n'
+                             b'Content-Type: application/json\r\nContent-Length: %d\r\n\r\n%s' % (len(body), body))
+                head = await reader.readuntil(b'\r\n\r\n')
+                length = int(head.split(b'content-length: ')[1].split(b'\r\n')[0])
+                await reader.readexactly(length)
+                assert head.startswith(b'HTTP/1.1 200')
+            writer.close()
+
+        async def run():
+            await asyncio.gather(*(client(n) for n in range(300)))
+
+        asyncio.run(run())
+        self.assertEqual(accounts.get_cents("1002"), 100000 + 300 * 3 * 100)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
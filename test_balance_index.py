@@ -0,0 +1,252 @@
+import unittest
+import os
+import random
+import sys
+import tempfile
+import threading
+
+# Add current directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from balance_index import BalanceIndex
+from snapshot import Snapshot, write_snapshot
+from store import MemoryAccountStore
+
+
+class TestBalanceIndex(unittest.TestCase):
+    """Unit tests for the sorted balance index"""
+
+    def assertMatches(self, index, balances):
+        ordered = sorted(balances.values())
+        stats = index.stats()
+        self.assertEqual(len(index), len(ordered))
+        self.assertEqual(stats['total'], sum(ordered))
+        self.assertEqual(stats['min'], ordered[0])
+        self.assertEqual(stats['max'], ordered[-1])
+        middle = len(ordered) // 2
+        median = ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) // 2
+        self.assertEqual(stats['median'], median)
+        for cents in (ordered[0], ordered[middle], ordered[-1] + 1, -1):
+            self.assertEqual(index.count_below(cents), sum(1 for value in ordered if value < cents))
+        expected = sorted(((cents, number) for number, cents in balances.items()), reverse=True)[:25]
+        self.assertEqual(index.top(25), [(number, cents) for cents, number in expected])
+
+    def test_empty(self):
+        """Test an empty index reports no balances"""
+        index = BalanceIndex()
+        self.assertEqual(index.stats(), {'count': 0, 'total': 0, 'min': None, 'max': None, 'median': None})
+        self.assertEqual(index.count_below(100), 0)
+        self.assertEqual(index.top(5), [])
+
+    def test_random_moves(self):
+        """Test the index agrees with a full sort across splits and emptied buckets"""
+        rng = random.Random(7)
+        balances = {str(1000 + i): rng.randrange(0, 500) for i in range(300)}
+        index = BalanceIndex(balances.items(), load=4)
+        self.assertMatches(index, balances)
+        for step in range(2000):
+            number = rng.choice(list(balances))
+            if step % 50 == 0:
+                new = str(5000 + step)
+                balances[new] = rng.randrange(0, 500)
+                index.add(new, balances[new])
+            # Skewed moves so buckets at the ends grow and drain
+            cents = rng.choice((0, 499, rng.randrange(0, 500)))
+            index.move(number, balances[number], cents)
+            balances[number] = cents
+        self.assertMatches(index, balances)
+
+    def test_bulk_update(self):
+        """Test adding batches to a populated index, with ties and splits, matches a full sort"""
+        rng = random.Random(11)
+        balances = {str(1000 + i): rng.randrange(0, 50) for i in range(40)}
+        index = BalanceIndex(balances.items(), load=4)
+        for start in range(2000, 2600, 150):
+            batch = {str(start + i): rng.randrange(0, 60) for i in range(150)}
+            index.update(batch.items())
+            balances.update(batch)
+        self.assertMatches(index, balances)
+        # Batches small next to the index are inserted rather than merged
+        for start in range(3000, 3100, 5):
+            batch = {str(start + i): rng.randrange(0, 60) for i in range(5)}
+            index.update(batch.items())
+            balances.update(batch)
+        self.assertMatches(index, balances)
+        index.move("2000", balances["2000"], 7)
+        balances["2000"] = 7
+        self.assertMatches(index, balances)
+
+    def test_move_unknown_entry(self):
+        """Test moving a balance that is not indexed raises KeyError"""
+        index = BalanceIndex([("1001", 100)])
+        with self.assertRaises(KeyError):
+            index.move("1001", 200, 300)
+        with self.assertRaises(KeyError):
+            index.move("1002", 100, 300)
+
+    def test_failed_move_keeps_index(self):
+        """Test a move to an out-of-range balance raises and leaves the index unchanged"""
+        balances = {"1001": 100, "1002": 200}
+        index = BalanceIndex(balances.items())
+        with self.assertRaises(OverflowError):
+            index.move("1001", 100, 1 << 63)
+        self.assertMatches(index, balances)
+        index.move("1001", 100, 300)
+        balances["1001"] = 300
+        self.assertMatches(index, balances)
+
+    def test_top_ties(self):
+        """Test equal balances are listed in descending account number order"""
+        index = BalanceIndex([("1001", 5), ("1003", 5), ("1002", 5), ("1004", 1)])
+        self.assertEqual(index.top(3), [("1003", 5), ("1002", 5), ("1001", 5)])
+        self.assertEqual(index.top(10)[-1], ("1004", 1))
+
+
+class TestStoreBalanceIndex(unittest.TestCase):
+    """The memory store keeps an attached index in step with every write"""
+
+    def setUp(self):
+        self.store = MemoryAccountStore({"1001": 50000, "1002": 100000, "1003": 75000})
+        self.store.balance_index = BalanceIndex(self.store.items())
+
+    def assertIndexed(self):
+        self.assertEqual(sorted((cents, number) for number, cents in self.store.balance_index.top(len(self.store))),
+                         sorted((cents, number) for number, cents in self.store.items()))
+
+    def test_every_write_path(self):
+        """Test deposits, withdrawals, batches, transfers, creates and updates move the index"""
+        self.store.deposit("1001", 100)
+        self.store.withdraw("1002", 300)
+        self.store.withdraw("1003", 10 ** 9)
+        self.store.apply_batch([("1001", 'withdraw', 5), ("1002", 'deposit', 7), ("1001", 'deposit', 1)], atomic=True)
+        self.store.apply_batch([("1001", 'deposit', 5), ("1003", 'withdraw', 10 ** 9)], atomic=True)
+        self.store.apply_batch([("1001", 'deposit', 5), ("1003", 'withdraw', 10 ** 9)], atomic=False)
+        self.store.transfer("1002", "1003", 250)
+        self.store.create("1004", 42)
+        self.store.update({"1001": 1, "1005": 2})
+        self.assertIndexed()
+        self.assertEqual(self.store.balance_index.stats()['total'], sum(cents for _, cents in self.store.items()))
+        self.store.clear()
+        self.assertEqual(len(self.store.balance_index), 0)
+
+    def test_snapshot_base(self):
+        """Test accounts served from a snapshot are indexed and moved on promotion"""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, 'accounts.snapshot')
+        write_snapshot(path, [("2001", 10), ("2002", 20)])
+        base = Snapshot(path)
+        self.addCleanup(base.close)
+        store = MemoryAccountStore(base=base)
+        store.balance_index = BalanceIndex(store.items())
+        store.deposit("2001", 15)
+        self.assertEqual(store.balance_index.top(2), [("2001", 25), ("2002", 20)])
+
+    def snapshot_store(self, items):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, 'accounts.snapshot')
+        write_snapshot(path, items)
+        base = Snapshot(path)
+        self.addCleanup(base.close)
+        return MemoryAccountStore(base=base)
+
+    def test_index_balances_catches_up(self):
+        """Test index_balances applies the accounts written since boot on top of the base"""
+        store = self.snapshot_store([("2001", 10), ("2002", 20), ("2003", 30)])
+        store.deposit("2001", 15)
+        store.create("2004", 5)
+        store.update({"2003": 1, "2005": 2})
+        index = store.index_balances()
+        self.assertIs(store.balance_index, index)
+        self.assertEqual(sorted(index.top(10)), sorted(store.items()))
+        store.withdraw("2002", 20)
+        self.assertEqual(sorted(index.top(10)), sorted(store.items()))
+
+    def test_index_balances_during_writes(self):
+        """Test an index built while other threads write matches the store once attached"""
+        store = self.snapshot_store([(str(10000 + i), 1000) for i in range(20000)])
+        stop = threading.Event()
+
+        def write(seed):
+            rng = random.Random(seed)
+            while not stop.is_set():
+                number = str(10000 + rng.randrange(20000))
+                if rng.random() < 0.5:
+                    store.deposit(number, rng.randrange(1, 100))
+                else:
+                    store.apply_batch([(number, 'withdraw', 1), (str(10000 + rng.randrange(20000)), 'deposit', 1)],
+                                      atomic=True)
+
+        writers = [threading.Thread(target=write, args=(seed,)) for seed in range(4)]
+        for writer in writers:
+            writer.start()
+        try:
+            store.index_balances()
+        finally:
+            stop.set()
+            for writer in writers:
+                writer.join()
+        self.assertEqual(sorted(store.balance_index.top(len(store))), sorted(store.items()))
+
+    def test_index_balances_after_clear(self):
+        """Test a store cleared before the index is attached is indexed from its slots alone"""
+        store = self.snapshot_store([("2001", 10)])
+        store.clear()
+        store.create("3001", 7)
+        self.assertEqual(store.index_balances().top(5), [("3001", 7)])
+
+    def test_suspend_and_resume(self):
+        """Test writes while the index is suspended are applied to it when it is resumed"""
+        store = self.snapshot_store([("2001", 10), ("2002", 20), ("2003", 30)])
+        store.deposit("2001", 5)
+        store.balance_index = BalanceIndex(store.items())
+        token = store.suspend_index()
+        self.assertIsNone(store.balance_index)
+        store.deposit("2001", 1)
+        store.deposit("2001", -1)
+        store.transfer("2002", "2003", 5)
+        store.create("2004", 7)
+        store.update({str(3000 + i): i for i in range(5000)})
+        store.update({"2004": 8, "3001": 9})
+        index = store.resume_index(token)
+        self.assertIs(store.balance_index, index)
+        self.assertEqual(sorted(index.top(len(store))), sorted(store.items()))
+
+    def test_resume_during_writes(self):
+        """Test an index resumed while other threads write matches the store once attached"""
+        store = MemoryAccountStore({str(10000 + i): 1000 for i in range(20000)})
+        store.balance_index = BalanceIndex(store.items())
+        token = store.suspend_index()
+        store.update({str(50000 + i): i for i in range(20000)})
+        stop = threading.Event()
+
+        def write(seed):
+            rng = random.Random(seed)
+            while not stop.is_set():
+                store.apply_batch([(str(10000 + rng.randrange(20000)), 'withdraw', 1),
+                                   (str(50000 + rng.randrange(20000)), 'deposit', 1)], atomic=True)
+
+        writers = [threading.Thread(target=write, args=(seed,)) for seed in range(4)]
+        for writer in writers:
+            writer.start()
+        try:
+            store.resume_index(token)
+        finally:
+            stop.set()
+            for writer in writers:
+                writer.join()
+        self.assertEqual(sorted(store.balance_index.top(len(store))), sorted(store.items()))
+
+    def test_resume_after_clear(self):
+        """Test a store cleared while its index is suspended is indexed afresh"""
+        store = MemoryAccountStore({"1001": 5})
+        store.balance_index = BalanceIndex(store.items())
+        token = store.suspend_index()
+        store.clear()
+        store.create("1002", 7)
+        self.assertEqual(store.resume_index(token).top(5), [("1002", 7)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+import os
+import sys
+
+# Add current directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from history import TransactionHistory
+from store import MemoryAccountStore
+
+
+class TestTransactionHistory(unittest.TestCase):
+    """Unit tests for the per-account transaction ring buffer"""
+
+    def setUp(self):
+        self.history = TransactionHistory(capacity=4)
+
+    def _records(self, account_number, before=None):
+        return [record[:1] + record[2:] for record in self.history.iter_records(account_number, before)]
+
+    def test_newest_first(self):
+        """Test records come back newest first with their sequence numbers"""
+        self.history.record("1001", 'deposit', 100, 50100)
+        self.history.record("1001", 'withdraw', 30, 50070)
+        self.assertEqual(self._records("1001"),
+                         [(2, 'withdraw', 30, 50070), (1, 'deposit', 100, 50100)])
+        self.assertEqual(self._records("1002"), [])
+
+    def test_capacity_is_bounded(self):
+        """Test only the last capacity records are kept and memory stays fixed"""
+        self.history.record("1001", 'deposit', 1, 1)
+        size = self.history.memory_bytes()
+        for i in range(2, 11):
+            self.history.record("1001", 'deposit', i, i)
+        self.assertEqual(self.history.memory_bytes(), size)
+        self.assertEqual([record[0] for record in self._records("1001")], [10, 9, 8, 7])
+
+    def test_before(self):
+        """Test iteration can start below a cursor"""
+        for i in range(1, 7):
+            self.history.record("1001", 'deposit', i, i)
+        self.assertEqual([record[0] for record in self._records("1001", before=5)], [4, 3])
+        # Cursors that fell out of the buffer yield nothing
+        self.assertEqual(self._records("1001", before=3), [])
+
+    def test_overwritten_while_reading(self):
+        """Test a reader stops instead of returning records overwritten under it"""
+        for i in range(1, 5):
+            self.history.record("1001", 'deposit', i, i)
+        records = self.history.iter_records("1001")
+        self.assertEqual(next(records)[0], 4)
+        self.history.record("1001", 'deposit', 5, 5)
+        self.history.record("1001", 'deposit', 6, 6)
+        # Records 1 and 2 were overwritten by 5 and 6, record 3 is still intact
+        self.assertEqual([record[0] for record in records], [3])
+
+    def test_store_records_applied_operations(self):
+        """Test the store records deposits, withdrawals, transfers and batches"""
+        store = MemoryAccountStore({"1001": 50000, "1002": 100000}, history=TransactionHistory(10))
+        store.deposit("1001", 100)
+        store.withdraw("1001", 999999)
+        store.transfer("1001", "1002", 50)
+        store.apply_batch([("1002", 'withdraw', 10), ("1002", 'withdraw', 999999)], atomic=False)
+        store.apply_batch([("1001", 'deposit', 10), ("1001", 'withdraw', 999999)], atomic=True)
+        self.assertEqual([record[2:] for record in store.history.iter_records("1001")],
+                         [('transfer_out', 50, 50050), ('deposit', 100, 50100)])
+        self.assertEqual([record[2:] for record in store.history.iter_records("1002")],
+                         [('withdraw', 10, 100040), ('transfer_in', 50, 100050)])
+        store.clear()
+        self.assertEqual(list(store.history.iter_records("1001")), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
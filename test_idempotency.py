@@ -0,0 +1,115 @@
+import unittest
+import os
+import sys
+import threading
+
+# Add current directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from idempotency import IdempotencyCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestIdempotencyCache(unittest.TestCase):
+    """Unit tests for the Idempotency-Key response cache"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = IdempotencyCache(max_bytes=1 << 20, ttl=60, clock=self.clock)
+        self.calls = 0
+
+    def _handler(self, body=None, status=200):
+        def handler():
+            self.calls += 1
+            return body if body is not None else {'call': self.calls}, status
+        return handler
+
+    def test_replay(self):
+        """Test a stored response is replayed without calling the handler"""
+        self.assertEqual(self.cache.run('a', 'fp', self._handler()), ({'call': 1}, 200, False))
+        self.assertEqual(self.cache.run('a', 'fp', self._handler()), ({'call': 1}, 200, True))
+        self.assertEqual(self.calls, 1)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+
+    def test_conflict(self):
+        """Test a key reused with another fingerprint is rejected"""
+        self.cache.run('a', 'fp', self._handler())
+        body, status, replayed = self.cache.run('a', 'other', self._handler())
+        self.assertEqual(status, 422)
+        self.assertFalse(replayed)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.cache.stats()['conflicts'], 1)
+
+    def test_ttl(self):
+        """Test entries expire ttl seconds after being stored"""
+        self.cache.run('a', 'fp', self._handler())
+        self.clock.now = 59
+        self.assertTrue(self.cache.run('a', 'fp', self._handler())[2])
+        self.clock.now = 60
+        self.assertEqual(self.cache.run('a', 'fp', self._handler()), ({'call': 2}, 200, False))
+        self.assertEqual(self.cache.stats()['expirations'], 1)
+
+    def test_memory_cap_evicts_least_recently_used(self):
+        """Test the size cap evicts the least recently used entries first"""
+        self.cache.run('a', 'fp', self._handler())
+        entry_bytes = self.cache.stats()['bytes']
+        self.cache.max_bytes = entry_bytes * 2
+        self.cache.run('b', 'fp', self._handler())
+        # Touch a so that b is the least recently used
+        self.cache.run('a', 'fp', self._handler())
+        self.cache.run('c', 'fp', self._handler())
+        stats = self.cache.stats()
+        self.assertEqual(stats['entries'], 2)
+        self.assertLessEqual(stats['bytes'], self.cache.max_bytes)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertTrue(self.cache.run('a', 'fp', self._handler())[2])
+        self.assertFalse(self.cache.run('b', 'fp', self._handler())[2])
+
+    def test_concurrent_duplicates_coalesce(self):
+        """Test duplicates arriving during the first execution wait for its response"""
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow():
+            self.calls += 1
+            started.set()
+            release.wait()
+            return {'call': self.calls}, 200
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(self.cache.run('a', 'fp', slow)))
+        leader.start()
+        started.wait()
+        followers = [threading.Thread(target=lambda: results.append(self.cache.run('a', 'fp', slow)))
+                     for _ in range(4)]
+        for thread in followers:
+            thread.start()
+        while self.cache.stats()['coalesced'] < 4:
+            threading.Event().wait(0.001)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(sorted(replayed for _, _, replayed in results), [False] + [True] * 4)
+        self.assertTrue(all(body == {'call': 1} for body, _, _ in results))
+
+    def test_failed_execution_is_not_stored(self):
+        """Test a handler that raises leaves the key free for a retry"""
+        def failing():
+            raise RuntimeError('boom')
+
+        with self.assertRaises(RuntimeError):
+            self.cache.run('a', 'fp', failing)
+        self.assertEqual(self.cache.run('a', 'fp', self._handler()), ({'call': 1}, 200, False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+import os
+import sys
+import tempfile
+import threading
+
+# Add current directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from journal import Journal, encode_group, encode_record, replay
+from store import MemoryAccountStore
+
+
+class TestJournal(unittest.TestCase):
+    """Unit tests for the write-ahead journal"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'accounts.journal')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_replay_keeps_last_balance(self):
+        """Test replay returns the latest balance recorded per account"""
+        journal = Journal(self.path)
+        for account_number, cents in (("1001", 100), ("1002", 5), ("1001", 250)):
+            journal.wait(journal.append(account_number, cents))
+        journal.close()
+        self.assertEqual(replay(self.path), {"1001": 250, "1002": 5})
+
+    def test_replay_missing_file(self):
+        """Test replaying a journal that was never written is empty"""
+        self.assertEqual(replay(self.path), {})
+
+    def test_replay_truncates_torn_tail(self):
+        """Test a partially written record is dropped and truncated"""
+        good = encode_record("1001", 700)
+        with open(self.path, 'wb') as f:
+            f.write(good + encode_record("1002", 9)[:-3])
+        self.assertEqual(replay(self.path), {"1001": 700})
+        self.assertEqual(os.path.getsize(self.path), len(good))
+
+    def test_group_commit_shares_fsyncs(self):
+        """Test concurrent writers are acknowledged with fewer fsyncs than records"""
+        journal = Journal(self.path, fsync_interval=0.005, batch_size=64)
+
+        def writer(n):
+            for i in range(50):
+                journal.wait(journal.append(str(n), i))
+
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = journal.stats()
+        journal.close()
+        self.assertEqual(stats['records'], 400)
+        self.assertEqual(stats['pending'], 0)
+        self.assertLess(stats['fsyncs'], 400)
+        self.assertEqual(replay(self.path), {str(n): 49 for n in range(8)})
+
+    def test_store_rebuilt_from_journal(self):
+        """Test a store with a journal can be rebuilt after a restart"""
+        store = MemoryAccountStore({"1001": 50000}, journal=Journal(self.path))
+        store.deposit("1001", 100)
+        store.withdraw("1001", 50)
+        store.withdraw("1001", 10 ** 9)
+        store.create("1002", 7)
+        store.apply_batch([("1002", "deposit", 3), ("1001", "withdraw", 50)], atomic=True)
+        store.journal.close()
+
+        restored = MemoryAccountStore(replay(self.path))
+        self.assertEqual(dict(restored.items()), dict(store.items()))
+
+    def test_transfer_cut_between_legs(self):
+        """Test a journal cut anywhere inside a transfer replays neither leg"""
+        store = MemoryAccountStore({"1001": 50000, "1002": 100000}, journal=Journal(self.path))
+        store.journal.sync()
+        before = os.path.getsize(self.path)
+        store.transfer("1001", "1002", 2500)
+        store.journal.close()
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        self.assertEqual(replay(self.path), {"1001": 47500, "1002": 102500})
+        for cut in range(before, len(data)):
+            with open(self.path, 'wb') as f:
+                f.write(data[:cut])
+            self.assertEqual(replay(self.path), {"1001": 50000, "1002": 100000})
+            self.assertEqual(os.path.getsize(self.path), before)
+
+    def test_group_records_mix_with_single_ones(self):
+        """Test group records replay in order with single records around them"""
+        with open(self.path, 'wb') as f:
+            f.write(encode_record("1001", 1) + encode_group([("1001", 2), ("1002", 3)]) + encode_record("1002", 4))
+        self.assertEqual(replay(self.path), {"1001": 2, "1002": 4})
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
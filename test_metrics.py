@@ -0,0 +1,93 @@
+import unittest
+import os
+import sys
+import threading
+
+# Add current directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from metrics import Metrics
+
+
+def samples(text):
+    """Parse Prometheus text output into {'name{labels}': value}"""
+    parsed = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            parsed[name] = float(value)
+    return parsed
+
+
+class TestMetrics(unittest.TestCase):
+    """Unit tests for the per-thread metrics registry"""
+
+    def setUp(self):
+        self.metrics = Metrics(buckets=(0.001, 0.01))
+
+    def test_histogram(self):
+        """Test durations land in cumulative buckets with sum and count"""
+        self.metrics.observe('balance', 200, 0.0005)
+        self.metrics.observe('balance', 200, 0.001)
+        self.metrics.observe('balance', 404, 0.005)
+        self.metrics.observe('balance', 200, 1.0)
+        parsed = samples(self.metrics.render())
+        self.assertEqual(parsed['atm_http_requests_total{route="balance",status="200"}'], 3)
+        self.assertEqual(parsed['atm_http_requests_total{route="balance",status="404"}'], 1)
+        self.assertEqual(parsed['atm_http_request_duration_seconds_bucket{route="balance",le="0.001"}'], 2)
+        self.assertEqual(parsed['atm_http_request_duration_seconds_bucket{route="balance",le="0.01"}'], 3)
+        self.assertEqual(parsed['atm_http_request_duration_seconds_bucket{route="balance",le="+Inf"}'], 4)
+        self.assertEqual(parsed['atm_http_request_duration_seconds_count{route="balance"}'], 4)
+        self.assertAlmostEqual(parsed['atm_http_request_duration_seconds_sum{route="balance"}'], 1.0065)
+
+    def test_threads_are_summed_and_survive_exit(self):
+        """Test counts recorded by many threads, including exited ones, are all reported"""
+        def record():
+            for _ in range(1000):
+                self.metrics.observe('deposit', 200, 0.0001)
+                self.metrics.count_insufficient_funds('withdraw')
+
+        threads = [threading.Thread(target=record) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for _ in range(2):
+            parsed = samples(self.metrics.render())
+            self.assertEqual(parsed['atm_http_requests_total{route="deposit",status="200"}'], 8000)
+            self.assertEqual(parsed['atm_insufficient_funds_total{route="withdraw"}'], 8000)
+
+    def test_instrument(self):
+        """Test the decorator records the returned or raised status"""
+        class Rejected(Exception):
+            code = 415
+
+        @self.metrics.instrument('deposit')
+        def handler(outcome):
+            if outcome == 'raise':
+                raise Rejected()
+            return outcome
+
+        self.assertEqual(handler(({}, 404)), ({}, 404))
+        handler(({}, 200, {'X': 'y'}))
+        handler({})
+        with self.assertRaises(Rejected):
+            handler('raise')
+        parsed = samples(self.metrics.render())
+        self.assertEqual(parsed['atm_http_requests_total{route="deposit",status="404"}'], 1)
+        self.assertEqual(parsed['atm_http_requests_total{route="deposit",status="200"}'], 2)
+        self.assertEqual(parsed['atm_http_requests_total{route="deposit",status="415"}'], 1)
+
+    def test_collectors(self):
+        """Test registered gauges are read at scrape time"""
+        value = [3]
+        self.metrics.register('atm_accounts', 'gauge', 'Accounts', lambda: value[0])
+        self.metrics.register('atm_events_total', 'counter', 'Events', lambda: [({'event': 'hits'}, 2)])
+        value[0] = 5
+        text = self.metrics.render()
+        self.assertIn('# TYPE atm_accounts gauge\natm_accounts 5\n', text)
+        self.assertIn('atm_events_total{event="hits"} 2\n', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
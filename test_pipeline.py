@@ -0,0 +1,144 @@
+import unittest
+import os
+import sys
+import threading
+import time
+
+# Add current directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from history import TransactionHistory
+from pipeline import MutationPipeline
+from store import MAX_CENTS, BalanceOverflowError, MemoryAccountStore
+
+
+class SlowStore(MemoryAccountStore):
+    """Store whose batches take a while, so mutations queue up behind them"""
+
+    def apply_batch(self, operations, atomic):
+        time.sleep(0.01)
+        return super().apply_batch(operations, atomic)
+
+
+class FailingStore(MemoryAccountStore):
+    """Store refusing every batch that touches account 1002, before writing anything"""
+
+    def apply_batch(self, operations, atomic):
+        if any(op[0] == "1002" for op in operations):
+            raise RuntimeError('database is locked')
+        return super().apply_batch(operations, atomic)
+
+
+class TestMutationPipeline(unittest.TestCase):
+    """Unit tests for the single-writer mutation pipeline"""
+
+    def setUp(self):
+        self.store = MemoryAccountStore({"1001": 50000, "1002": 100000, "1003": 75000})
+        self.pipeline = MutationPipeline(self.store).start()
+
+    def tearDown(self):
+        self.pipeline.stop()
+
+    def _run_threads(self, count, work):
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_same_results_as_the_store(self):
+        """Test deposits and withdrawals return what direct store calls would"""
+        self.assertEqual(self.pipeline.deposit("1001", 150), 50150)
+        self.assertEqual(self.pipeline.withdraw("1003", 80000), (False, 75000))
+        self.assertEqual(self.pipeline.withdraw("1003", 75000), (True, 0))
+        self.assertEqual(self.store.get_cents("1001"), 50150)
+        with self.assertRaises(KeyError):
+            self.pipeline.deposit("9999", 1)
+        self.assertEqual(self.pipeline.deposit("1002", 1), 100001)
+
+    def test_concurrent_mutations_are_batched(self):
+        """Test mutations queued behind a running batch are applied together, none lost"""
+        self.pipeline.stop()
+        self.store = SlowStore({"1001": 0, "1003": 500})
+        self.pipeline = MutationPipeline(self.store, max_batch=8).start()
+        withdrawn = []
+
+        def work(i):
+            for _ in range(5):
+                self.pipeline.deposit("1001", 1)
+                withdrawn.append(self.pipeline.withdraw("1003", 10)[0])
+
+        self._run_threads(16, work)
+        self.assertEqual(self.store.get_cents("1001"), 80)
+        self.assertEqual(withdrawn.count(True), 50)
+        self.assertEqual(self.store.get_cents("1003"), 0)
+        stats = self.pipeline.stats()
+        self.assertEqual(stats['operations'], 160)
+        self.assertLess(stats['batches'], 80)
+        self.assertEqual(stats['largest_batch'], 8)
+
+    def test_failed_mutation_does_not_fail_its_batch(self):
+        """Test a mutation the store rejects fails alone and the rest of its batch is applied"""
+        self.pipeline.stop()
+        self.store = FailingStore({"1001": 0, "1002": 0, "1004": MAX_CENTS - 5})
+        self.pipeline = MutationPipeline(self.store, max_batch=4, max_delay=0.5).start()
+        outcomes = {}
+
+        def work(i):
+            account_number = ("1001", "1002", "1004", "9999")[i]
+            try:
+                outcomes[account_number] = self.pipeline.deposit(account_number, 10)
+            except Exception as e:
+                outcomes[account_number] = type(e)
+
+        self._run_threads(4, work)
+        self.assertEqual(self.pipeline.stats()['batches'], 1)
+        self.assertEqual(outcomes, {"1001": 10, "1002": RuntimeError, "1004": BalanceOverflowError,
+                                    "9999": KeyError})
+        self.assertEqual(self.store.get_cents("1001"), 10)
+        self.assertEqual(self.store.get_cents("1002"), 0)
+        self.assertEqual(self.store.get_cents("1004"), MAX_CENTS - 5)
+
+    def test_history_follows_queue_order(self):
+        """Test every applied mutation is recorded with the balance it produced"""
+        self.store.history = TransactionHistory(capacity=200)
+
+        def work(i):
+            for _ in range(50):
+                self.pipeline.deposit("1001", 1)
+
+        self._run_threads(4, work)
+        balances = [record[4] for record in self.store.history.iter_records("1001")]
+        self.assertEqual(balances, list(range(50200, 50000, -1)))
+
+    def test_max_delay_fills_batches(self):
+        """Test the applier waits up to max_delay for more mutations"""
+        self.pipeline.stop()
+        self.pipeline = MutationPipeline(self.store, max_batch=4, max_delay=0.5).start()
+        started = time.monotonic()
+        self._run_threads(4, lambda i: self.pipeline.deposit("1001", 1))
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(self.pipeline.stats()['batches'], 1)
+
+    def test_full_queue_blocks_until_drained(self):
+        """Test a queue smaller than the number of writers still serves them all"""
+        self.pipeline.stop()
+        self.pipeline = MutationPipeline(self.store, max_batch=2, capacity=2).start()
+        self._run_threads(8, lambda i: [self.pipeline.deposit("1002", 1) for _ in range(20)])
+        self.assertEqual(self.store.get_cents("1002"), 100160)
+
+    def test_stop(self):
+        """Test a stopped pipeline refuses new mutations"""
+        self.pipeline.stop()
+        with self.assertRaises(RuntimeError):
+            self.pipeline.deposit("1001", 1)
+
+    def test_invalid_settings(self):
+        """Test nonsensical settings are rejected"""
+        for kwargs in ({'capacity': 100}, {'max_batch': 0}, {'max_delay': -1}):
+            with self.assertRaises(ValueError):
+                MutationPipeline(self.store, **kwargs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import unittest
+import os
+import sys
+import threading
+
+# Add current directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ratelimit import RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRateLimiter(unittest.TestCase):
+    """Unit tests for the sharded token-bucket rate limiter"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = RateLimiter(rate=2, burst=3, clock=self.clock)
+
+    def test_burst_then_refill(self):
+        """Test a burst is allowed, then tokens come back at the configured rate"""
+        self.assertEqual([self.limiter.acquire("1001") for _ in range(3)], [0.0, 0.0, 0.0])
+        self.assertAlmostEqual(self.limiter.acquire("1001"), 0.5)
+        self.clock.now += 0.25
+        self.assertAlmostEqual(self.limiter.acquire("1001"), 0.25)
+        self.clock.now += 0.25
+        self.assertEqual(self.limiter.acquire("1001"), 0.0)
+        self.assertAlmostEqual(self.limiter.acquire("1001"), 0.5)
+
+    def test_keys_are_independent(self):
+        """Test one key running out of tokens does not affect another"""
+        for _ in range(3):
+            self.limiter.acquire("1001")
+        self.assertGreater(self.limiter.acquire("1001"), 0)
+        self.assertEqual(self.limiter.acquire("1002"), 0.0)
+
+    def test_refill_is_capped_at_burst(self):
+        """Test a long pause does not bank more than burst tokens"""
+        self.limiter.acquire("1001")
+        self.clock.now += 3600
+        self.assertEqual([self.limiter.acquire("1001") for _ in range(3)], [0.0, 0.0, 0.0])
+        self.assertGreater(self.limiter.acquire("1001"), 0)
+
+    def test_idle_buckets_are_evicted(self):
+        """Test buckets that have refilled completely are dropped"""
+        limiter = RateLimiter(rate=2, burst=3, shards=1, clock=self.clock)
+        for i in range(10):
+            limiter.acquire(str(i))
+        self.assertEqual(limiter.stats()['buckets'], 10)
+        self.clock.now += limiter.idle
+        limiter.acquire("new")
+        stats = limiter.stats()
+        self.assertEqual(stats['buckets'], 1)
+        self.assertEqual(stats['evictions'], 10)
+
+    def test_max_keys(self):
+        """Test each shard holds a bounded number of buckets, dropping the oldest"""
+        limiter = RateLimiter(rate=2, burst=3, max_keys=4, shards=1, clock=self.clock)
+        for key in ("a", "b", "c", "d"):
+            limiter.acquire(key)
+            limiter.acquire(key)
+        limiter.acquire("e")
+        self.assertEqual(limiter.stats()['buckets'], 4)
+        self.assertEqual(limiter.stats()['evictions'], 1)
+        # "b" kept its bucket; "a" was dropped, so it starts again from a full one
+        self.assertEqual(limiter.acquire("b"), 0.0)
+        self.assertGreater(limiter.acquire("b"), 0)
+        self.assertEqual([limiter.acquire("a") for _ in range(3)], [0.0, 0.0, 0.0])
+
+    def test_full_shard_evicts_least_recently_used(self):
+        """Test a full shard drops the bucket used longest ago, not the one created first"""
+        limiter = RateLimiter(rate=2, burst=3, max_keys=2, shards=1, clock=self.clock)
+        limiter.acquire("a")
+        limiter.acquire("b")
+        limiter.acquire("a")
+        limiter.acquire("c")
+        self.assertEqual(limiter.stats()['evictions'], 1)
+        # "a" was used after "b", so it still has its bucket with one token left
+        self.assertEqual(limiter.acquire("a"), 0.0)
+        self.assertGreater(limiter.acquire("a"), 0)
+        self.assertEqual([limiter.acquire("b") for _ in range(3)], [0.0, 0.0, 0.0])
+
+    def test_stats(self):
+        """Test allowed and throttled requests are counted"""
+        for _ in range(5):
+            self.limiter.acquire("1001")
+        stats = self.limiter.stats()
+        self.assertEqual((stats['allowed'], stats['throttled'], stats['buckets']), (3, 2, 1))
+
+    def test_concurrent_acquires(self):
+        """Test threads sharing a key never get more than burst tokens without refill"""
+        limiter = RateLimiter(rate=1, burst=50, clock=self.clock)
+        granted = []
+
+        def worker():
+            granted.append(sum(1 for _ in range(100) if limiter.acquire("1001") == 0.0))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sum(granted), 50)
+
+    def test_invalid_settings(self):
+        """Test nonsensical limits are rejected"""
+        with self.assertRaises(ValueError):
+            RateLimiter(rate=0, burst=1)
+        with self.assertRaises(ValueError):
+            RateLimiter(rate=1, burst=0)
+        with self.assertRaises(ValueError):
+            RateLimiter(rate=1, burst=1, shards=3)
+        for rate, burst in ((float('nan'), 1), (1, float('nan')), (float('inf'), 1), (1, float('inf'))):
+            with self.assertRaises(ValueError):
+                RateLimiter(rate=rate, burst=burst)
+
+    def test_fractional_burst(self):
+        """Test a fractional burst caps the tokens a bucket banks"""
+        limiter = RateLimiter(rate=0.5, burst=1.5, clock=self.clock)
+        self.assertEqual(limiter.acquire("1001"), 0.0)
+        self.assertAlmostEqual(limiter.acquire("1001"), 1.0)
+        self.clock.now += 3600
+        self.assertEqual(limiter.acquire("1001"), 0.0)
+        self.assertAlmostEqual(limiter.acquire("1001"), 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,214 @@
+import unittest
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+
+# Add current directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from werkzeug.test import Client
+
+from sharding import HashRing, ShardPool, ShardRouter
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+HOST = 'atm-api-435429241525.us-central1.run.app'
+TOKEN = 'secret'
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_shard():
+    """Serve app.py with gunicorn, which keeps connections alive, on a free port"""
+    port = free_port()
+    env = dict({k: v for k, v in os.environ.items() if not k.startswith('ATM_')}, ATM_ADMIN_TOKEN=TOKEN)
+    process = subprocess.Popen(['gunicorn', '--bind', f'127.0.0.1:{port}', '--threads', '4', 'app:app'],
+                               cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError(f'gunicorn did not start on port {port}')
+
+
+def shard_call(url, method, path, body=None, content_type='application/json'):
+    pool = ShardPool(url)
+    status, _, _, data = pool.request(method, path, body, {'Host': HOST, 'Content-Type': content_type,
+                                                           'Authorization': f'Bearer {TOKEN}'})
+    pool.close()
+    return status, json.loads(data)
+
+
+class TestHashRing(unittest.TestCase):
+    """Unit tests for the consistent hash ring"""
+
+    def setUp(self):
+        self.keys = [str(10000000 + i) for i in range(20000)]
+
+    def test_spread(self):
+        """Test accounts are spread evenly and the same way by every ring"""
+        ring = HashRing(['a', 'b', 'c', 'd'])
+        counts = Counter(map(ring.node_for, self.keys))
+        self.assertEqual(set(counts), {'a', 'b', 'c', 'd'})
+        for count in counts.values():
+            self.assertLess(abs(count - 5000), 1000)
+        again = HashRing(['d', 'c', 'b', 'a'])
+        self.assertTrue(all(ring.node_for(key) == again.node_for(key) for key in self.keys[:1000]))
+
+    def test_adding_a_node_moves_only_its_share(self):
+        """Test a new node takes about 1/N of the accounts, all from other nodes"""
+        before = HashRing(['a', 'b', 'c', 'd'])
+        after = HashRing(['a', 'b', 'c', 'd', 'e'])
+        moved = [key for key in self.keys if before.node_for(key) != after.node_for(key)]
+        self.assertTrue(all(after.node_for(key) == 'e' for key in moved))
+        self.assertLess(abs(len(moved) - 4000), 800)
+
+    def test_removing_a_node_moves_only_its_accounts(self):
+        """Test only the removed node's accounts change owner"""
+        before = HashRing(['a', 'b', 'c'])
+        after = HashRing(['a', 'c'])
+        for key in self.keys:
+            if before.node_for(key) != 'b':
+                self.assertEqual(after.node_for(key), before.node_for(key))
+
+    def test_invalid_settings(self):
+        """Test rings without nodes or virtual nodes are rejected"""
+        with self.assertRaises(ValueError):
+            HashRing([])
+        with self.assertRaises(ValueError):
+            HashRing(['a'], vnodes=0)
+        with self.assertRaises(ValueError):
+            ShardPool('https://example.com')
+
+
+class TestShardRouter(unittest.TestCase):
+    """Tests for the router against real app.py shards"""
+
+    @classmethod
+    def setUpClass(cls):
+        started = [start_shard() for _ in range(3)]
+        cls.processes = [process for process, _ in started]
+        cls.urls = [url for _, url in started]
+
+    @classmethod
+    def tearDownClass(cls):
+        for process in cls.processes:
+            process.terminate()
+            process.wait()
+
+    def setUp(self):
+        self.router = ShardRouter(self.urls[:2], host=HOST, admin_token=TOKEN, shard_token=TOKEN)
+        self.client = Client(self.router)
+        self.headers = {'Host': HOST}
+        # Accounts 20000-20999 on the shard owning each, 10.00 apiece
+        self.numbers = [str(20000 + i) for i in range(1000)]
+        for url in self.urls:
+            owned = [n for n in self.numbers if self.router.ring.node_for(n) == url]
+            shard_call(url, 'POST', '/accounts/import?format=csv',
+                       ''.join(f'{n},10\n' for n in owned), 'text/csv')
+
+    def tearDown(self):
+        for pool in self.router.pools.values():
+            pool.close()
+
+    def test_forwards_to_owning_shard(self):
+        """Test a deposit through the router reaches only the account's shard"""
+        number = self.numbers[0]
+        owner = self.router.ring.node_for(number)
+        response = self.client.post(f'/accounts/{number}/deposit', json={"amount": 5}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['balance'], 15.0)
+        self.assertEqual(shard_call(owner, 'GET', f'/accounts/{number}/balance'),
+                         (200, {'account_number': number, 'balance': 15.0}))
+        balance = self.client.get(f'/accounts/{number}/balance', headers=self.headers)
+        self.assertEqual(balance.get_json(), {'account_number': number, 'balance': 15.0})
+        history = self.client.get(f'/accounts/{number}/transactions?limit=1', headers=self.headers)
+        self.assertEqual(history.get_json()['transactions'][0]['amount'], 5.0)
+
+    def test_shard_responses_pass_through(self):
+        """Test shard errors and headers come back unchanged"""
+        response = self.client.get('/accounts/29999/balance', headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.get_json(), {"error": "Account not found"})
+        headers = dict(self.headers, **{'Idempotency-Key': 'router-test'})
+        first = self.client.post(f'/accounts/{self.numbers[1]}/withdraw', json={"amount": 1}, headers=headers)
+        retry = self.client.post(f'/accounts/{self.numbers[1]}/withdraw', json={"amount": 1}, headers=headers)
+        self.assertEqual(retry.get_json(), first.get_json())
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+
+    def test_connections_are_reused(self):
+        """Test requests share pooled keep-alive connections"""
+        for number in self.numbers[:20]:
+            self.client.get(f'/accounts/{number}/balance', headers=self.headers)
+        connections = self.router.stats()['connections']
+        self.assertLessEqual(sum(c['created'] for c in connections.values()), 2)
+        self.assertGreaterEqual(sum(c['reused'] for c in connections.values()), 18)
+
+    def test_unrouted_paths(self):
+        """Test routes spanning several shards are not served"""
+        for path in ('/accounts/stats', '/accounts/batch', '/router/shards'):
+            response = self.client.get(path, headers=self.headers)
+            self.assertEqual(response.status_code, 401 if path == '/router/shards' else 404)
+
+    def test_unavailable_shard(self):
+        """Test a shard that cannot be reached gives 502"""
+        router = ShardRouter(['http://127.0.0.1:9'], host=HOST)
+        response = Client(router).get('/accounts/1001/balance', headers=self.headers)
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(response.get_json(), {"error": "Shard unavailable"})
+
+    def test_rebalance(self):
+        """Test adding a shard moves its accounts there without losing concurrent deposits"""
+        before = self.router.ring
+        stop = threading.Event()
+        deposits = []
+
+        def deposit():
+            while not stop.is_set():
+                response = self.client.post(f'/accounts/{self.numbers[len(deposits) % 50]}/deposit',
+                                            json={"amount": 1}, headers=self.headers)
+                deposits.append(response.status_code)
+
+        worker = threading.Thread(target=deposit)
+        worker.start()
+        response = self.client.put('/router/shards', json={"shards": self.urls},
+                                   headers=dict(self.headers, Authorization=f'Bearer {TOKEN}'))
+        stop.set()
+        worker.join()
+        self.assertEqual(response.status_code, 200)
+        result = response.get_json()
+        self.assertEqual(result['shards'], self.urls)
+        moved = [n for n in self.numbers if before.node_for(n) != self.router.ring.node_for(n)]
+        self.assertTrue(all(self.router.ring.node_for(n) == self.urls[2] for n in moved))
+        # Seeded accounts 1001-1003 move too if they now belong to the new shard
+        self.assertEqual(result['moved'], len(moved) + sum(
+            before.node_for(n) != self.router.ring.node_for(n) for n in ('1001', '1002', '1003')))
+        self.assertEqual(set(deposits), {200})
+        total = sum(self.client.get(f'/accounts/{n}/balance', headers=self.headers).get_json()['balance']
+                    for n in self.numbers)
+        self.assertEqual(total, 10 * len(self.numbers) + len(deposits))
+
+    def test_rebalance_requires_token(self):
+        """Test the admin route rejects wrong tokens and malformed shard lists"""
+        put = self.client.put
+        response = put('/router/shards', json={"shards": self.urls}, headers=dict(self.headers, Authorization='Bearer x'))
+        self.assertEqual(response.status_code, 401)
+        auth = dict(self.headers, Authorization=f'Bearer {TOKEN}')
+        for body in ({"shards": []}, {"shards": ["ftp://x"]}, {"urls": self.urls}):
+            self.assertEqual(put('/router/shards', json=body, headers=auth).status_code, 400)
+        self.assertEqual(self.router.ring.nodes, tuple(self.urls[:2]))
+
+
+if __name__ == '__main__':
+    unittest.main()
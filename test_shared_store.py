@@ -0,0 +1,149 @@
+import unittest
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+
+# Add current directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from shared_store import SharedAccountStore
+from store import MAX_CENTS, BalanceOverflowError
+
+
+def _deposit_worker(path, rounds):
+    store = SharedAccountStore(path)
+    for i in range(rounds):
+        store.deposit(("1001", "1002")[i % 2], 1)
+        store.withdraw("1003", 1)
+    store.close()
+
+
+class TestSharedAccountStore(unittest.TestCase):
+    """Unit tests for the shared-memory account store"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'accounts.shm')
+        self.store = SharedAccountStore(self.path, capacity=64,
+                                        balances={"1001": 50000, "1002": 100000, "1003": 75000})
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_basic_operations(self):
+        """Test lookup, deposit, withdraw and create on the shared table"""
+        self.assertEqual(len(self.store), 3)
+        self.assertIn("1002", self.store)
+        self.assertNotIn("9999", self.store)
+        self.assertEqual(self.store.deposit("1001", 150), 50150)
+        self.assertEqual(self.store.withdraw("1003", 80000), (False, 75000))
+        self.assertEqual(self.store.withdraw("1003", 75000), (True, 0))
+        self.assertTrue(self.store.create("1004", 9))
+        self.assertFalse(self.store.create("1004", 1))
+        self.assertEqual(dict(self.store.items()),
+                         {"1001": 50150, "1002": 100000, "1003": 0, "1004": 9})
+        with self.assertRaises(KeyError):
+            self.store.deposit("9999", 1)
+
+    def test_versions_and_apply_if(self):
+        """Test versions are shared through the file and apply_if checks them"""
+        self.assertEqual(self.store.get_versioned("1001"), (50000, 0))
+        self.store.deposit("1001", 1)
+        self.store.apply_batch([("1001", "withdraw", 1)], atomic=False)
+        other = SharedAccountStore(self.path)
+        self.assertEqual(other.get_versioned("1001"), (50000, 2))
+        self.assertEqual(other.apply_if("1001", "deposit", 5, {(1, 50000)}), (None, 50000))
+        self.assertEqual(other.apply_if("1001", "deposit", 5, {(2, 50000)}), (True, 50005))
+        other.close()
+        self.assertEqual(self.store.get_versioned("1001"), (50005, 3))
+        self.assertIsNone(self.store.get_versioned("9999"))
+
+    def test_overflow_writes_nothing(self):
+        """Test writes that would take a balance past int64 raise before changing anything"""
+        self.store.update({"1002": MAX_CENTS - 5})
+        with self.assertRaises(BalanceOverflowError):
+            self.store.deposit("1002", 6)
+        with self.assertRaises(BalanceOverflowError):
+            self.store.apply_batch([("1001", "deposit", 1), ("1002", "deposit", 6)], atomic=False)
+        with self.assertRaises(BalanceOverflowError):
+            self.store.transfer("1001", "1002", 6)
+        self.assertEqual(self.store.get_cents("1001"), 50000)
+        self.assertEqual(self.store.get_cents("1002"), MAX_CENTS - 5)
+
+    def test_update_and_capture(self):
+        """Test update reports created accounts and a capture ignores later writes"""
+        self.assertEqual(self.store.update({"1001": 1, "1004": 2}), 1)
+        pairs = self.store.capture()
+        self.store.deposit("1001", 5)
+        self.store.create("1005", 3)
+        self.assertEqual(dict(pairs), {"1001": 1, "1002": 100000, "1003": 75000, "1004": 2})
+
+    def test_capture_waits_for_transfers(self):
+        """Test a capture is not taken while a transfer holds its account locks"""
+        held = threading.Event()
+        release = threading.Event()
+        captured = []
+
+        def transfer():
+            # Stands in for a transfer between its two legs
+            with self.store.locks.hold_many(("1001", "1002")):
+                held.set()
+                release.wait(5)
+
+        def capture():
+            captured.append(dict(self.store.capture()))
+
+        writer = threading.Thread(target=transfer)
+        writer.start()
+        held.wait(5)
+        reader = threading.Thread(target=capture)
+        reader.start()
+        reader.join(0.1)
+        self.assertTrue(reader.is_alive())
+        release.set()
+        writer.join()
+        reader.join(5)
+        self.assertEqual(len(captured), 1)
+
+    def test_second_opener_attaches_without_reseeding(self):
+        """Test a second process-level handle sees the same balances"""
+        self.store.deposit("1001", 1)
+        other = SharedAccountStore(self.path, balances={"1001": 0})
+        self.assertEqual(other.get_cents("1001"), 50001)
+        other.withdraw("1001", 1)
+        self.assertEqual(self.store.get_cents("1001"), 50000)
+        other.close()
+
+    def test_capacity_is_enforced(self):
+        """Test inserts beyond the load limit are refused"""
+        with self.assertRaises(RuntimeError):
+            for i in range(64):
+                self.store.create(str(2000 + i), 0)
+        self.assertLessEqual(len(self.store), 64)
+
+    def test_apply_batch_atomic_rollback(self):
+        """Test an atomic batch with a failing operation writes nothing"""
+        results = self.store.apply_batch([("1001", "deposit", 100), ("1002", "withdraw", 10 ** 9)], atomic=True)
+        self.assertEqual(results, [(True, 50100), (False, 100000)])
+        self.assertEqual(self.store.get_cents("1001"), 50000)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'requires fork')
+    def test_concurrent_processes_lose_no_updates(self):
+        """Test updates from several processes are all applied"""
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=_deposit_worker, args=(self.path, 5000)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertTrue(all(process.exitcode == 0 for process in processes))
+        self.assertEqual(self.store.get_cents("1001"), 50000 + 10000)
+        self.assertEqual(self.store.get_cents("1002"), 100000 + 10000)
+        self.assertEqual(self.store.get_cents("1003"), 75000 - 20000)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
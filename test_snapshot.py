@@ -0,0 +1,117 @@
+import unittest
+import os
+import sys
+import tempfile
+import threading
+
+# Add current directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from journal import Journal, replay, segment_paths
+from snapshot import Snapshot, SnapshotWriter, write_snapshot
+from store import MemoryAccountStore
+
+
+class TestSnapshot(unittest.TestCase):
+    """Unit tests for the mmap snapshot format and snapshot-backed stores"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'accounts.snapshot')
+        write_snapshot(self.path, [("1003", 75000), ("1001", 50000), ("10020", 100000)])
+        self.snapshot = Snapshot(self.path)
+
+    def tearDown(self):
+        self.snapshot.close()
+        self.tmp.cleanup()
+
+    def test_lookup(self):
+        """Test binary search finds present keys and rejects missing ones"""
+        self.assertEqual(len(self.snapshot), 3)
+        self.assertEqual(self.snapshot.key_width, 5)
+        self.assertEqual(self.snapshot.get_cents("1001"), 50000)
+        self.assertEqual(self.snapshot.get_cents("10020"), 100000)
+        self.assertIsNone(self.snapshot.get_cents("1002"))
+        self.assertIsNone(self.snapshot.get_cents("100200"))
+        self.assertNotIn("9999", self.snapshot)
+
+    def test_items_sorted(self):
+        """Test iteration yields accounts in key order"""
+        self.assertEqual(list(self.snapshot.items()),
+                         [("1001", 50000), ("10020", 100000), ("1003", 75000)])
+
+    def test_rejects_other_files(self):
+        """Test opening a file that is not a snapshot raises ValueError"""
+        other = os.path.join(self.tmp.name, 'other')
+        with open(other, 'wb') as f:
+            f.write(b'\0' * 64)
+        with self.assertRaises(ValueError):
+            Snapshot(other)
+
+    def test_store_reads_through_and_promotes_on_write(self):
+        """Test a snapshot-backed store serves reads and copies accounts on write"""
+        store = MemoryAccountStore(base=self.snapshot)
+        self.assertEqual(len(store), 3)
+        self.assertIn("1003", store)
+        self.assertEqual(store.get_cents("1003"), 75000)
+        self.assertFalse(store.create("1003", 1))
+        self.assertEqual(store.deposit("1003", 500), 75500)
+        self.assertTrue(store.create("1004", 1))
+        self.assertEqual(len(store), 4)
+        self.assertEqual(dict(store.items()),
+                         {"1001": 50000, "10020": 100000, "1003": 75500, "1004": 1})
+        with self.assertRaises(KeyError):
+            store.deposit("9999", 1)
+
+    def test_writer_checkpoints_journal(self):
+        """Test the writer rotates the journal and restart recovers every write"""
+        journal_path = os.path.join(self.tmp.name, 'accounts.journal')
+        store = MemoryAccountStore(base=self.snapshot, journal=Journal(journal_path))
+        store.deposit("1001", 100)
+        writer = SnapshotWriter(store, self.path, interval=3600)
+        self.assertEqual(writer.write(), 3)
+        self.assertEqual(segment_paths(journal_path), [journal_path])
+        store.withdraw("1003", 75000)
+        store.journal.close()
+
+        restored = MemoryAccountStore(base=Snapshot(self.path))
+        for segment in segment_paths(journal_path):
+            restored.update(replay(segment))
+        self.assertEqual(dict(restored.items()), dict(store.items()))
+        restored.base.close()
+
+    def test_writer_without_journal_conserves_money(self):
+        """Test snapshots taken during atomic batches never hold half of one"""
+        store = MemoryAccountStore(base=self.snapshot)
+        total = sum(cents for _, cents in store.items())
+        numbers = ["1001", "10020", "1003"]
+        stop = threading.Event()
+
+        def transfer(offset):
+            i = 0
+            while not stop.is_set():
+                store.apply_batch([(numbers[(i + offset) % 3], 'withdraw', 1),
+                                   (numbers[(i + offset + 1) % 3], 'deposit', 1)], atomic=True)
+                i += 1
+
+        # Switch threads often so a copy is likely to land between two legs
+        self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+        sys.setswitchinterval(1e-6)
+        threads = [threading.Thread(target=transfer, args=(offset,)) for offset in range(2)]
+        for thread in threads:
+            thread.start()
+        path = os.path.join(self.tmp.name, 'copy.snapshot')
+        writer = SnapshotWriter(store, path, interval=3600)
+        try:
+            for _ in range(300):
+                writer.write()
+                copy = Snapshot(path)
+                self.assertEqual(sum(cents for _, cents in copy.items()), total)
+                copy.close()
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
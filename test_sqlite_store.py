@@ -0,0 +1,179 @@
+import unittest
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+
+# Add current directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from history import TransactionHistory
+from sqlite_store import SQLiteAccountStore
+from store import MAX_CENTS, BalanceOverflowError
+
+
+def _deposit_worker(path, rounds):
+    store = SQLiteAccountStore(path, synchronous='OFF')
+    for i in range(rounds):
+        store.deposit(("1001", "1002")[i % 2], 1)
+        store.withdraw("1003", 1)
+    store.close()
+
+
+class TestSQLiteAccountStore(unittest.TestCase):
+    """Unit tests for the SQLite account store"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'accounts.db')
+        self.store = SQLiteAccountStore(self.path, balances={"1001": 50000, "1002": 100000, "1003": 75000},
+                                        synchronous='OFF')
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_basic_operations(self):
+        """Test lookup, deposit, withdraw and create"""
+        self.assertEqual(len(self.store), 3)
+        self.assertIn("1002", self.store)
+        self.assertNotIn("9999", self.store)
+        self.assertEqual(self.store.deposit("1001", 150), 50150)
+        self.assertEqual(self.store.withdraw("1003", 80000), (False, 75000))
+        self.assertEqual(self.store.withdraw("1003", 75000), (True, 0))
+        self.assertTrue(self.store.create("1004", 9))
+        self.assertFalse(self.store.create("1004", 1))
+        self.assertEqual(dict(self.store.items()),
+                         {"1001": 50150, "1002": 100000, "1003": 0, "1004": 9})
+        with self.assertRaises(KeyError):
+            self.store.deposit("9999", 1)
+        with self.assertRaises(KeyError):
+            self.store.withdraw("9999", 1)
+
+    def test_transfer(self):
+        """Test transfers move money atomically and refuse overdrafts"""
+        self.assertEqual(self.store.transfer("1001", "1002", 100), (True, 49900, 100100))
+        self.assertEqual(self.store.transfer("1001", "1002", 10 ** 9), (False, 49900, None))
+        self.assertEqual(self.store.get_cents("1002"), 100100)
+        with self.assertRaises(KeyError):
+            self.store.transfer("1001", "9999", 1)
+        self.assertEqual(self.store.get_cents("1001"), 49900)
+
+    def test_apply_batch_atomic_rollback(self):
+        """Test an atomic batch with a failing operation writes nothing"""
+        results = self.store.apply_batch([("1001", "deposit", 100), ("1002", "withdraw", 10 ** 9)], atomic=True)
+        self.assertEqual(results, [(True, 50100), (False, 100000)])
+        self.assertEqual(self.store.get_cents("1001"), 50000)
+        results = self.store.apply_batch([("1001", "deposit", 100), ("1002", "withdraw", 10 ** 9),
+                                          ("1001", "withdraw", 50)], atomic=False)
+        self.assertEqual(results, [(True, 50100), (False, 100000), (True, 50050)])
+        self.assertEqual(self.store.get_cents("1001"), 50050)
+
+    def test_versions_and_apply_if(self):
+        """Test versions persist across reopening and apply_if checks them"""
+        self.assertEqual(self.store.get_versioned("1001"), (50000, 0))
+        self.store.deposit("1001", 1)
+        self.store.withdraw("1001", 1)
+        self.store.apply_batch([("1001", "deposit", 1)], atomic=False)
+        self.store.close()
+        self.store = SQLiteAccountStore(self.path, synchronous='OFF')
+        self.assertEqual(self.store.get_versioned("1001"), (50001, 3))
+        self.assertEqual(self.store.apply_if("1001", "withdraw", 1, {(2, 50001)}), (None, 50001))
+        self.assertEqual(self.store.apply_if("1001", "withdraw", 10 ** 9, {(3, 50001)}), (False, 50001))
+        self.assertEqual(self.store.apply_if("1001", "withdraw", 1, {(3, 50001)}), (True, 50000))
+        self.assertEqual(self.store.get_versioned("1001"), (50000, 4))
+        self.assertIsNone(self.store.get_versioned("9999"))
+
+    def test_adds_version_column_to_older_databases(self):
+        """Test a database created before balances were versioned is upgraded on open"""
+        self.store.close()
+        path = os.path.join(self.tmp.name, 'old.db')
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE accounts (account_number TEXT PRIMARY KEY, cents INTEGER NOT NULL) WITHOUT ROWID')
+        conn.execute("INSERT INTO accounts VALUES ('1001', 5)")
+        conn.commit()
+        conn.close()
+        self.store = SQLiteAccountStore(path, synchronous='OFF')
+        self.assertEqual(self.store.get_versioned("1001"), (5, 0))
+        self.assertEqual(self.store.deposit("1001", 1), 6)
+        self.assertEqual(self.store.get_versioned("1001"), (6, 1))
+
+    def test_overflow_writes_nothing(self):
+        """Test writes that would take a balance past int64 raise before changing anything"""
+        self.store.update({"1002": MAX_CENTS - 5})
+        with self.assertRaises(BalanceOverflowError):
+            self.store.deposit("1002", 6)
+        with self.assertRaises(BalanceOverflowError):
+            self.store.apply_batch([("1001", "deposit", 1), ("1002", "deposit", 6)], atomic=False)
+        with self.assertRaises(BalanceOverflowError):
+            self.store.transfer("1001", "1002", 6)
+        self.assertEqual(self.store.get_cents("1001"), 50000)
+        self.assertEqual(self.store.get_cents("1002"), MAX_CENTS - 5)
+
+    def test_update_and_capture(self):
+        """Test update reports created accounts and a capture ignores later writes"""
+        self.assertEqual(self.store.update({"1001": 1, "1004": 2}), 1)
+        pairs = self.store.capture()
+        self.store.deposit("1001", 5)
+        self.store.create("1005", 3)
+        self.assertEqual(dict(pairs), {"1001": 1, "1002": 100000, "1003": 75000, "1004": 2})
+
+    def test_reopen_keeps_balances_without_reseeding(self):
+        """Test balances persist and a second opener does not load the seed again"""
+        self.store.deposit("1001", 1)
+        self.store.close()
+        self.store = SQLiteAccountStore(self.path, balances={"1001": 0}, synchronous='OFF')
+        self.assertEqual(self.store.get_cents("1001"), 50001)
+        self.assertEqual(len(self.store), 3)
+
+    def test_history_is_in_balance_order(self):
+        """Test concurrent deposits are recorded in the order the balance changed"""
+        self.store.history = TransactionHistory(capacity=400)
+        threads = [threading.Thread(target=lambda: [self.store.deposit("1001", 1) for _ in range(100)])
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        balances = [record[4] for record in self.store.history.iter_records("1001")]
+        self.assertEqual(balances, list(range(50400, 50000, -1)))
+
+    def test_concurrent_withdrawals_never_overdraw(self):
+        """Test threads racing to withdraw get exactly the balance and no more"""
+        granted = []
+
+        def worker():
+            granted.append(sum(self.store.withdraw("1003", 1000)[0] for _ in range(30)))
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sum(granted), 75)
+        self.assertEqual(self.store.get_cents("1003"), 0)
+
+    def test_invalid_synchronous(self):
+        """Test unknown PRAGMA synchronous values are rejected"""
+        with self.assertRaises(ValueError):
+            SQLiteAccountStore(self.path, synchronous='SOMETIMES')
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'requires fork')
+    def test_concurrent_processes_lose_no_updates(self):
+        """Test updates from several processes are all applied"""
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=_deposit_worker, args=(self.path, 500)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertTrue(all(process.exitcode == 0 for process in processes))
+        self.assertEqual(self.store.get_cents("1001"), 50000 + 1000)
+        self.assertEqual(self.store.get_cents("1002"), 100000 + 1000)
+        self.assertEqual(self.store.get_cents("1003"), 75000 - 2000)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
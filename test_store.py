@@ -0,0 +1,168 @@
+import unittest
+import gc
+import os
+import sys
+import threading
+
+# Add current directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from balance_index import BalanceIndex
+from store import MAX_CENTS, AccountStore, BalanceOverflowError, MemoryAccountStore, from_cents, to_cents
+
+
+class TestMemoryAccountStore(unittest.TestCase):
+    """Unit tests for the compact in-memory account store"""
+
+    def setUp(self):
+        self.store = MemoryAccountStore({"1001": 50000, "1002": 100000})
+
+    def test_cents_conversion(self):
+        """Test dollar amounts round-trip through integer cents"""
+        self.assertEqual(to_cents(100.46), 10046)
+        self.assertEqual(to_cents(0.01), 1)
+        self.assertEqual(to_cents(999999.99), 99999999)
+        self.assertEqual(from_cents(60046), 600.46)
+
+    def test_lookup(self):
+        """Test membership, length and balance lookup"""
+        self.assertIn("1001", self.store)
+        self.assertNotIn("9999", self.store)
+        self.assertEqual(len(self.store), 2)
+        self.assertEqual(self.store.get_cents("1002"), 100000)
+        self.assertIsNone(self.store.get_cents("9999"))
+
+    def test_deposit_and_withdraw(self):
+        """Test deposits and withdrawals update the slot in place"""
+        self.assertEqual(self.store.deposit("1001", 150), 50150)
+        self.assertEqual(self.store.withdraw("1001", 50150), (True, 0))
+        self.assertEqual(self.store.withdraw("1001", 1), (False, 0))
+        self.assertEqual(self.store.get_cents("1001"), 0)
+
+    def test_create_and_update(self):
+        """Test create refuses duplicates and update overwrites"""
+        self.assertTrue(self.store.create("1003", 75000))
+        self.assertFalse(self.store.create("1003", 1))
+        self.assertEqual(self.store.update({"1003": 5, "1004": 6}), 1)
+        self.assertEqual(list(self.store.items()),
+                         [("1001", 50000), ("1002", 100000), ("1003", 5), ("1004", 6)])
+
+    def test_bulk_update_sets_off_no_full_collection(self):
+        """Test large updates leave nothing for the cyclic collector to promote"""
+        self.store.balance_index = BalanceIndex(self.store.items())
+        full = []
+
+        def record(phase, info):
+            if phase == 'start' and info['generation'] == 2:
+                full.append(info)
+
+        gc.collect()
+        gc.callbacks.append(record)
+        self.addCleanup(gc.callbacks.remove, record)
+        for start in range(0, 200000, 10000):
+            self.assertEqual(self.store.update({str(10000000 + start + i): i for i in range(10000)}), 10000)
+        self.assertEqual(full, [])
+        self.assertEqual(len(self.store.balance_index), len(self.store))
+
+    def test_capture_is_point_in_time(self):
+        """Test a capture ignores writes and new accounts made after it was taken"""
+        pairs = self.store.capture()
+        self.store.deposit("1001", 1)
+        self.store.create("1003", 7)
+        self.assertEqual(list(pairs), [("1001", 50000), ("1002", 100000)])
+
+    def test_capture_waits_for_transfers(self):
+        """Test a capture is not taken while a transfer holds its account locks"""
+        held = threading.Event()
+        release = threading.Event()
+        captured = []
+
+        def transfer():
+            # Stands in for a transfer between its two legs
+            with self.store.locks.hold_many(("1001", "1002")):
+                held.set()
+                release.wait(5)
+
+        def capture():
+            captured.append(list(self.store.capture()))
+
+        writer = threading.Thread(target=transfer)
+        writer.start()
+        held.wait(5)
+        reader = threading.Thread(target=capture)
+        reader.start()
+        reader.join(0.1)
+        self.assertTrue(reader.is_alive())
+        release.set()
+        writer.join()
+        reader.join(5)
+        self.assertEqual(len(captured), 1)
+
+    def test_apply_batch_atomic_rollback(self):
+        """Test an atomic batch with a failing operation writes nothing"""
+        results = self.store.apply_batch([("1001", "deposit", 100), ("1001", "withdraw", 60000)], atomic=True)
+        self.assertEqual(results, [(True, 50100), (False, 50100)])
+        self.assertEqual(self.store.get_cents("1001"), 50000)
+
+    def test_apply_batch_independent(self):
+        """Test an independent batch keeps the operations that succeeded"""
+        results = self.store.apply_batch([("1001", "withdraw", 60000), ("1002", "withdraw", 1)], atomic=False)
+        self.assertEqual(results, [(False, 50000), (True, 99999)])
+        self.assertEqual(self.store.get_cents("1002"), 99999)
+
+    def test_transfer(self):
+        """Test a transfer moves cents atomically or not at all"""
+        self.assertEqual(self.store.transfer("1001", "1002", 20000), (True, 30000, 120000))
+        self.assertEqual(self.store.transfer("1001", "1002", 30001), (False, 30000, None))
+        self.assertEqual(self.store.get_cents("1002"), 120000)
+
+    def test_generic_transfer_uses_atomic_batch(self):
+        """Test the AccountStore fallback transfer built on apply_batch"""
+        transfer = AccountStore.transfer
+        self.assertEqual(transfer(self.store, "1002", "1001", 100000), (True, 0, 150000))
+        self.assertEqual(transfer(self.store, "1002", "1001", 1), (False, 0, None))
+        self.assertEqual(self.store.get_cents("1001"), 150000)
+
+    def test_versions_and_apply_if(self):
+        """Test every balance change bumps the version and apply_if checks it under the lock"""
+        self.assertEqual(self.store.get_versioned("1001"), (50000, 0))
+        self.assertIsNone(self.store.get_versioned("9999"))
+        self.store.deposit("1001", 1)
+        self.store.withdraw("1001", 10 ** 9)
+        self.store.apply_batch([("1001", "withdraw", 1), ("1002", "deposit", 1)], atomic=True)
+        self.store.transfer("1002", "1001", 1)
+        self.assertEqual(self.store.get_versioned("1001"), (50001, 3))
+        self.assertEqual(self.store.apply_if("1001", "deposit", 5, {(2, 50001)}), (None, 50001))
+        self.assertEqual(self.store.apply_if("1001", "withdraw", 10 ** 9, {(3, 50001)}), (False, 50001))
+        self.assertEqual(self.store.apply_if("1001", "withdraw", 1, {(3, 50001)}), (True, 50000))
+        self.assertEqual(self.store.get_versioned("1001"), (50000, 4))
+        self.store.update({"1001": 7})
+        self.assertEqual(self.store.get_versioned("1001"), (7, 5))
+        with self.assertRaises(KeyError):
+            self.store.apply_if("9999", "deposit", 1, {(0, 0)})
+
+    def test_overflow_writes_nothing(self):
+        """Test writes that would take a balance past int64 raise before changing anything"""
+        self.store.update({"1002": MAX_CENTS - 5})
+        with self.assertRaises(BalanceOverflowError):
+            self.store.deposit("1002", 6)
+        with self.assertRaises(BalanceOverflowError):
+            self.store.apply_batch([("1001", "deposit", 1), ("1002", "deposit", 6)], atomic=False)
+        with self.assertRaises(BalanceOverflowError):
+            self.store.apply_if("1002", "deposit", 6, {(1, MAX_CENTS - 5)})
+        self.assertEqual(self.store.get_versioned("1001"), (50000, 0))
+        self.assertEqual(self.store.get_versioned("1002"), (MAX_CENTS - 5, 1))
+        with self.assertRaises(BalanceOverflowError):
+            self.store.transfer("1001", "1002", 6)
+        self.assertEqual(self.store.get_cents("1001"), 50000)
+
+    def test_clear_and_memory(self):
+        """Test clear empties the store and memory is reported"""
+        self.assertGreater(self.store.memory_bytes(), 0)
+        self.store.clear()
+        self.assertEqual(len(self.store), 0)
+        self.assertEqual(list(self.store.items()), [])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
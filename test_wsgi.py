@@ -0,0 +1,66 @@
+import unittest
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# Add current directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from werkzeug.test import Client
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+HOST = 'atm-api-435429241525.us-central1.run.app'
+
+# Runs in a fresh interpreter so that no earlier test has imported Flask
+COLD_START = r'''
+import json, sys
+sys.path.insert(0, {root!r})
+from werkzeug.test import Client
+from wsgi import application
+client = Client(application)
+headers = {{'Host': {host!r}}}
+balance = client.get('/accounts/1001/balance', headers=headers)
+deposit = client.post('/accounts/1001/deposit', data='{{"amount": 10}}',
+                      content_type='application/json', headers=headers)
+loaded_early = 'flask' in sys.modules
+docs = client.get('/docs', headers=headers)
+print(json.dumps({{'balance': balance.get_json(), 'deposit': deposit.get_json(), 'loaded_early': loaded_early,
+                  'docs': docs.status_code, 'loaded_late': 'flask' in sys.modules}}))
+'''
+
+
+class TestLazyApplication(unittest.TestCase):
+    """Tests for the fast-startup entry point in wsgi.py"""
+
+    def test_account_routes_do_not_import_flask(self):
+        """Test the account routes are served before Flask is imported, and /docs loads it"""
+        env = {k: v for k, v in os.environ.items() if not k.startswith('ATM_')}
+        output = subprocess.run([sys.executable, '-c', COLD_START.format(root=ROOT, host=HOST)],
+                                env=env, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output)
+        self.assertEqual(result['balance'], {'account_number': '1001', 'balance': 500.0})
+        self.assertEqual(result['deposit']['balance'], 510.0)
+        self.assertFalse(result['loaded_early'])
+        self.assertEqual(result['docs'], 200)
+        self.assertTrue(result['loaded_late'])
+
+    def test_pregenerated_openapi(self):
+        """Test /swagger.json is served from the exported file, identical to Flask's"""
+        from app import app, export_openapi
+        from fastpath import LazyApplication
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'swagger.json')
+            export_openapi(path)
+            client = Client(LazyApplication(HOST, openapi_path=path))
+            response = client.get('/swagger.json', headers={'Host': HOST})
+        expected = app.test_client().get('/swagger.json', headers={'Host': HOST})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, expected.data)
+        self.assertEqual(response.headers['Content-Type'], expected.headers['Content-Type'])
+
+
+if __name__ == '__main__':
+    unittest.main()
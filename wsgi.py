@@ -0,0 +1,13 @@
+"""Fast-startup WSGI entry point for production: gunicorn wsgi:application
+
+Serves the balance, deposit and withdraw routes without importing Flask and
+imports app.py only when another route is first requested, so a cold
+instance answers its first account request sooner. Set ATM_OPENAPI_PATH to a
+spec written by app.export_openapi() to serve /swagger.json from that file.
+"""
+import os
+
+from banking import SERVER_NAME
+from fastpath import LazyApplication
+
+application = LazyApplication(SERVER_NAME, openapi_path=os.environ.get("ATM_OPENAPI_PATH"))